@@ -0,0 +1,17 @@
+alter table song
+    add `file_size` bigint DEFAULT NULL,
+    add `mtime_ns` bigint DEFAULT NULL,
+    add `inode` bigint DEFAULT NULL
+;
+
+create table directory (
+    `directory_id` int NOT NULL AUTO_INCREMENT,
+    `library_id` int NOT NULL,
+    `dir_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    `mtime_ns` bigint NOT NULL,
+    `inode` bigint NOT NULL,
+    PRIMARY KEY (`directory_id`),
+    UNIQUE KEY `u_directory_1` (`library_id`, `dir_path`),
+    CONSTRAINT `directory_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+;
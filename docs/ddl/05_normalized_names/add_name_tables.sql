@@ -0,0 +1,43 @@
+-- Names are compared exactly (utf8mb4_bin) so that they match the in-process interning cache.
+create table artist (
+    `artist_id` int NOT NULL AUTO_INCREMENT,
+    `name` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    PRIMARY KEY (`artist_id`),
+    UNIQUE KEY `u_artist_1` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+;
+
+-- An album belongs to its album artist, or to the track artist when the album artist is not tagged.
+create table album (
+    `album_id` int NOT NULL AUTO_INCREMENT,
+    `artist_id` int NOT NULL,
+    `name` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    PRIMARY KEY (`album_id`),
+    UNIQUE KEY `u_album_1` (`artist_id`, `name`),
+    CONSTRAINT `album_ibfk_1` FOREIGN KEY (`artist_id`) REFERENCES `artist` (`artist_id`) ON DELETE RESTRICT ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+;
+
+create table genre (
+    `genre_id` int NOT NULL AUTO_INCREMENT,
+    `name` varchar(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    PRIMARY KEY (`genre_id`),
+    UNIQUE KEY `u_genre_1` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+;
+
+alter table song
+    add `artist_id` int DEFAULT NULL,
+    add `album_artist_id` int DEFAULT NULL,
+    add `album_id` int DEFAULT NULL,
+    add `genre_id` int DEFAULT NULL,
+    -- Browse queries (albums of an artist, tracks of an album, artists of a genre) are covered by these.
+    add KEY `i_song_6` (`library_id`, `artist_id`, `album_id`, `disc_number`, `track_number`),
+    add KEY `i_song_7` (`album_id`, `disc_number`, `track_number`),
+    add KEY `i_song_8` (`genre_id`, `artist_id`),
+    add KEY `f_song_2` (`album_artist_id`),
+    add CONSTRAINT `song_ibfk_2` FOREIGN KEY (`artist_id`) REFERENCES `artist` (`artist_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+    add CONSTRAINT `song_ibfk_3` FOREIGN KEY (`album_artist_id`) REFERENCES `artist` (`artist_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+    add CONSTRAINT `song_ibfk_4` FOREIGN KEY (`album_id`) REFERENCES `album` (`album_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+    add CONSTRAINT `song_ibfk_5` FOREIGN KEY (`genre_id`) REFERENCES `genre` (`genre_id`) ON DELETE RESTRICT ON UPDATE CASCADE
+;
@@ -0,0 +1,8 @@
+-- Optional: once browsing goes through the id columns, the indexes on the inline name strings are redundant.
+-- The inline columns themselves stay as the display values.
+alter table song
+    drop index `i_song_2`,
+    drop index `i_song_3`,
+    drop index `i_song_4`,
+    drop index `i_song_5`
+;
@@ -0,0 +1,29 @@
+-- Fill the name tables from existing rows. Run with NORMALIZE_NAMES=1 afterwards so that syncs keep the ids set.
+-- Trailing spaces are not significant for the (PAD SPACE) keys, so names are stored trimmed like the sync does.
+insert ignore into artist (name)
+    select distinct trim(trailing ' ' from artist) from song
+    union
+    select distinct trim(trailing ' ' from album_artist) from song where album_artist is not null
+;
+
+insert ignore into album (artist_id, name)
+    select distinct a.artist_id, trim(trailing ' ' from s.album)
+    from song s
+    join artist a on a.name = trim(trailing ' ' from coalesce(s.album_artist, s.artist))
+;
+
+insert ignore into genre (name)
+    select distinct trim(trailing ' ' from genre) from song
+;
+
+update song s
+    join artist a on a.name = trim(trailing ' ' from s.artist)
+    left join artist aa on aa.name = trim(trailing ' ' from s.album_artist)
+    join album al on al.artist_id = coalesce(aa.artist_id, a.artist_id) and al.name = trim(trailing ' ' from s.album)
+    join genre g on g.name = trim(trailing ' ' from s.genre)
+set
+    s.artist_id = a.artist_id,
+    s.album_artist_id = aa.artist_id,
+    s.album_id = al.album_id,
+    s.genre_id = g.genre_id
+;
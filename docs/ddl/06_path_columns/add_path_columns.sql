@@ -0,0 +1,21 @@
+alter table song
+    add `dir_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin DEFAULT NULL after `file_path`,
+    add `file_path_hash` bigint DEFAULT NULL after `dir_path`
+;
+
+-- dir_path is the parent directory relative to the library, '.' for files at the top level.
+-- file_path_hash must match kyofu.util.path_hash: the first 8 bytes of the SHA-256 of the UTF-8 path, as a
+-- big-endian integer with the top bit cleared.
+update song set
+    dir_path = if(locate('/', file_path) = 0, '.',
+                  left(file_path, char_length(file_path) - char_length(substring_index(file_path, '/', -1)) - 1)),
+    file_path_hash = cast(conv(left(sha2(file_path, 256), 16), 16, 10) as unsigned) & 0x7FFFFFFFFFFFFFFF
+;
+
+-- Subtree scans (scan --path-hint, update) are range scans on i_song_9; exact lookups use i_song_10.
+alter table song
+    modify `dir_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    modify `file_path_hash` bigint NOT NULL,
+    add KEY `i_song_9` (`library_id`, `dir_path`),
+    add KEY `i_song_10` (`library_id`, `file_path_hash`)
+;
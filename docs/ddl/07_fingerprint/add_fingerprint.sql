@@ -0,0 +1,6 @@
+-- Content fingerprint used to detect moved files, see kyofu.fingerprint. Existing rows stay NULL, and so are
+-- not matched, until they are rewritten, e.g. by `scan --overwrite-song`.
+alter table song
+    add `fingerprint` bigint DEFAULT NULL after `inode`,
+    add KEY `i_song_11` (`library_id`, `fingerprint`)
+;
@@ -0,0 +1,5 @@
+-- Digest of the values a sync reads from each file, see kyofu.bulk.song_digest. `scan --overwrite-song` skips
+-- rows whose digest is unchanged; rows with a NULL digest are rewritten once by the next overwrite scan.
+alter table song
+    add `metadata_digest` bigint DEFAULT NULL after `fingerprint`
+;
@@ -0,0 +1,42 @@
+-- Album and artist summaries for browsing. Required before upgrading: every sync writes to these tables and
+-- fails without them. Fill them for existing libraries with `kyofu rebuild-aggregates LIBRARY` or the
+-- statements below.
+create table album_summary (
+    `album_summary_id` int NOT NULL AUTO_INCREMENT,
+    `library_id` int NOT NULL,
+    `artist` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    `album` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    `track_count` int NOT NULL,
+    `disc_count` smallint NOT NULL,
+    `min_year` smallint NOT NULL,
+    `max_year` smallint NOT NULL,
+    PRIMARY KEY (`album_summary_id`),
+    UNIQUE KEY `u_album_summary_1` (`library_id`, `artist`, `album`),
+    CONSTRAINT `album_summary_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+;
+
+create table artist_summary (
+    `artist_summary_id` int NOT NULL AUTO_INCREMENT,
+    `library_id` int NOT NULL,
+    `artist` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    `album_count` int NOT NULL,
+    `track_count` int NOT NULL,
+    PRIMARY KEY (`artist_summary_id`),
+    UNIQUE KEY `u_artist_summary_1` (`library_id`, `artist`),
+    CONSTRAINT `artist_summary_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+;
+
+insert into album_summary (library_id, artist, album, track_count, disc_count, min_year, max_year)
+    select library_id, coalesce(album_artist, artist), album, count(*), count(distinct disc_number),
+        min(release_year), max(release_year)
+    from song
+    group by library_id, coalesce(album_artist, artist), album
+;
+
+insert into artist_summary (library_id, artist, album_count, track_count)
+    select library_id, artist, count(*), sum(track_count)
+    from album_summary
+    group by library_id, artist
+;
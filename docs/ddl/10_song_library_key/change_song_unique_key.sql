@@ -0,0 +1,6 @@
+-- File paths are relative to their library, so only the pair has to be unique. The old key let a sync of one
+-- library overwrite the row of another library's file at the same relative path.
+alter table song
+    drop index `u_song_1`,
+    add unique index `u_song_1` (`library_id`, `file_path`)
+;
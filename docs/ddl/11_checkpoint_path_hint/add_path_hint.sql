@@ -0,0 +1,4 @@
+-- The path hints of the scan that wrote the checkpoint, so that `scan --resume` only continues the same scan.
+alter table sync_checkpoint
+    add `path_hint` varchar(2000) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin DEFAULT NULL after `last_path`
+;
@@ -24,6 +24,113 @@
 /*!50717 EXECUTE s */;
 /*!50717 DEALLOCATE PREPARE s */;
 
+--
+-- Table structure for table `album`
+--
+
+DROP TABLE IF EXISTS `album`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `album` (
+  `album_id` int NOT NULL AUTO_INCREMENT,
+  `artist_id` int NOT NULL,
+  `name` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  PRIMARY KEY (`album_id`),
+  UNIQUE KEY `u_album_1` (`artist_id`,`name`),
+  CONSTRAINT `album_ibfk_1` FOREIGN KEY (`artist_id`) REFERENCES `artist` (`artist_id`) ON DELETE RESTRICT ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `album_summary`
+--
+
+DROP TABLE IF EXISTS `album_summary`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `album_summary` (
+  `album_summary_id` int NOT NULL AUTO_INCREMENT,
+  `library_id` int NOT NULL,
+  `artist` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+  `album` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+  `track_count` int NOT NULL,
+  `disc_count` smallint NOT NULL,
+  `min_year` smallint NOT NULL,
+  `max_year` smallint NOT NULL,
+  PRIMARY KEY (`album_summary_id`),
+  UNIQUE KEY `u_album_summary_1` (`library_id`,`artist`,`album`),
+  CONSTRAINT `album_summary_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `artist`
+--
+
+DROP TABLE IF EXISTS `artist`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `artist` (
+  `artist_id` int NOT NULL AUTO_INCREMENT,
+  `name` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  PRIMARY KEY (`artist_id`),
+  UNIQUE KEY `u_artist_1` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `artist_summary`
+--
+
+DROP TABLE IF EXISTS `artist_summary`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `artist_summary` (
+  `artist_summary_id` int NOT NULL AUTO_INCREMENT,
+  `library_id` int NOT NULL,
+  `artist` varchar(200) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+  `album_count` int NOT NULL,
+  `track_count` int NOT NULL,
+  PRIMARY KEY (`artist_summary_id`),
+  UNIQUE KEY `u_artist_summary_1` (`library_id`,`artist`),
+  CONSTRAINT `artist_summary_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `directory`
+--
+
+DROP TABLE IF EXISTS `directory`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `directory` (
+  `directory_id` int NOT NULL AUTO_INCREMENT,
+  `library_id` int NOT NULL,
+  `dir_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  `mtime_ns` bigint NOT NULL,
+  `inode` bigint NOT NULL,
+  PRIMARY KEY (`directory_id`),
+  UNIQUE KEY `u_directory_1` (`library_id`,`dir_path`),
+  CONSTRAINT `directory_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `genre`
+--
+
+DROP TABLE IF EXISTS `genre`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `genre` (
+  `genre_id` int NOT NULL AUTO_INCREMENT,
+  `name` varchar(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  PRIMARY KEY (`genre_id`),
+  UNIQUE KEY `u_genre_1` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `library`
 --
@@ -60,15 +167,54 @@ CREATE TABLE `song` (
   `release_year` smallint NOT NULL,
   `modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `file_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  `dir_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  `file_path_hash` bigint NOT NULL,
+  `file_size` bigint DEFAULT NULL,
+  `mtime_ns` bigint DEFAULT NULL,
+  `inode` bigint DEFAULT NULL,
+  `fingerprint` bigint DEFAULT NULL,
+  `metadata_digest` bigint DEFAULT NULL,
+  `artist_id` int DEFAULT NULL,
+  `album_artist_id` int DEFAULT NULL,
+  `album_id` int DEFAULT NULL,
+  `genre_id` int DEFAULT NULL,
   PRIMARY KEY (`song_id`),
-  UNIQUE KEY `u_song_1` (`file_path`),
+  UNIQUE KEY `u_song_1` (`library_id`,`file_path`),
   KEY `i_song_1` (`title`),
   KEY `i_song_2` (`album`),
   KEY `i_song_3` (`artist`),
   KEY `i_song_4` (`album_artist`),
   KEY `i_song_5` (`genre`),
   KEY `f_song_1` (`library_id`),
-  CONSTRAINT `song_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE RESTRICT ON UPDATE CASCADE
+  KEY `i_song_6` (`library_id`,`artist_id`,`album_id`,`disc_number`,`track_number`),
+  KEY `i_song_7` (`album_id`,`disc_number`,`track_number`),
+  KEY `i_song_8` (`genre_id`,`artist_id`),
+  KEY `f_song_2` (`album_artist_id`),
+  KEY `i_song_9` (`library_id`,`dir_path`),
+  KEY `i_song_10` (`library_id`,`file_path_hash`),
+  KEY `i_song_11` (`library_id`,`fingerprint`),
+  CONSTRAINT `song_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+  CONSTRAINT `song_ibfk_2` FOREIGN KEY (`artist_id`) REFERENCES `artist` (`artist_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+  CONSTRAINT `song_ibfk_3` FOREIGN KEY (`album_artist_id`) REFERENCES `artist` (`artist_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+  CONSTRAINT `song_ibfk_4` FOREIGN KEY (`album_id`) REFERENCES `album` (`album_id`) ON DELETE RESTRICT ON UPDATE CASCADE,
+  CONSTRAINT `song_ibfk_5` FOREIGN KEY (`genre_id`) REFERENCES `genre` (`genre_id`) ON DELETE RESTRICT ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `sync_checkpoint`
+--
+
+DROP TABLE IF EXISTS `sync_checkpoint`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `sync_checkpoint` (
+  `library_id` int NOT NULL,
+  `last_path` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  `path_hint` varchar(2000) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin DEFAULT NULL,
+  `updated` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`library_id`),
+  CONSTRAINT `sync_checkpoint_ibfk_1` FOREIGN KEY (`library_id`) REFERENCES `library` (`library_id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!50112 SET @disable_bulk_load = IF (@is_rocksdb_supported, 'SET SESSION rocksdb_bulk_load = @old_rocksdb_bulk_load', 'SET @dummy_rocksdb_bulk_load = 0') */;
@@ -1,35 +1,55 @@
+import threading
 from logging import getLogger
-from logging.config import dictConfig
-from types import MethodType
 
-from kyofu.config import logger_config
-from kyofu.model import sqla_metadata
-from kyofu.setup import setup_database_connection
-
-dictConfig(logger_config)
+# Importing the package must stay cheap: worker processes and the metadata CLI only need the parsing code.
+# The engine and session are created on first access of kyofu.engine / kyofu.session.
 
 logger = getLogger(__name__)
-engine, session = setup_database_connection()
 
 current_config = {
     'auto_commit': False,
 }
 
+_database = None
+_database_lock = threading.Lock()
+
+
+def configure_logging(handler: str = 'stdout') -> None:
+    from copy import deepcopy
+    from logging.config import dictConfig
+    from kyofu.config import logger_config
+
+    config = deepcopy(logger_config)
+    config['loggers']['kyofu']['handlers'] = [handler]
+    dictConfig(config)
+
 
-def safe_commit(self, force: bool = False):
+def confirm_commit() -> bool:
     from kyofu.util import show_proceed_prompt
 
-    auto_commit = current_config.get('auto_commit', False)
-    if auto_commit or force:
-        self.kyofu_commit()
-    else:
-        if self.new or self.dirty or self.deleted:
-            if show_proceed_prompt('Commit?'):
-                self.kyofu_commit()
-            else:
-                self.rollback()
+    # Long running syncs commit periodically, so ask once before starting instead of at the end.
+    if not current_config.get('auto_commit', False):
+        current_config['auto_commit'] = show_proceed_prompt('Commit?')
+    return current_config['auto_commit']
+
+
+def _connect():
+    global _database
+
+    with _database_lock:
+        if _database is None:
+            from kyofu.model import sqla_metadata
+            from kyofu.setup import setup_database_connection
+
+            engine, session = setup_database_connection()
+            sqla_metadata.bind = engine
+            _database = engine, session
+    return _database
 
 
-session.kyofu_commit = session.commit
-session.commit = MethodType(safe_commit, session)
-sqla_metadata.bind = engine
+def __getattr__(name: str):
+    if name == 'engine':
+        return _connect()[0]
+    elif name == 'session':
+        return _connect()[1]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
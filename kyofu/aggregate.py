@@ -0,0 +1,148 @@
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from kyofu.model import AlbumSummary, ArtistSummary, Song
+
+# Per library album and artist summaries for browsing, so that listing albums does not group the whole song
+# table. Writers collect the album keys they touch, before and after each write, and recompute just those
+# albums in the same transaction; the artist rows are recomputed from the album rows of the touched artists.
+#
+# An album belongs to its album artist, or to the track artist when the album artist is not tagged, like the
+# album name table of NORMALIZE_NAMES.
+
+AlbumKey = Tuple[int, str, str]
+
+
+def _album_artist():
+    from sqlalchemy import func
+
+    return func.coalesce(Song.album_artist, Song.artist)
+
+
+def album_key(row: Dict) -> AlbumKey:
+    return row['library_id'], row['album_artist'] or row['artist'], row['album']
+
+
+def song_album_keys(session, condition) -> Set[AlbumKey]:
+    from sqlalchemy import select
+
+    query = select(Song.library_id, _album_artist(), Song.album).where(condition).distinct()
+    return {tuple(k) for k in session.execute(query)}
+
+
+def _album_select(condition):
+    from sqlalchemy import distinct, func, select
+
+    artist = _album_artist()
+    query = select(Song.library_id, artist, Song.album, func.count(), func.count(distinct(Song.disc_number)),
+                   func.min(Song.release_year), func.max(Song.release_year))
+    return query.where(condition).group_by(Song.library_id, artist, Song.album)
+
+
+def _artist_select(condition):
+    from sqlalchemy import func, select
+
+    query = select(AlbumSummary.library_id, AlbumSummary.artist, func.count(), func.sum(AlbumSummary.track_count))
+    return query.where(condition).group_by(AlbumSummary.library_id, AlbumSummary.artist)
+
+
+_ALBUM_COLUMNS = ['library_id', 'artist', 'album', 'track_count', 'disc_count', 'min_year', 'max_year']
+_ARTIST_COLUMNS = ['library_id', 'artist', 'album_count', 'track_count']
+
+
+def refresh_aggregates(session, keys: Iterable[AlbumKey], batch_size: Optional[int] = None) -> int:
+    from sqlalchemy import delete, insert, tuple_
+    from kyofu.bulk import mark_pending_writes
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    albums = AlbumSummary.__table__
+    artists = ArtistSummary.__table__
+    count = 0
+    for chunk in chunked(sorted(set(keys)), batch_size or DB_BATCH_SIZE):
+        # The plain IN on album lets the song side use its album index; the row IN picks the exact keys.
+        condition = Song.library_id.in_({k[0] for k in chunk}) & Song.album.in_({k[2] for k in chunk})
+        condition &= tuple_(Song.library_id, _album_artist(), Song.album).in_(chunk)
+        session.execute(delete(albums).where(tuple_(albums.c.library_id, albums.c.artist, albums.c.album).in_(chunk)))
+        session.execute(insert(albums).from_select(_ALBUM_COLUMNS, _album_select(condition)))
+
+        artist_keys = sorted({(k[0], k[1]) for k in chunk})
+        session.execute(delete(artists).where(tuple_(artists.c.library_id, artists.c.artist).in_(artist_keys)))
+        condition = tuple_(AlbumSummary.library_id, AlbumSummary.artist).in_(artist_keys)
+        session.execute(insert(artists).from_select(_ARTIST_COLUMNS, _artist_select(condition)))
+        mark_pending_writes(session)
+        count += len(chunk)
+    return count
+
+
+def _summaries(session, library_id: int) -> Tuple[Set[Tuple], Set[Tuple]]:
+    from sqlalchemy import select
+
+    albums = session.execute(select(*(AlbumSummary.__table__.c[c] for c in _ALBUM_COLUMNS))
+                             .where(AlbumSummary.library_id == library_id))
+    artists = session.execute(select(*(ArtistSummary.__table__.c[c] for c in _ARTIST_COLUMNS))
+                              .where(ArtistSummary.library_id == library_id))
+    return {tuple(r) for r in albums}, {tuple(r) for r in artists}
+
+
+def rebuild_aggregates(session, library_id: int) -> Dict[str, int]:
+    from sqlalchemy import delete, insert
+    from kyofu.bulk import mark_pending_writes
+
+    # Recomputes every summary row of the library and reports how many of the stored rows were off.
+    before = _summaries(session, library_id)
+    session.execute(delete(AlbumSummary.__table__).where(AlbumSummary.library_id == library_id))
+    session.execute(delete(ArtistSummary.__table__).where(ArtistSummary.library_id == library_id))
+    session.execute(insert(AlbumSummary.__table__).from_select(
+        _ALBUM_COLUMNS, _album_select(Song.library_id == library_id)))
+    session.execute(insert(ArtistSummary.__table__).from_select(
+        _ARTIST_COLUMNS, _artist_select(AlbumSummary.library_id == library_id)))
+    mark_pending_writes(session)
+    after = _summaries(session, library_id)
+    return {
+        'albums': len(after[0]),
+        'artists': len(after[1]),
+        'differences': len(before[0] ^ after[0]) + len(before[1] ^ after[1]),
+    }
+
+
+class AggregateTracker:
+    def __init__(self, batch_size: Optional[int] = None):
+        from kyofu.config import DB_BATCH_SIZE
+
+        self.batch_size = batch_size or DB_BATCH_SIZE
+        self.keys: Set[AlbumKey] = set()
+
+    def rows(self, rows: Iterable[Dict]) -> None:
+        self.keys.update(album_key(r) for r in rows)
+
+    def existing_paths(self, session, rows: Iterable[Dict]) -> None:
+        from kyofu.util import chunked
+
+        # The albums the rows at these paths belonged to before they are overwritten.
+        by_library = {}
+        for row in rows:
+            by_library.setdefault(row['library_id'], set()).add(row['file_path_hash'])
+        for library_id, hashes in by_library.items():
+            for chunk in chunked(hashes, self.batch_size):
+                condition = (Song.library_id == library_id) & Song.file_path_hash.in_(chunk)
+                self.keys.update(song_album_keys(session, condition))
+
+    def existing_songs(self, session, song_ids: Iterable[int]) -> None:
+        from kyofu.util import chunked
+
+        for chunk in chunked(song_ids, self.batch_size):
+            self.keys.update(song_album_keys(session, Song.song_id.in_(chunk)))
+
+    def flush(self, session) -> int:
+        from kyofu.stats import stats
+
+        if not self.keys:
+            return 0
+        with stats.timer('db.aggregate_seconds'):
+            count = refresh_aggregates(session, self.keys, self.batch_size)
+        stats.count('db.aggregate_albums', count)
+        self.keys = set()
+        return count
+
+    def discard(self) -> None:
+        self.keys = set()
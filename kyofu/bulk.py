@@ -0,0 +1,320 @@
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from kyofu.model import Song
+
+if TYPE_CHECKING:
+    from kyofu.aggregate import AggregateTracker
+    from kyofu.names import NameResolver
+    from kyofu.search import SearchDelta
+
+PENDING_WRITES_KEY = 'kyofu_pending_writes'
+
+SONG_KEY_COLUMN = 'file_path'
+SONG_UNIQUE_COLUMNS = ('library_id', SONG_KEY_COLUMN)
+SONG_UPDATE_COLUMNS = (
+    'title',
+    'album',
+    'artist',
+    'album_artist',
+    'genre',
+    'track_number',
+    'disc_number',
+    'release_year',
+    'modified',
+    'file_size',
+    'mtime_ns',
+    'inode',
+    'fingerprint',
+    'metadata_digest',
+    'artist_id',
+    'album_artist_id',
+    'album_id',
+    'genre_id',
+)
+
+
+# Everything a sync writes that is read from the file; the path and name id columns are derived from these.
+# The fingerprint is left out: it only changes with the stat columns, and an overwrite scan compares digests
+# before it decides to read the content of a file.
+SONG_DIGEST_COLUMNS = (
+    'title',
+    'album',
+    'artist',
+    'album_artist',
+    'genre',
+    'track_number',
+    'disc_number',
+    'release_year',
+    'modified',
+    'file_size',
+    'mtime_ns',
+    'inode',
+)
+
+
+def song_digest(row: Dict) -> int:
+    from hashlib import sha256
+
+    # Compared with the stored digest only, so repr of the values is stable enough.
+    data = repr(tuple(row.get(c) for c in SONG_DIGEST_COLUMNS)).encode()
+    return int.from_bytes(sha256(data).digest()[:8], 'big') & 0x7FFFFFFFFFFFFFFF
+
+
+def mark_pending_writes(session) -> None:
+    session.info[PENDING_WRITES_KEY] = True
+
+
+def has_pending_writes(session) -> bool:
+    return session.info.get(PENDING_WRITES_KEY, False)
+
+
+def clear_pending_writes(session) -> None:
+    session.info.pop(PENDING_WRITES_KEY, None)
+
+
+def _update_columns(rows: List[Dict]) -> List[str]:
+    # The name id columns are only present when NORMALIZE_NAMES is enabled.
+    return [c for c in SONG_UPDATE_COLUMNS if c in rows[0]]
+
+
+def song_upsert_statement(dialect_name: str, rows: List[Dict]):
+    table = Song.__table__
+    if dialect_name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(table).values(rows)
+        return statement.on_duplicate_key_update({c: statement.inserted[c] for c in _update_columns(rows)})
+    elif dialect_name in ('sqlite', 'postgresql'):
+        if dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(table).values(rows)
+        return statement.on_conflict_do_update(
+            index_elements=list(SONG_UNIQUE_COLUMNS),
+            set_={c: statement.excluded[c] for c in _update_columns(rows)},
+        )
+    return None
+
+
+def insert_ignore_statement(dialect_name: str, table):
+    from sqlalchemy import insert
+
+    if dialect_name == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    elif dialect_name in ('sqlite', 'postgresql'):
+        if dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        return insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def _generic_upsert(session, rows: List[Dict]) -> None:
+    from sqlalchemy import and_, bindparam, insert, select, tuple_, update
+
+    table = Song.__table__
+    keys = [table.c[c] for c in SONG_UNIQUE_COLUMNS]
+    query = select(*keys).where(tuple_(*keys).in_([tuple(r[c] for c in SONG_UNIQUE_COLUMNS) for r in rows]))
+    existing = {tuple(key) for key in session.execute(query)}
+
+    def key_of(row):
+        return tuple(row[c] for c in SONG_UNIQUE_COLUMNS)
+
+    update_rows = [{f'b_{k}': v for k, v in r.items()} for r in rows if key_of(r) in existing]
+    insert_rows = [r for r in rows if key_of(r) not in existing]
+    if update_rows:
+        statement = update(table).where(and_(*(key == bindparam(f'b_{key.name}') for key in keys)))
+        statement = statement.values({c: bindparam(f'b_{c}') for c in _update_columns(rows)})
+        session.execute(statement, update_rows)
+    if insert_rows:
+        session.execute(insert(table).values(insert_rows))
+
+
+def upsert_songs(session, rows: Iterable[Dict], batch_size: Optional[int] = None) -> int:
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    batch_size = batch_size or DB_BATCH_SIZE
+    dialect_name = session.get_bind().dialect.name
+    count = 0
+    for batch in chunked(rows, batch_size):
+        statement = song_upsert_statement(dialect_name, batch)
+        if statement is None:
+            _generic_upsert(session, batch)
+        else:
+            session.execute(statement)
+        mark_pending_writes(session)
+        count += len(batch)
+    return count
+
+
+def move_songs(session, rows: Iterable[Dict], batch_size: Optional[int] = None) -> int:
+    from sqlalchemy import bindparam, update
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    # Rewrites the path of an existing song_id in place, so a moved file keeps its id and no index entry
+    # other than the path ones is touched. Bind names are prefixed as they may not shadow column names.
+    table = Song.__table__
+    count = 0
+    for batch in chunked(rows, batch_size or DB_BATCH_SIZE):
+        columns = [SONG_KEY_COLUMN, 'dir_path', 'file_path_hash'] + _update_columns(batch)
+        statement = update(table).where(table.c.song_id == bindparam('_song_id'))
+        statement = statement.values({c: bindparam(f'_{c}') for c in columns})
+        session.execute(statement, [{f'_{c}': row.get(c) for c in ['song_id'] + columns} for row in batch])
+        mark_pending_writes(session)
+        count += len(batch)
+    return count
+
+
+def rename_songs(session, renames: Iterable[Tuple[int, str]], batch_size: Optional[int] = None) -> int:
+    from sqlalchemy import bindparam, update
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    # Only the path columns; a renamed file keeps its content, stat and tags. Rows run in the given order,
+    # so a chain of renames through the same path is applied correctly.
+    table = Song.__table__
+    columns = [SONG_KEY_COLUMN, 'dir_path', 'file_path_hash']
+    statement = update(table).where(table.c.song_id == bindparam('_song_id'))
+    statement = statement.values({c: bindparam(f'_{c}') for c in columns})
+    count = 0
+    for batch in chunked(renames, batch_size or DB_BATCH_SIZE):
+        params = []
+        for song_id, file_path in batch:
+            values = dict(Song.path_values(file_path), file_path=file_path)
+            params.append({'_song_id': song_id, **{f'_{c}': values[c] for c in columns}})
+        session.execute(statement, params)
+        mark_pending_writes(session)
+        count += len(batch)
+    return count
+
+
+def delete_songs(session, song_ids: Iterable[int], batch_size: Optional[int] = None) -> int:
+    from sqlalchemy import delete
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    table = Song.__table__
+    count = 0
+    for batch in chunked(song_ids, batch_size or DB_BATCH_SIZE):
+        session.execute(delete(table).where(table.c.song_id.in_(batch)))
+        mark_pending_writes(session)
+        count += len(batch)
+    return count
+
+
+class BatchWriter:
+    def __init__(self, session, batch_size: Optional[int] = None, names: Optional['NameResolver'] = None,
+                 search: Optional['SearchDelta'] = None, aggregates: Optional['AggregateTracker'] = None):
+        from kyofu.config import DB_BATCH_SIZE
+
+        self.session = session
+        self.batch_size = batch_size or DB_BATCH_SIZE
+        self.names = names
+        self.search = search
+        self.aggregates = aggregates
+        self._upserts = []
+        self._renames = []
+        self._moves = []
+        self._deletes = []
+
+    def upsert(self, row: Dict) -> None:
+        self._upserts.append(row)
+        if len(self._upserts) >= self.batch_size:
+            self._flush_upserts()
+
+    def rename(self, song_id: int, file_path: str) -> None:
+        self._renames.append((song_id, file_path))
+        if len(self._renames) >= self.batch_size:
+            self._flush_renames()
+
+    def move(self, song_id: int, row: Dict) -> None:
+        self._moves.append(dict(row, song_id=song_id))
+        if len(self._moves) >= self.batch_size:
+            self._flush_moves()
+
+    def delete(self, song_id: int) -> None:
+        self._deletes.append(song_id)
+        if len(self._deletes) >= self.batch_size:
+            self._flush_deletes()
+
+    def delete_now(self, song_ids: List[int]) -> None:
+        # Ahead of everything buffered, for rows that have to be gone before those writes can run.
+        pending, self._deletes = self._deletes, list(song_ids)
+        self._flush_deletes()
+        self._deletes = pending
+
+    def committed(self) -> None:
+        if self.search:
+            self.search.commit()
+
+    def rolled_back(self) -> None:
+        if self.search:
+            self.search.discard()
+        if self.aggregates:
+            self.aggregates.discard()
+
+    def flush(self) -> None:
+        self._flush_renames()
+        self._flush_moves()
+        self._flush_upserts()
+        self._flush_deletes()
+        # Once per commit rather than per batch, as an album is usually spread over consecutive batches.
+        if self.aggregates:
+            self.aggregates.flush(self.session)
+
+    def _flush_upserts(self) -> None:
+        from kyofu.stats import stats
+
+        if self._upserts:
+            with stats.timer('db.flush_seconds'):
+                if self.names:
+                    self.names.apply(self.session, self._upserts)
+                if self.aggregates:
+                    self.aggregates.existing_paths(self.session, self._upserts)
+                    self.aggregates.rows(self._upserts)
+                stats.count('db.upserted_rows', upsert_songs(self.session, self._upserts, self.batch_size))
+                if self.search:
+                    self.search.put_rows(self.session, self._upserts)
+            self._upserts = []
+
+    def _flush_renames(self) -> None:
+        from kyofu.stats import stats
+
+        if self._renames:
+            with stats.timer('db.flush_seconds'):
+                stats.count('db.renamed_rows', rename_songs(self.session, self._renames, self.batch_size))
+            self._renames = []
+
+    def _flush_moves(self) -> None:
+        from kyofu.stats import stats
+
+        if self._moves:
+            with stats.timer('db.flush_seconds'):
+                if self.names:
+                    self.names.apply(self.session, self._moves)
+                if self.aggregates:
+                    self.aggregates.existing_songs(self.session, [r['song_id'] for r in self._moves])
+                    self.aggregates.rows(self._moves)
+                stats.count('db.moved_rows', move_songs(self.session, self._moves, self.batch_size))
+                if self.search:
+                    for row in self._moves:
+                        self.search.put(row['song_id'], row)
+            self._moves = []
+
+    def _flush_deletes(self) -> None:
+        from kyofu.stats import stats
+
+        if self._deletes:
+            with stats.timer('db.flush_seconds'):
+                if self.aggregates:
+                    self.aggregates.existing_songs(self.session, self._deletes)
+                stats.count('db.deleted_rows', delete_songs(self.session, self._deletes, self.batch_size))
+                if self.search:
+                    self.search.delete(self._deletes)
+            self._deletes = []
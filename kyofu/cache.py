@@ -0,0 +1,183 @@
+import pickle
+import sqlite3
+import threading
+import time
+from os import stat_result
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from kyofu import logger
+from kyofu.metadata import Metadata
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata_cache (
+    path TEXT NOT NULL PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    value BLOB,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+'''
+# Bump when the pickled Metadata layout changes; older caches are dropped on open.
+_VERSION = 1
+_LRU_INDEX = 'CREATE INDEX IF NOT EXISTS i_metadata_cache_1 ON metadata_cache (last_used)'
+
+# Fraction of max_bytes kept after an automatic eviction, so that eviction does not run on every store.
+_EVICT_TARGET = 0.9
+
+
+def _fingerprint(stat: stat_result) -> Tuple[int, int, int]:
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class MetadataCache:
+    # Several syncs, threads of one process or shards in separate processes, may share the file. Every write
+    # is therefore committed at once, so the write lock is never held across files, and a database error
+    # only turns a lookup into a miss or drops a store.
+    def __init__(self, path: Path, max_bytes: int, touch_every: int = 1000, timeout: float = 30):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_every = touch_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._used: Dict[str, float] = {}
+        self._connection = sqlite3.connect(str(path), timeout=timeout, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        (version,) = self._connection.execute('PRAGMA user_version').fetchone()
+        if version != _VERSION:
+            self._connection.execute('DROP TABLE IF EXISTS metadata_cache')
+            self._connection.execute(f'PRAGMA user_version = {_VERSION}')
+        self._connection.execute(_SCHEMA)
+        self._connection.execute(_LRU_INDEX)
+        self._connection.commit()
+        (total,) = self._connection.execute('SELECT COALESCE(SUM(bytes), 0) FROM metadata_cache').fetchone()
+        self._total_bytes = total
+
+    @staticmethod
+    def open_default() -> 'MetadataCache':
+        from kyofu.config import METADATA_CACHE_MAX_BYTES, METADATA_CACHE_PATH
+
+        return MetadataCache(Path(METADATA_CACHE_PATH).expanduser(), METADATA_CACHE_MAX_BYTES)
+
+    def lookup(self, path: Path, stat: Optional[stat_result] = None) -> Tuple[bool, Optional[Metadata]]:
+        key = str(path.resolve())
+        stat = stat or path.stat()
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    'SELECT size, mtime_ns, inode, value FROM metadata_cache WHERE path = ?', (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f'Metadata cache lookup failed: path={path}, error={e}')
+                row = None
+            if not row or tuple(row[:3]) != _fingerprint(stat):
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            # A hit only reads; the LRU times are written in batches.
+            self._used[key] = time.time()
+            if len(self._used) >= self.touch_every:
+                self._write_used()
+        value = row[3]
+        return True, pickle.loads(value) if value is not None else None
+
+    def store(self, path: Path, metadata: Optional[Metadata], stat: Optional[stat_result] = None) -> None:
+        key = str(path.resolve())
+        stat = stat or path.stat()
+        # A None value is a negative entry: the file failed to parse and is not retried until it changes.
+        value = pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL) if metadata is not None else None
+        size = len(key) + (len(value) if value is not None else 0)
+        with self._lock:
+            total_bytes = self._total_bytes
+            try:
+                old = self._connection.execute('SELECT bytes FROM metadata_cache WHERE path = ?', (key,)).fetchone()
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO metadata_cache (path, size, mtime_ns, inode, value, bytes, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, *_fingerprint(stat), value, size, time.time()),
+                )
+                self._total_bytes += size - (old[0] if old else 0)
+                if self._total_bytes > self.max_bytes:
+                    self._evict(int(self.max_bytes * _EVICT_TARGET))
+                self._connection.commit()
+            except sqlite3.Error as e:
+                self._rollback()
+                self._total_bytes = total_bytes
+                logger.warning(f'Metadata cache store failed: path={path}, error={e}')
+
+    def _write_used(self) -> None:
+        used, self._used = self._used, {}
+        try:
+            self._connection.executemany('UPDATE metadata_cache SET last_used = ? WHERE path = ?',
+                                         [(t, key) for key, t in used.items()])
+            self._connection.commit()
+        except sqlite3.Error as e:
+            # Only the eviction order suffers.
+            self._rollback()
+            logger.warning(f'Metadata cache LRU update failed: entries={len(used)}, error={e}')
+
+    def _rollback(self) -> None:
+        try:
+            self._connection.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, target_bytes: int) -> int:
+        evicted = 0
+        while self._total_bytes > target_bytes:
+            rows = self._connection.execute(
+                'SELECT path, bytes FROM metadata_cache ORDER BY last_used LIMIT 1000'
+            ).fetchall()
+            if not rows:
+                break
+            for path, size in rows:
+                if self._total_bytes <= target_bytes:
+                    break
+                self._connection.execute('DELETE FROM metadata_cache WHERE path = ?', (path,))
+                self._total_bytes -= size
+                evicted += 1
+        return evicted
+
+    def prune(self, max_bytes: Optional[int] = None, negative: bool = False) -> int:
+        with self._lock:
+            self._write_used()
+            pruned = 0
+            if negative:
+                pruned += self._connection.execute('DELETE FROM metadata_cache WHERE value IS NULL').rowcount
+                (self._total_bytes,) = self._connection.execute(
+                    'SELECT COALESCE(SUM(bytes), 0) FROM metadata_cache'
+                ).fetchone()
+            pruned += self._evict(self.max_bytes if max_bytes is None else max_bytes)
+            self._connection.commit()
+            self._connection.execute('VACUUM')
+            return pruned
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, negative, total = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(value IS NULL), 0), COALESCE(SUM(bytes), 0) FROM metadata_cache'
+            ).fetchone()
+        return {
+            'entries': entries,
+            'negative_entries': negative,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_used()
+            self._connection.close()
+
+    def __enter__(self) -> 'MetadataCache':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
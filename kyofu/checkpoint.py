@@ -0,0 +1,80 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from kyofu.bulk import BatchWriter
+from kyofu.model import Library, SyncCheckpoint
+from kyofu.walk import ROOT_DIR, walk_roots
+
+
+def path_order_key(relative_path: str, path_hint: Optional[Iterable[str]] = None) -> Tuple:
+    # Matches the order of walk_files: its roots one after another, and within each a sorted top-down walk
+    # where the files of a directory come before its subdirectories.
+    roots = walk_roots(path_hint)
+    root = next((n for n, r in enumerate(roots)
+                 if r == ROOT_DIR or relative_path.startswith(f'{r}/')), len(roots))
+    *dirs, name = Path(relative_path).parts
+    return (root,) + tuple((1, d) for d in dirs) + ((0, name),)
+
+
+def checkpoint_hint(path_hint: Optional[Iterable[str]] = None) -> Optional[str]:
+    roots = walk_roots(path_hint)
+    return None if roots == [ROOT_DIR] else '\n'.join(roots)
+
+
+class CommitScheduler:
+    def __init__(self, library: Library, writer: BatchWriter, every: int, interval: float, enabled: bool,
+                 checkpoint: bool = True, path_hint: Optional[Iterable[str]] = None):
+        self.library = library
+        self.writer = writer
+        self.every = every
+        self.interval = interval
+        self.enabled = enabled
+        self.checkpoint = checkpoint
+        self.path_hint = checkpoint_hint(path_hint)
+        self._count = 0
+        self._last_commit = time.monotonic()
+
+    def tick(self, last_path: str) -> None:
+        self._count += 1
+        if not self.enabled:
+            return
+        if self._count >= self.every or time.monotonic() - self._last_commit >= self.interval:
+            self.commit(last_path)
+
+    def commit(self, last_path: Optional[str]) -> None:
+        from kyofu import session
+        from kyofu.stats import stats
+
+        self.writer.flush()
+        if self.checkpoint and last_path is not None:
+            checkpoint = SyncCheckpoint.get_by_library(self.library)
+            if not checkpoint:
+                checkpoint = SyncCheckpoint(library_id=self.library.library_id)
+                session.add(checkpoint)
+            checkpoint.last_path = last_path
+            checkpoint.path_hint = self.path_hint
+            checkpoint.updated = datetime.now()
+        with stats.timer('db.commit_seconds'):
+            session.commit(force=True)
+        self.writer.committed()
+        self._count = 0
+        self._last_commit = time.monotonic()
+
+    def finish(self) -> None:
+        from kyofu import session
+        from kyofu.stats import stats
+
+        self.writer.flush()
+        if not self.enabled:
+            session.rollback()
+            self.writer.rolled_back()
+            return
+        if self.checkpoint:
+            checkpoint = SyncCheckpoint.get_by_library(self.library)
+            if checkpoint:
+                session.delete(checkpoint)
+        with stats.timer('db.commit_seconds'):
+            session.commit(force=True)
+        self.writer.committed()
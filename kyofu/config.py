@@ -8,8 +8,42 @@ DB_PORT = os.getenv('DB_PORT', '3306')
 DB_SCHEMA = os.getenv('DB_SCHEMA', 'kyofu')
 DB_OPTION = os.getenv('DB_OPTION', 'charset=utf8mb4')
 
-DB_URL = f'{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_SCHEMA}' + f'?{DB_OPTION}' if DB_OPTION else ''
+# DB_URL overrides the DB_* parts, e.g. DB_URL=sqlite:////path/to/kyofu.sqlite3 for a local catalog.
+DB_URL = os.getenv('DB_URL') or (
+    f'{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_SCHEMA}' + (f'?{DB_OPTION}' if DB_OPTION else '')
+)
 SQLALCHEMY_ENGINE_ECHO = os.getenv('SQLALCHEMY_ENGINE_ECHO ', False)
+SQLITE_PRAGMAS = [p for p in os.getenv(
+    'SQLITE_PRAGMAS',
+    'journal_mode=WAL,synchronous=NORMAL,foreign_keys=ON,busy_timeout=30000,cache_size=-65536,temp_store=MEMORY',
+).split(',') if p]
+NORMALIZE_NAMES = os.getenv('NORMALIZE_NAMES', '0') == '1'
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '500'))
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '4'))
+# Libraries on the same device synced at once; more than one makes a spinning disk seek between them.
+SYNC_DEVICE_CONCURRENCY = int(os.getenv('SYNC_DEVICE_CONCURRENCY', '1'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(SYNC_CONCURRENCY + 1)))
+SYNC_COMMIT_EVERY = int(os.getenv('SYNC_COMMIT_EVERY', '10000'))
+SYNC_COMMIT_INTERVAL = float(os.getenv('SYNC_COMMIT_INTERVAL', '300'))
+WALK_AUDIO_EXTENSIONS = [e for e in os.getenv('WALK_AUDIO_EXTENSIONS', 'mp3,flac,m4a,m4b,mp4,aac').split(',') if e]
+WALK_IGNORE = [p for p in os.getenv('WALK_IGNORE', '.*').split(',') if p]
+WALK_THREADS = int(os.getenv('WALK_THREADS', '1'))
+WATCH_DEBOUNCE = float(os.getenv('WATCH_DEBOUNCE', '1'))
+WATCH_MAX_DELAY = float(os.getenv('WATCH_MAX_DELAY', '10'))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '1000'))
+FINGERPRINT_SAMPLE_BYTES = int(os.getenv('FINGERPRINT_SAMPLE_BYTES', str(64 * 1024)))
+FAST_TAG_READER = os.getenv('FAST_TAG_READER', '1') == '1'
+METADATA_CACHE = os.getenv('METADATA_CACHE', '1') == '1'
+METADATA_CACHE_PATH = os.getenv(
+    'METADATA_CACHE_PATH',
+    os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'kyofu', 'metadata.sqlite3'),
+)
+METADATA_CACHE_MAX_BYTES = int(os.getenv('METADATA_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+SEARCH_INDEX_DIR = os.getenv(
+    'SEARCH_INDEX_DIR',
+    os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'kyofu', 'search'),
+)
+SEARCH_DELTA_MAX_BYTES = int(os.getenv('SEARCH_DELTA_MAX_BYTES', str(4 * 1024 * 1024)))
 
 logger_config = {
     'version': 1,
@@ -28,6 +62,12 @@ logger_config = {
             'formatter': 'default',
             'stream': 'ext://sys.stdout',
         },
+        'stderr': {
+            'class': 'logging.StreamHandler',
+            'level': 'INFO',
+            'formatter': 'default',
+            'stream': 'ext://sys.stderr',
+        },
         'null': {
             'class': 'logging.NullHandler',
             'level': 'DEBUG',
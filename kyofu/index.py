@@ -0,0 +1,152 @@
+from array import array
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional, Tuple
+
+from kyofu.model import Library, Song
+
+if TYPE_CHECKING:
+    from kyofu.walk import Shard
+
+_NO_FINGERPRINT = -1
+_NO_DIGEST = -1
+
+
+class _FingerprintKeys:
+    # A sequence view of the fingerprints in fingerprint order, so bisect works without copying them.
+    def __init__(self, index: 'SongIndex'):
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._index._fingerprint_order)
+
+    def __getitem__(self, i: int) -> int:
+        return self._index._fingerprints[self._index._fingerprint_order[i]]
+
+
+class SongIndex:
+    def __init__(self):
+        self._hashes = array('q')
+        self._song_ids = array('q')
+        self._fingerprints = array('q')
+        self._digests = array('q')
+        self._fingerprint_order = array('q')
+        self._seen = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def append(self, song_id: int, file_path: str, fingerprint: Optional[int] = None,
+               digest: Optional[int] = None) -> None:
+        from kyofu.util import path_hash
+
+        self.append_hash(song_id, path_hash(file_path), fingerprint, digest)
+
+    def append_hash(self, song_id: int, file_path_hash: int, fingerprint: Optional[int] = None,
+                    digest: Optional[int] = None) -> None:
+        self._hashes.append(file_path_hash)
+        self._song_ids.append(song_id)
+        self._fingerprints.append(_NO_FINGERPRINT if fingerprint is None else fingerprint)
+        self._digests.append(_NO_DIGEST if digest is None else digest)
+
+    def freeze(self) -> 'SongIndex':
+        order = sorted(range(len(self._hashes)), key=self._hashes.__getitem__)
+        self._hashes = array('q', (self._hashes[i] for i in order))
+        self._song_ids = array('q', (self._song_ids[i] for i in order))
+        self._fingerprints = array('q', (self._fingerprints[i] for i in order))
+        self._digests = array('q', (self._digests[i] for i in order))
+        # Positions sorted by fingerprint, for matching new paths against songs that may have moved.
+        self._fingerprint_order = array('q', sorted(
+            (i for i, f in enumerate(self._fingerprints) if f != _NO_FINGERPRINT), key=self._fingerprints.__getitem__
+        ))
+        self._seen = bytearray(len(self._hashes))
+        return self
+
+    def find(self, file_path: str) -> Optional[int]:
+        from kyofu.util import path_hash
+
+        h = path_hash(file_path)
+        pos = bisect_left(self._hashes, h)
+        if pos < len(self._hashes) and self._hashes[pos] == h:
+            return pos
+        return None
+
+    def __contains__(self, file_path: str) -> bool:
+        return self.find(file_path) is not None
+
+    def song_id(self, pos: int) -> int:
+        return self._song_ids[pos]
+
+    def digest(self, pos: int) -> Optional[int]:
+        digest = self._digests[pos]
+        return None if digest == _NO_DIGEST else digest
+
+    def unseen_fingerprints(self, fingerprint: Optional[int]) -> Iterator[int]:
+        if fingerprint is None:
+            return
+        keys = _FingerprintKeys(self)
+        i = bisect_left(keys, fingerprint)
+        while i < len(keys) and keys[i] == fingerprint:
+            pos = self._fingerprint_order[i]
+            if not self._seen[pos]:
+                yield pos
+            i += 1
+
+    def mark_seen(self, pos: int) -> None:
+        self._seen[pos] = 1
+
+    def unseen_song_ids(self) -> Iterator[int]:
+        for pos, seen in enumerate(self._seen):
+            if not seen:
+                yield self._song_ids[pos]
+
+    @staticmethod
+    def load(library: Library, path_hint: Iterable[str] = None, batch_size: Optional[int] = None,
+             shard: Optional['Shard'] = None) -> 'SongIndex':
+        from kyofu import session
+        from kyofu.config import DB_BATCH_SIZE
+        from kyofu.tree import subtree_filter
+        from kyofu.walk import ROOT_DIR
+        from sqlalchemy import case, or_
+
+        # The stored hash is enough to match walked paths, so the long path strings are not transferred.
+        # A shard only needs the directory to tell its own songs; the file path only for the base directory.
+        shard_key = case((Song.dir_path == ROOT_DIR, Song.file_path), else_=Song.dir_path)
+        query = session.query(Song.song_id, Song.file_path_hash, Song.fingerprint, Song.metadata_digest,
+                              shard_key if shard else Song.song_id)
+        query = query.filter(Song.library_id == library.library_id)
+        if path_hint:
+            query = query.filter(or_(*(subtree_filter(h) for h in path_hint)))
+        query = query.execution_options(stream_results=True).yield_per(batch_size or DB_BATCH_SIZE)
+
+        index = SongIndex()
+        for song_id, file_path_hash, fingerprint, digest, key in query:
+            if shard and not shard.owns(key):
+                continue
+            index.append_hash(song_id, file_path_hash, fingerprint, digest)
+        return index.freeze()
+
+
+def song_ids_by_path(library: Library, paths: Iterable[str], batch_size: Optional[int] = None) -> Dict[str, int]:
+    from kyofu import session
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked, path_hash
+
+    result = {}
+    for chunk in chunked(paths, batch_size or DB_BATCH_SIZE):
+        query = session.query(Song.song_id, Song.file_path)
+        query = query.filter(Song.library_id == library.library_id)
+        query = query.filter(Song.file_path_hash.in_({path_hash(p) for p in chunk}))
+        wanted = set(chunk)
+        result.update((p, song_id) for song_id, p in query if p in wanted)
+    return result
+
+
+def iter_song_paths(song_ids: Iterable[int], batch_size: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    from kyofu import session
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    for chunk in chunked(song_ids, batch_size or DB_BATCH_SIZE):
+        query = session.query(Song.song_id, Song.file_path)
+        query = query.filter(Song.song_id.in_(chunk))
+        yield from query.all()
@@ -0,0 +1,121 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+from dataclasses import dataclass
+from typing import List, Optional
+
+from kyofu.exceptions import KyofuError
+
+# Flags from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class InotifyError(KyofuError):
+    pass
+
+
+@dataclass
+class Event:
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.mask & IN_ISDIR)
+
+
+def _libc():
+    name = ctypes.util.find_library('c')
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise InotifyError('inotify is not available on this platform')
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def parse_events(data: bytes) -> List[Event]:
+    events = []
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+    return events
+
+
+class Inotify:
+    def __init__(self):
+        self._libc = _libc()
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise('inotify_init1')
+
+    def _raise(self, call: str, hint: str = ''):
+        raise InotifyError(f'{call} failed: {os.strerror(ctypes.get_errno())}{hint}')
+
+    def add_watch(self, path: str, mask: int) -> Optional[int]:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # The directory went away or was replaced before it could be watched; its events arrive anyway.
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            if error == errno.ENOSPC:
+                self._raise('inotify_add_watch', ': raise fs.inotify.max_user_watches')
+            self._raise('inotify_add_watch')
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        # Fails with EINVAL when the kernel already dropped the watch, which is fine.
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: Optional[float]) -> List[Event]:
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            return parse_events(os.read(self.fd, _READ_SIZE))
+        except BlockingIOError:
+            return []
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> 'Inotify':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
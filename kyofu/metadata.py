@@ -3,18 +3,27 @@ from argparse import ArgumentParser, Namespace
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
-
-from mutagen import File
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator, List, Optional, Tuple
 
 from kyofu import logger
 from kyofu.exceptions import KyofuError
 
+if TYPE_CHECKING:
+    from mutagen import File
+    from kyofu.cache import MetadataCache
+
 
 class MetadataError(KyofuError):
     pass
 
 
+class ParseError(MetadataError):
+    # Keeps the sniffed kind of a file that failed to parse for the parse counters.
+    def __init__(self, message: str, kind: str):
+        super().__init__(message)
+        self.kind = kind
+
+
 @dataclass
 class Fraction:
     numerator: int
@@ -33,13 +42,25 @@ class SongMetadata:
     year: int
 
 
+DUMP_FILE_EXTENSION = '.pickle'
+
+
+def song_path(raw_path: Path) -> Path:
+    raw_path_str = str(raw_path)
+    if raw_path_str.endswith(DUMP_FILE_EXTENSION):
+        return Path(raw_path_str[:len(raw_path_str) - len(DUMP_FILE_EXTENSION)])
+    return raw_path
+
+
 @dataclass
 class FileMetadata:
-    _DUMP_FILE_EXTENSION = '.pickle'
-
     raw_path: Path
     file_type: str
     modified: datetime
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+    inode: Optional[int] = None
+    fingerprint: Optional[int] = None
 
     @property
     def raw_path_str(self):
@@ -47,14 +68,11 @@ class FileMetadata:
 
     @property
     def is_dump_file(self):
-        return self.raw_path_str.endswith(self._DUMP_FILE_EXTENSION)
+        return self.raw_path_str.endswith(DUMP_FILE_EXTENSION)
 
     @property
     def path(self):
-        if self.is_dump_file:
-            return Path(self.raw_path_str[:len(self.raw_path_str) - len(self._DUMP_FILE_EXTENSION)])
-        else:
-            return self.raw_path
+        return song_path(self.raw_path)
 
 
 @dataclass
@@ -63,7 +81,7 @@ class Metadata:
     file: FileMetadata
 
 
-def _guess_file_type(file: File) -> str:
+def _guess_file_type(file: 'File') -> str:
     if 'audio/mp3' in file.mime:
         return 'mp3'
     elif 'audio/flac' in file.mime:
@@ -91,7 +109,7 @@ def _as_year(date: str) -> int:
 
 
 class MetadataExtractor:
-    def __init__(self, file: File, path: Path, file_type: str):
+    def __init__(self, file: 'File', path: Path, file_type: str):
         self.path = path
         self.file = file
         self.file_type = file_type
@@ -173,28 +191,82 @@ class MetadataExtractor:
         return result[0]
 
     def as_file_metadata(self) -> FileMetadata:
+        stat = self.path.stat()
         return FileMetadata(
             raw_path=self.path.resolve(),
             file_type=self.file_type,
-            modified=datetime.fromtimestamp(self.path.stat().st_mtime)
+            modified=datetime.fromtimestamp(stat.st_mtime),
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            inode=stat.st_ino,
         )
 
 
-def _load_metadata(path: Path) -> Optional[Metadata]:
-    if path.suffix == '.pickle':
+def _mutagen_class(kind: str):
+    from kyofu import sniff
+
+    if kind == sniff.MP3:
+        from mutagen.mp3 import EasyMP3
+        return EasyMP3
+    elif kind == sniff.FLAC:
+        from mutagen.flac import FLAC
+        return FLAC
+    elif kind == sniff.MP4:
+        from mutagen.easymp4 import EasyMP4
+        return EasyMP4
+    elif kind == sniff.AAC:
+        from mutagen.aac import AAC
+        return AAC
+    return None
+
+
+def _read_tags(f: BinaryIO, kind: str = None):
+    from kyofu.config import FAST_TAG_READER
+    from kyofu.sniff import UNKNOWN
+    from kyofu.tagreader import read_tags
+
+    guessed_file = read_tags(f) if FAST_TAG_READER else None
+    if not guessed_file:
+        f.seek(0)
+        file_class = _mutagen_class(kind or UNKNOWN)
+        if file_class:
+            guessed_file = file_class(f)
+        else:
+            from mutagen import File
+
+            guessed_file = File(f, easy=True)
+    return guessed_file
+
+
+def _load_metadata_kind(path: Path) -> Tuple[Optional[Metadata], Optional[str]]:
+    from kyofu.sniff import AUDIO_KINDS, SNIFF_BYTES, sniff
+
+    if path.suffix == DUMP_FILE_EXTENSION:
         with path.open('rb') as f:
             try:
                 guessed_file = pickle.load(f)
             except Exception as e:
                 logger.warning(f'failed to load pickle: path={path} error={e}')
-                return None
-    else:
-        with path.open('rb') as f:
-            guessed_file = File(f, easy=True)
-        if not guessed_file:
-            logger.warning('Failed to guess file type: %s' % path)
-            return None
-
+                return None, None
+        return _extract_metadata(guessed_file, path), None
+
+    with path.open('rb') as f:
+        kind = sniff(f.read(SNIFF_BYTES), path.suffix)
+        if kind not in AUDIO_KINDS:
+            logger.debug(f'Not audio: path={path} kind={kind}')
+            return None, kind
+        try:
+            f.seek(0)
+            guessed_file = _read_tags(f, kind)
+            if not guessed_file:
+                logger.warning('Failed to guess file type: %s' % path)
+                return None, kind
+            return _extract_metadata(guessed_file, path), kind
+        except Exception as e:
+            raise ParseError(str(e) or type(e).__name__, kind) from e
+
+
+def _extract_metadata(guessed_file, path: Path) -> Optional[Metadata]:
     if 'audio/mp3' in guessed_file.mime:
         metadata = MetadataExtractor(guessed_file, path, 'mp3').as_metadata()
     elif 'audio/flac' in guessed_file.mime:
@@ -208,31 +280,203 @@ def _load_metadata(path: Path) -> Optional[Metadata]:
     return metadata
 
 
-def load_metadata(path: Path) -> Optional[Metadata]:
+def _load_metadata(path: Path) -> Optional[Metadata]:
+    return _load_metadata_kind(path)[0]
+
+
+def _parse(path: Path) -> Tuple[Optional[Metadata], Optional[str]]:
     from kyofu import logger
 
     try:
-        return _load_metadata(path)
+        return _load_metadata_kind(path)
     except Exception as e:
         logger.warning(f'Failed to load metadata: path={path}, error={e}')
-        return None
+        return None, e.kind if isinstance(e, ParseError) else None
+
+
+def _load_metadata_uncached(path: Path) -> Optional[Metadata]:
+    return _parse(path)[0]
 
 
-def _parse_args() -> Namespace:
-    parser = ArgumentParser()
-    parser.add_argument('file')
-    return parser.parse_args()
+def load_metadata(path: Path, cache: 'MetadataCache' = None) -> Optional[Metadata]:
+    if not cache:
+        return _load_metadata_uncached(path)
+    request = _CacheRequest(path, cache)
+    metadata, _ = _load_cache_request(request)
+    request.store(metadata)
+    return request.metadata if request.hit else metadata
 
 
-def _main() -> None:
-    args = _parse_args()
-    target_path = Path(args.file)
+class _CacheRequest:
+    def __init__(self, path: Path, cache: 'MetadataCache'):
+        self.path = path
+        self.cache = cache
+        self.stat = None
+        self.hit = False
+        self.metadata = None
+        try:
+            self.stat = path.stat()
+            self.hit, self.metadata = cache.lookup(path, self.stat)
+        except OSError:
+            pass
+
+    def __getstate__(self):
+        # Only the path travels to worker processes; the cache and any cached value stay here.
+        return {'path': self.path, 'hit': self.hit}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def store(self, metadata: Optional[Metadata]) -> None:
+        if not self.hit and self.stat is not None:
+            self.cache.store(self.path, metadata, self.stat)
+
+
+def _load_cache_request(request: _CacheRequest) -> Tuple[Optional[Metadata], Optional[str]]:
+    if request.hit:
+        return None, None
+    return _parse(request.path)
+
+
+def _timed(func, item):
+    # Runs in the worker, so the latency excludes the time spent queued in the pool.
+    import time
+
+    start = time.perf_counter()
+    result = func(item)
+    return result, time.perf_counter() - start
+
+
+def _record_parse(result, elapsed: float, kind: Optional[str] = None) -> None:
+    from kyofu.sniff import AUDIO_KINDS, UNKNOWN
+    from kyofu.stats import stats
+
+    stats.count('parse.files')
+    stats.observe('parse.seconds', elapsed)
+    if kind == UNKNOWN:
+        stats.count('parse.probed')
+    elif kind in AUDIO_KINDS:
+        stats.count(f'parse.routed.{kind}')
+    elif kind is not None:
+        # Rejected by its first bytes without mutagen ever seeing it.
+        stats.count(f'parse.skipped.{kind}')
+        return
+    if result is None:
+        stats.count('parse.failed')
+
+
+def load_metadata_many(paths: Iterable[Path], jobs: int = 1, executor_type: str = 'process', ordered: bool = True,
+                       cache: 'MetadataCache' = None) -> Iterator[Tuple[Path, Optional[Metadata]]]:
+    from functools import partial
+    from kyofu.stats import stats
+    from kyofu.worker import map_bounded
+
+    if not cache:
+        loaded = map_bounded(partial(_timed, _parse), paths, jobs=jobs, executor_type=executor_type, ordered=ordered)
+        for path, ((metadata, kind), elapsed) in loaded:
+            _record_parse(metadata, elapsed, kind)
+            yield path, metadata
+        return
+
+    requests = (_CacheRequest(p, cache) for p in paths)
+    loaded = map_bounded(partial(_timed, _load_cache_request), requests, jobs=jobs, executor_type=executor_type,
+                         ordered=ordered)
+    for request, ((metadata, kind), elapsed) in loaded:
+        request.store(metadata)
+        if request.hit:
+            stats.count('parse.cache_hits')
+            yield request.path, request.metadata
+        else:
+            _record_parse(metadata, elapsed, kind)
+            yield request.path, metadata
+
+
+STDIN_PATH = '-'
+
+
+def _load_metadata_or_error(path: Path) -> Tuple[Optional[Metadata], Optional[str]]:
+    from kyofu.sniff import AUDIO_KINDS
+
     try:
-        metadata = load_metadata(target_path)
-        print(asdict(metadata))
+        metadata, kind = _load_metadata_kind(path)
     except Exception as e:
-        logger.error(f'path={target_path} exception={e}')
+        return None, str(e) or type(e).__name__
+    if not metadata and kind not in AUDIO_KINDS:
+        return None, f'not audio: {kind}'
+    return metadata, (None if metadata else 'unsupported file')
+
+
+def _read_stdin_paths(null: bool) -> Iterator[Path]:
+    import os
+    import sys
+
+    separator = b'\0' if null else b'\n'
+    rest = b''
+    for chunk in iter(lambda: sys.stdin.buffer.read(65536), b''):
+        *items, rest = (rest + chunk).split(separator)
+        yield from (Path(os.fsdecode(i)) for i in items if i)
+    if rest.strip(b'\n'):
+        yield Path(os.fsdecode(rest.strip(b'\n')))
+
+
+def _iter_input_paths(targets: Iterable[str], null: bool) -> Iterator[Path]:
+    from kyofu.walk import walk_files
+
+    for target in targets:
+        paths = _read_stdin_paths(null) if target == STDIN_PATH else [Path(target)]
+        for p in paths:
+            if p.is_dir():
+                yield from walk_files(p)
+            else:
+                yield p
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> Namespace:
+    from kyofu.worker import EXECUTOR_TYPES
+
+    parser = ArgumentParser(description='Print metadata of audio files as one JSON object per line.')
+    parser.add_argument('paths', nargs='*', default=[STDIN_PATH],
+                        help=f'files or directories; {STDIN_PATH} reads paths from stdin (default)')
+    parser.add_argument('--null', '-0', action='store_true', help='paths on stdin are separated by NUL')
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+    parser.add_argument('--executor', choices=EXECUTOR_TYPES, default='process')
+    parser.add_argument('--keep-order', action='store_true', help='print results in input order')
+    parser.add_argument('--stats', action='store_true', help='print a summary to stderr')
+    return parser.parse_args(argv)
+
+
+def _main(argv: Optional[List[str]] = None) -> int:
+    import json
+    import sys
+    from functools import partial
+    from kyofu import configure_logging
+    from kyofu.stats import stats
+    from kyofu.worker import map_bounded
+
+    # stdout carries the results, so log to stderr.
+    configure_logging('stderr')
+    args = _parse_args(argv)
+    paths = _iter_input_paths(args.paths, args.null)
+    failed = 0
+    results = map_bounded(partial(_timed, _load_metadata_or_error), paths, jobs=args.jobs,
+                          executor_type=args.executor, ordered=args.keep_order)
+    for path, ((metadata, error), elapsed) in results:
+        _record_parse(metadata, elapsed)
+        if error:
+            failed += 1
+            print(json.dumps({'path': str(path), 'error': error}, ensure_ascii=False), file=sys.stderr, flush=True)
+        else:
+            print(json.dumps(asdict(metadata), default=_json_default, ensure_ascii=False), flush=True)
+    if args.stats:
+        print(stats.summary(), file=sys.stderr)
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    _main()
+    raise SystemExit(_main())
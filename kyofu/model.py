@@ -1,20 +1,42 @@
 from pathlib import Path
+from typing import Any, Dict, Optional
 
-from sqlalchemy import Column, DateTime, ForeignKey, String, text
-from sqlalchemy.dialects.mysql import INTEGER, SMALLINT
+from sqlalchemy import (BigInteger, Column, DateTime, ForeignKey, Index, Integer, SmallInteger, String,
+                        UniqueConstraint, func)
+from sqlalchemy.dialects.mysql import BIGINT, INTEGER, SMALLINT, VARCHAR
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 Base = declarative_base()
 sqla_metadata = Base.metadata
 
 
+# Portable column types that keep the MySQL display widths and collations of docs/ddl/kyofu.sql.
+def _integer(display_width: int):
+    return Integer().with_variant(INTEGER(display_width), 'mysql')
+
+
+def _bigint(display_width: int):
+    return BigInteger().with_variant(BIGINT(display_width), 'mysql')
+
+
+def _smallint(display_width: int):
+    return SmallInteger().with_variant(SMALLINT(display_width), 'mysql')
+
+
+def _string(length: int, collation: str = 'utf8mb4_unicode_ci'):
+    return String(length).with_variant(VARCHAR(length, collation=collation), 'mysql')
+
+
 class Library(Base):
     __tablename__ = 'library'
+    __table_args__ = (
+        UniqueConstraint('name', name='u_library_1'),
+    )
 
-    library_id = Column(INTEGER(20), primary_key=True)
-    name = Column(String(100, 'utf8mb4_unicode_ci'), nullable=False)
-    base_path = Column(String(500, 'utf8mb4_unicode_ci'), nullable=False)
+    library_id = Column(_integer(20), primary_key=True)
+    name = Column(_string(100), nullable=False)
+    base_path = Column(_string(500), nullable=False)
     song = relationship('Song', back_populates='library')
 
     def relative_path(self, path: Path) -> Path:
@@ -39,33 +61,154 @@ class Library(Base):
 
 class Song(Base):
     __tablename__ = 'song'
-
-    song_id = Column(INTEGER(20), primary_key=True)
+    __table_args__ = (
+        # Paths are relative to the library, so the same one may exist in several libraries.
+        UniqueConstraint('library_id', 'file_path', name='u_song_1'),
+        Index('i_song_6', 'library_id', 'artist_id', 'album_id', 'disc_number', 'track_number'),
+        Index('i_song_7', 'album_id', 'disc_number', 'track_number'),
+        Index('i_song_8', 'genre_id', 'artist_id'),
+        Index('i_song_9', 'library_id', 'dir_path'),
+        Index('i_song_10', 'library_id', 'file_path_hash'),
+        Index('i_song_11', 'library_id', 'fingerprint'),
+    )
+
+    song_id = Column(_integer(20), primary_key=True)
     library_id = Column(ForeignKey('library.library_id', onupdate='CASCADE'), nullable=False, index=True)
-    title = Column(String(200, 'utf8mb4_unicode_ci'), nullable=False, index=True)
-    album = Column(String(200, 'utf8mb4_unicode_ci'), nullable=False, index=True)
-    artist = Column(String(200, 'utf8mb4_unicode_ci'), nullable=False, index=True)
-    album_artist = Column(String(200, 'utf8mb4_unicode_ci'), index=True)
-    genre = Column(String(50, 'utf8mb4_unicode_ci'), nullable=False, index=True)
-    track_number = Column(SMALLINT(2), nullable=False)
-    disc_number = Column(SMALLINT(2), nullable=False)
-    release_year = Column(SMALLINT(4), nullable=False)
-    modified = Column(DateTime, nullable=False, server_default=text("current_timestamp()"))
-    file_path = Column(String(500, 'utf8mb4_unicode_ci'), nullable=False, unique=True)
+    title = Column(_string(200), nullable=False, index=True)
+    album = Column(_string(200), nullable=False, index=True)
+    artist = Column(_string(200), nullable=False, index=True)
+    album_artist = Column(_string(200), index=True)
+    genre = Column(_string(50), nullable=False, index=True)
+    track_number = Column(_smallint(2), nullable=False)
+    disc_number = Column(_smallint(2), nullable=False)
+    release_year = Column(_smallint(4), nullable=False)
+    modified = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+    file_path = Column(_string(500, 'utf8mb4_bin'), nullable=False)
+    dir_path = Column(_string(500, 'utf8mb4_bin'), nullable=False)
+    file_path_hash = Column(_bigint(20), nullable=False)
+    fingerprint = Column(_bigint(20))
+    metadata_digest = Column(_bigint(20))
+    file_size = Column(_bigint(20))
+    mtime_ns = Column(_bigint(20))
+    inode = Column(_bigint(20))
+    # Set only with NORMALIZE_NAMES; deferred so that plain queries do not depend on the columns.
+    artist_id = deferred(Column(ForeignKey('artist.artist_id', onupdate='CASCADE')))
+    album_artist_id = deferred(Column(ForeignKey('artist.artist_id', onupdate='CASCADE'), index=True))
+    album_id = deferred(Column(ForeignKey('album.album_id', onupdate='CASCADE')))
+    genre_id = deferred(Column(ForeignKey('genre.genre_id', onupdate='CASCADE')))
 
     library = relationship('Library', back_populates='song')
 
+    @staticmethod
+    def path_values(file_path: str) -> Dict[str, Any]:
+        from kyofu.tree import parent_dir
+        from kyofu.util import path_hash
+
+        return {'dir_path': parent_dir(file_path), 'file_path_hash': path_hash(file_path)}
+
     @staticmethod
     def get_by_path(path: Path, library: Library, required: bool = False) -> 'Song':
         from kyofu import session
         from kyofu.exceptions import EntityNotFoundError
+        from kyofu.util import path_hash
 
         query = session.query(Song)
-        query = query.filter(Song.file_path == str(path))
         query = query.filter(Song.library_id == library.library_id)
+        query = query.filter(Song.file_path_hash == path_hash(str(path)))
+        query = query.filter(Song.file_path == str(path))
         result = query.first()
 
         if not result and required:
             raise EntityNotFoundError(path)
 
         return result
+
+
+class SyncCheckpoint(Base):
+    __tablename__ = 'sync_checkpoint'
+
+    library_id = Column(ForeignKey('library.library_id', ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
+    last_path = Column(_string(500, 'utf8mb4_bin'), nullable=False)
+    # The path hints of the interrupted scan, one per line; NULL for a scan of the whole library.
+    path_hint = Column(_string(2000, 'utf8mb4_bin'))
+    updated = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+
+    @staticmethod
+    def get_by_library(library: Library) -> Optional['SyncCheckpoint']:
+        from kyofu import session
+
+        return session.get(SyncCheckpoint, library.library_id)
+
+
+class Directory(Base):
+    __tablename__ = 'directory'
+    __table_args__ = (
+        UniqueConstraint('library_id', 'dir_path'),
+    )
+
+    directory_id = Column(_integer(20), primary_key=True)
+    library_id = Column(ForeignKey('library.library_id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    dir_path = Column(_string(500, 'utf8mb4_bin'), nullable=False)
+    mtime_ns = Column(_bigint(20), nullable=False)
+    inode = Column(_bigint(20), nullable=False)
+
+
+class Artist(Base):
+    __tablename__ = 'artist'
+    __table_args__ = (
+        UniqueConstraint('name', name='u_artist_1'),
+    )
+
+    artist_id = Column(_integer(20), primary_key=True)
+    name = Column(_string(200, 'utf8mb4_bin'), nullable=False)
+
+
+class Album(Base):
+    __tablename__ = 'album'
+    __table_args__ = (
+        UniqueConstraint('artist_id', 'name', name='u_album_1'),
+    )
+
+    album_id = Column(_integer(20), primary_key=True)
+    artist_id = Column(ForeignKey('artist.artist_id', onupdate='CASCADE'), nullable=False)
+    name = Column(_string(200, 'utf8mb4_bin'), nullable=False)
+
+
+class Genre(Base):
+    __tablename__ = 'genre'
+    __table_args__ = (
+        UniqueConstraint('name', name='u_genre_1'),
+    )
+
+    genre_id = Column(_integer(20), primary_key=True)
+    name = Column(_string(50, 'utf8mb4_bin'), nullable=False)
+
+
+class AlbumSummary(Base):
+    __tablename__ = 'album_summary'
+    __table_args__ = (
+        UniqueConstraint('library_id', 'artist', 'album', name='u_album_summary_1'),
+    )
+
+    album_summary_id = Column(_integer(20), primary_key=True)
+    library_id = Column(ForeignKey('library.library_id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    # Album artist, or the track artist when the album artist is not tagged.
+    artist = Column(_string(200), nullable=False)
+    album = Column(_string(200), nullable=False)
+    track_count = Column(_integer(11), nullable=False)
+    disc_count = Column(_smallint(2), nullable=False)
+    min_year = Column(_smallint(4), nullable=False)
+    max_year = Column(_smallint(4), nullable=False)
+
+
+class ArtistSummary(Base):
+    __tablename__ = 'artist_summary'
+    __table_args__ = (
+        UniqueConstraint('library_id', 'artist', name='u_artist_summary_1'),
+    )
+
+    artist_summary_id = Column(_integer(20), primary_key=True)
+    library_id = Column(ForeignKey('library.library_id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    artist = Column(_string(200), nullable=False)
+    album_count = Column(_integer(11), nullable=False)
+    track_count = Column(_integer(11), nullable=False)
@@ -0,0 +1,68 @@
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from kyofu.model import Album, Artist, Genre
+
+
+def _name(value: str) -> str:
+    # MySQL compares the utf8mb4_bin keys with PAD SPACE, so trailing spaces would alias another name.
+    return value.rstrip(' ')
+
+
+class NameCache:
+    def __init__(self, table, columns: Tuple[str, ...], id_column: str, batch_size: Optional[int] = None):
+        from kyofu.config import DB_BATCH_SIZE
+
+        self.table = table
+        self.columns = columns
+        self.id_column = id_column
+        self.batch_size = batch_size or DB_BATCH_SIZE
+        self.ids: Dict[Hashable, int] = {}
+
+    def __getitem__(self, key: Tuple) -> int:
+        return self.ids[key]
+
+    def resolve(self, session, keys: Iterable[Tuple]) -> None:
+        from kyofu.bulk import insert_ignore_statement, mark_pending_writes
+        from kyofu.util import chunked
+
+        missing = [k for k in set(keys) if k not in self.ids]
+        for chunk in chunked(missing, self.batch_size):
+            self._load(session, chunk)
+            new = [k for k in chunk if k not in self.ids]
+            if not new:
+                continue
+            # Another sync may insert the same names concurrently, so ignore conflicts and read the ids back.
+            statement = insert_ignore_statement(session.get_bind().dialect.name, self.table)
+            session.execute(statement, [dict(zip(self.columns, k)) for k in new])
+            mark_pending_writes(session)
+            self._load(session, new)
+
+    def _load(self, session, keys: List[Tuple]) -> None:
+        from sqlalchemy import and_, select
+
+        columns = [self.table.c[c] for c in self.columns]
+        query = select(self.table.c[self.id_column], *columns)
+        query = query.where(and_(*(c.in_({k[i] for k in keys}) for i, c in enumerate(columns))))
+        wanted = set(keys)
+        for row_id, *key in session.execute(query):
+            if tuple(key) in wanted:
+                self.ids[tuple(key)] = row_id
+
+
+class NameResolver:
+    def __init__(self, batch_size: Optional[int] = None):
+        self.artists = NameCache(Artist.__table__, ('name',), 'artist_id', batch_size)
+        self.albums = NameCache(Album.__table__, ('artist_id', 'name'), 'album_id', batch_size)
+        self.genres = NameCache(Genre.__table__, ('name',), 'genre_id', batch_size)
+
+    def apply(self, session, rows: List[Dict]) -> None:
+        # Resolves a whole batch at once; names seen before cost no query at all.
+        self.artists.resolve(session, ((_name(r[k]),) for r in rows for k in ('artist', 'album_artist') if r[k]))
+        album_keys = [(self.artists[(_name(r['album_artist'] or r['artist']),)], _name(r['album'])) for r in rows]
+        self.albums.resolve(session, album_keys)
+        self.genres.resolve(session, ((_name(r['genre']),) for r in rows))
+        for row, album_key in zip(rows, album_keys):
+            row['artist_id'] = self.artists[(_name(row['artist']),)]
+            row['album_artist_id'] = self.artists[(_name(row['album_artist']),)] if row['album_artist'] else None
+            row['album_id'] = self.albums[album_key]
+            row['genre_id'] = self.genres[(_name(row['genre']),)]
@@ -0,0 +1,139 @@
+import threading
+import time
+from queue import Empty, Full, Queue
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class StageMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.queue_depth_max = 0
+        self._queue_depth_total = 0
+        self._queue_depth_samples = 0
+        self.started = None
+        self.finished = None
+
+    def sample(self, queue_depth: int) -> None:
+        self.items += 1
+        self.queue_depth_max = max(self.queue_depth_max, queue_depth)
+        self._queue_depth_total += queue_depth
+        self._queue_depth_samples += 1
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'items': self.items,
+            'elapsed': round(self.elapsed, 3),
+            'items_per_second': round(self.items / self.elapsed, 1) if self.elapsed else 0.0,
+            'queue_depth_max': self.queue_depth_max,
+            'queue_depth_avg': round(self._queue_depth_total / self._queue_depth_samples, 1)
+            if self._queue_depth_samples else 0.0,
+        }
+
+
+class Pipeline:
+    # Each stage maps an iterator to an iterator and runs in its own thread, connected to the next stage by a
+    # bounded queue, so a slow stage blocks its producers instead of buffering the whole library in memory.
+    # The last stage runs in the calling thread, which keeps all database access on the caller's session.
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._source: Optional[Iterable] = None
+        self._stages: List[tuple] = []
+        self._metrics: List[StageMetrics] = []
+        self._cancelled = threading.Event()
+
+    def source(self, name: str, items: Iterable) -> 'Pipeline':
+        self._source = items
+        self._metrics.append(StageMetrics(name))
+        return self
+
+    def stage(self, name: str, func: Callable[[Iterator], Iterable]) -> 'Pipeline':
+        self._stages.append(func)
+        self._metrics.append(StageMetrics(name))
+        return self
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {m.name: m.as_dict() for m in self._metrics}
+
+    def run(self, name: str) -> Iterator:
+        sink_metrics = StageMetrics(name)
+        self._metrics.append(sink_metrics)
+        queues = [Queue(self.queue_size) for _ in range(len(self._stages) + 1)]
+        threads = [threading.Thread(target=self._produce, args=(self._source, queues[0], self._metrics[0]),
+                                    name=f'kyofu-{self._metrics[0].name}', daemon=True)]
+        for i, func in enumerate(self._stages):
+            items = func(self._consume(queues[i]))
+            threads.append(threading.Thread(target=self._produce, args=(items, queues[i + 1], self._metrics[i + 1]),
+                                            name=f'kyofu-{self._metrics[i + 1].name}', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        sink_metrics.started = time.monotonic()
+        try:
+            for item in self._consume(queues[-1]):
+                sink_metrics.sample(0)
+                yield item
+        finally:
+            sink_metrics.finished = time.monotonic()
+            self._cancelled.set()
+            for thread in threads:
+                thread.join()
+
+    def _produce(self, items: Iterable, queue: Queue, metrics: StageMetrics) -> None:
+        metrics.started = time.monotonic()
+        try:
+            for item in items:
+                self._put(queue, item)
+                metrics.sample(queue.qsize())
+            self._put(queue, _DONE)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            try:
+                self._put(queue, _Failure(e))
+            except PipelineCancelled:
+                pass
+        finally:
+            metrics.finished = time.monotonic()
+
+    def _put(self, queue: Queue, item) -> None:
+        while True:
+            if self._cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                return
+            except Full:
+                pass
+
+    def _consume(self, queue: Queue) -> Iterator:
+        while True:
+            if self._cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                item = queue.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
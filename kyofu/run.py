@@ -1,116 +1,408 @@
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from kyofu.metadata import Metadata
 from kyofu.model import Song, Library
+from kyofu.walk import Shard
+
+
+@dataclass
+class SyncOptions:
+    jobs: int = 1
+    executor_type: str = 'process'
+    batch_size: Optional[int] = None
+    commit_every: Optional[int] = None
+    commit_interval: Optional[float] = None
+    walk_threads: Optional[int] = None
+    ignore: Optional[List[str]] = None
+    metadata_cache: Optional[bool] = None
+    queue_size: Optional[int] = None
+    shard: Optional[Shard] = None
+
+    def __post_init__(self):
+        from kyofu.config import (DB_BATCH_SIZE, METADATA_CACHE, PIPELINE_QUEUE_SIZE, SYNC_COMMIT_EVERY,
+                                  SYNC_COMMIT_INTERVAL, WALK_THREADS)
+
+        self.batch_size = self.batch_size or DB_BATCH_SIZE
+        self.commit_every = self.commit_every or SYNC_COMMIT_EVERY
+        self.commit_interval = self.commit_interval or SYNC_COMMIT_INTERVAL
+        self.walk_threads = self.walk_threads or WALK_THREADS
+        self.metadata_cache = METADATA_CACHE if self.metadata_cache is None else self.metadata_cache
+        self.queue_size = self.queue_size or PIPELINE_QUEUE_SIZE
+
+    def open_metadata_cache(self):
+        import sqlite3
+        from kyofu import logger
+        from kyofu.cache import MetadataCache
+
+        if not self.metadata_cache:
+            return None
+        try:
+            return MetadataCache.open_default()
+        except (OSError, sqlite3.Error) as e:
+            # The cache only saves parsing; a sync without it is slower, not wrong.
+            logger.warning(f'Metadata cache unavailable: error={e}')
+            return None
+
+    @property
+    def walk_filter(self):
+        from kyofu.config import WALK_IGNORE
+        from kyofu.walk import WalkFilter
+
+        return WalkFilter(ignore=WALK_IGNORE + (self.ignore or []), shard=self.shard)
+
+    @staticmethod
+    def from_args(args) -> 'SyncOptions':
+        return SyncOptions(
+            jobs=args.jobs,
+            executor_type=args.executor,
+            batch_size=args.batch_size,
+            commit_every=args.commit_every,
+            commit_interval=args.commit_interval,
+            walk_threads=args.walk_threads,
+            ignore=args.ignore,
+            metadata_cache=args.metadata_cache,
+            queue_size=args.queue_size,
+            shard=getattr(args, 'shard', None),
+        )
+
+
+def _add_sync_arguments(parser):
+    from kyofu.worker import EXECUTOR_TYPES
 
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+    parser.add_argument('--executor', choices=EXECUTOR_TYPES, default='process')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--commit-every', type=int)
+    parser.add_argument('--commit-interval', type=float)
+    parser.add_argument('--walk-threads', type=int)
+    parser.add_argument('--ignore', action='append')
+    parser.add_argument('--metadata-cache', action='store_const', const=True)
+    parser.add_argument('--no-metadata-cache', dest='metadata_cache', action='store_const', const=False)
+    parser.add_argument('--queue-size', type=int)
+
+
+def _shard_argument(value: str) -> Shard:
+    from argparse import ArgumentTypeError
+    from kyofu.exceptions import KyofuError
 
-def parse_args():
+    try:
+        return Shard.parse(value)
+    except KyofuError as e:
+        raise ArgumentTypeError(str(e)) from None
+
+
+def _add_library_arguments(parser) -> None:
+    parser.add_argument('library_name', nargs='*')
+    parser.add_argument('--all', action='store_true', help='sync every library')
+    parser.add_argument('--concurrency', type=int, help='libraries synced at once')
+    parser.add_argument('--shard', type=_shard_argument, metavar='I/N',
+                        help='only sync the top-level directories of partition I of N, e.g. one per process')
+
+
+def parse_args(argv: Optional[List[str]] = None):
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
     parser.add_argument('--yes', '-y', action='store_true')
+    parser.add_argument('--stats', action='store_true', help='print counters and latencies when done')
+    parser.add_argument('--stats-json', metavar='PATH')
+    parser.add_argument('--stats-prometheus', metavar='PATH', help='node_exporter textfile collector output')
+    parser.add_argument('--profile', metavar='PATH', help='profile the command and write the result to PATH')
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
     subparsers = parser.add_subparsers(required=True, dest='sub_command')
 
     init_parser = subparsers.add_parser('init')
     init_parser.add_argument('library_name')
     init_parser.add_argument('base_path')
+    _add_sync_arguments(init_parser)
     init_parser.set_defaults(func=init)
 
     scan_parser = subparsers.add_parser('scan')
-    scan_parser.add_argument('library_name')
+    _add_library_arguments(scan_parser)
     scan_parser.add_argument('--overwrite-song', action='store_true')
     scan_parser.add_argument('--path-hint', '-p', action='append')
+    scan_parser.add_argument('--resume', action='store_true')
+    _add_sync_arguments(scan_parser)
     scan_parser.set_defaults(func=scan)
 
     update_parser = subparsers.add_parser('update')
-    update_parser.add_argument('library_name')
-    update_parser.set_defaults(func=update)
+    _add_library_arguments(update_parser)
+    update_parser.add_argument('--deep', action='store_true')
+    _add_sync_arguments(update_parser)
+    # update falls back to scan on an empty library
+    update_parser.set_defaults(func=update, path_hint=None)
+
+    watch_parser = subparsers.add_parser('watch')
+    watch_parser.add_argument('library_name')
+    watch_parser.add_argument('--debounce', type=float, help='seconds without events before a batch is applied')
+    watch_parser.add_argument('--max-delay', type=float, help='seconds after which a batch is applied regardless')
+    watch_parser.add_argument('--deep', action='store_true', help='stat every file in the catch-up update')
+    _add_sync_arguments(watch_parser)
+    watch_parser.set_defaults(func=watch)
+
+    search_parser = subparsers.add_parser('search')
+    search_parser.add_argument('library_name')
+    search_parser.add_argument('query', nargs='*')
+    search_parser.add_argument('--limit', type=int, default=20)
+    search_parser.add_argument('--offset', type=int, default=0)
+    search_parser.add_argument('--rebuild', action='store_true', help='build the index from the database first')
+    search_parser.set_defaults(func=search)
+
+    browse_parser = subparsers.add_parser('browse')
+    browse_parser.add_argument('library_name')
+    browse_parser.add_argument('kind', choices=['albums', 'artists'])
+    browse_parser.add_argument('--artist', help='only the albums of this artist')
+    browse_parser.add_argument('--limit', type=int, default=50)
+    browse_parser.add_argument('--offset', type=int, default=0)
+    browse_parser.set_defaults(func=browse)
+
+    aggregates_parser = subparsers.add_parser('rebuild-aggregates')
+    aggregates_parser.add_argument('library_name')
+    aggregates_parser.set_defaults(func=rebuild_aggregates)
 
     delete_parser = subparsers.add_parser('delete')
     delete_parser.add_argument('library_name')
     delete_parser.add_argument('--prefix', '-p', action='append', required=True)
     delete_parser.set_defaults(func=delete)
 
-    return parser.parse_args()
+    schema_parser = subparsers.add_parser('create-schema')
+    schema_parser.set_defaults(func=create_schema)
+
+    cache_parser = subparsers.add_parser('cache')
+    cache_subparsers = cache_parser.add_subparsers(required=True, dest='cache_command')
+    cache_subparsers.add_parser('stats')
+    prune_parser = cache_subparsers.add_parser('prune')
+    prune_parser.add_argument('--max-bytes', type=int)
+    prune_parser.add_argument('--negative', action='store_true')
+    cache_parser.set_defaults(func=cache)
+
+    return parser.parse_args(argv)
+
+
+def _metadata_values(metadata: Metadata) -> Dict[str, Any]:
+    return {
+        'title': metadata.song.title,
+        'album': metadata.song.album,
+        'artist': metadata.song.artist,
+        'album_artist': metadata.song.album_artist,
+        'genre': metadata.song.genre,
+        'track_number': metadata.song.track_number,
+        'disc_number': metadata.song.disc_number,
+        'release_year': metadata.song.year,
+        'modified': metadata.file.modified,
+        'file_size': metadata.file.size,
+        'mtime_ns': metadata.file.mtime_ns,
+        'inode': metadata.file.inode,
+        'fingerprint': metadata.file.fingerprint,
+    }
+
+
+def _song_values(library: Library, metadata: Metadata) -> Dict[str, Any]:
+    from kyofu.bulk import song_digest
+
+    file_path = str(library.relative_path(metadata.file.path))
+    values = {
+        'library_id': library.library_id,
+        'file_path': file_path,
+        **Song.path_values(file_path),
+        **_metadata_values(metadata),
+    }
+    values['metadata_digest'] = song_digest(values)
+    return values
+
+
+def _report_counts(counts: Dict[str, int]) -> None:
+    from kyofu.stats import stats
+
+    for key, value in counts.items():
+        stats.count(f'sync.{key}', value)
+    print('Summary: ' + ' '.join(f'{k}={v}' for k, v in counts.items()))
+
+
+def _batch_writer(library: Library, options: SyncOptions):
+    from kyofu import session
+    from kyofu.aggregate import AggregateTracker
+    from kyofu.bulk import BatchWriter
+    from kyofu.config import NORMALIZE_NAMES
+    from kyofu.names import NameResolver
+    from kyofu.search import SearchDelta
 
+    names = NameResolver(options.batch_size) if NORMALIZE_NAMES else None
+    return BatchWriter(session, options.batch_size, names, SearchDelta.for_library(library),
+                       AggregateTracker(options.batch_size))
 
-def _import_song(library: Library, metadata: Metadata, song: Song = None) -> Song:
-    if not song:
-        song = Song()
-        song.library_id = library.library_id
-        song.file_path = str(library.relative_path(metadata.file.path))
-    else:
-        assert song.library_id == library.library_id
-        assert str(song.file_path) == str(library.relative_path(metadata.file.path))
-    song.title = metadata.song.title
-    song.album = metadata.song.album
-    song.artist = metadata.song.artist
-    song.album_artist = metadata.song.album_artist
-    song.genre = metadata.song.genre
-    song.track_number = metadata.song.track_number
-    song.disc_number = metadata.song.disc_number
-    song.release_year = metadata.song.year
-    song.modified = metadata.file.modified
-
-    return song
-
-
-def _full_scan(path: Path, path_hint: Iterable[str]) -> Iterable[Path]:
-    if path_hint:
-        for hint in path_hint:
-            target_path = path / Path(hint)
-            for p in target_path.rglob('*'):
-                if p.is_dir():
-                    continue
-                yield p
-    else:
-        for p in path.rglob('*'):
-            if p.is_dir():
-                continue
-            yield p
 
+def _fingerprint_files(items: Iterator[Tuple[Path, Optional[Metadata]]], wanted: Callable[[Metadata], bool]):
+    from kyofu import logger
+    from kyofu.fingerprint import fingerprint
+
+    for p, metadata in items:
+        if metadata and wanted(metadata):
+            try:
+                metadata.file.fingerprint = fingerprint(metadata.file.raw_path)
+            except OSError as e:
+                logger.warning(f'Fingerprint failed: path={p} error={e}')
+        yield p, metadata
 
-def _full_sync(library: Library, overwrite: bool = False, path_hint: Iterable[str] = None):
-    from kyofu.metadata import load_metadata
+
+def _metadata_pipeline(source_name: str, paths: Iterable[Path], options: SyncOptions, cache,
+                       fingerprint_wanted: Callable[[Metadata], bool]):
+    from kyofu.metadata import load_metadata_many
+    from kyofu.pipeline import Pipeline
+
+    # Only files that are about to be written are fingerprinted; unchanged files cost no extra reads. The
+    # fingerprint is not part of the metadata digest, so the digest tells without reading the content.
+    pipeline = Pipeline(options.queue_size)
+    pipeline.source(source_name, paths)
+    pipeline.stage('parse', lambda items: load_metadata_many(items, options.jobs, options.executor_type, cache=cache))
+    pipeline.stage('fingerprint', lambda items: _fingerprint_files(items, fingerprint_wanted))
+    return pipeline
+
+
+def _moved_from(library: Library, song_id: int) -> Optional[str]:
     from kyofu import session
-    from kyofu.util import escape_for_like
-    from sqlalchemy import or_
 
-    if path_hint:
-        query = session.query(Song)
-        query = query.filter(Song.library_id == library.library_id)
-        query = query.filter(
-            or_(Song.file_path.like(f'{escape_for_like(h)}%/%') for h in path_hint)
-        )
-        imported = {s.file_path: s for s in query.all()}
-    else:
-        imported = {s.file_path: s for s in library.song}
-    exists = set()
+    # A song whose file is still in place was copied, not moved.
+    old_path = session.query(Song.file_path).filter(Song.song_id == song_id).scalar()
+    if old_path is None or (library.path / old_path).exists():
+        return None
+    return old_path
 
-    for p in _full_scan(library.path, path_hint):
-        metadata = load_metadata(p)
-        if not metadata:
-            continue
-        relative_path = library.relative_path(metadata.file.path)
-        if str(relative_path) in imported:
-            exists.add(str(relative_path))
-            if overwrite:
-                _import_song(library, metadata, song=imported.get(str(relative_path)))
-                print(f'Force updated: path={p}')
+
+def _deleted_fingerprints(deleted: List[Tuple[int, str]], batch_size: int) -> Dict[int, List[Tuple[int, str]]]:
+    from kyofu import session
+    from kyofu.util import chunked
+
+    paths = dict(deleted)
+    result: Dict[int, List[Tuple[int, str]]] = {}
+    for chunk in chunked(paths, batch_size):
+        query = session.query(Song.song_id, Song.fingerprint)
+        query = query.filter(Song.song_id.in_(chunk), Song.fingerprint.isnot(None))
+        for song_id, fingerprint in query:
+            result.setdefault(fingerprint, []).append((song_id, paths[song_id]))
+    return result
+
+
+def _log_pipeline_metrics(pipeline) -> None:
+    from kyofu import logger
+    from kyofu.stats import stats
+
+    for name, metrics in pipeline.metrics().items():
+        logger.info(f'Stage {name}: ' + ' '.join(f'{k}={v}' for k, v in metrics.items()))
+        stats.gauge(f'pipeline.{name}.items_per_second', metrics['items_per_second'])
+        stats.gauge(f'pipeline.{name}.queue_depth_max', metrics['queue_depth_max'])
+
+
+def _full_sync(library: Library, overwrite: bool = False, path_hint: Iterable[str] = None, resume: bool = False,
+               options: SyncOptions = None) -> Dict[str, int]:
+    from kyofu.bulk import song_digest
+    from kyofu.checkpoint import CommitScheduler, path_order_key
+    from kyofu.index import SongIndex, iter_song_paths
+    from kyofu.metadata import song_path
+    from kyofu.model import SyncCheckpoint
+    from kyofu.stats import stats
+    from kyofu.walk import walk_files
+    from kyofu import current_config
+    from kyofu.exceptions import KyofuError
+
+    options = options or SyncOptions()
+    if resume and options.shard:
+        # The checkpoint is per library, so concurrent shards would overwrite each other's.
+        raise KyofuError('--resume cannot be combined with --shard')
+    with stats.timer('phase.index_load'):
+        imported = SongIndex.load(library, path_hint, options.batch_size, options.shard)
+    writer = _batch_writer(library, options)
+    scheduler = CommitScheduler(library, writer, options.commit_every, options.commit_interval,
+                                enabled=current_config.get('auto_commit', False), checkpoint=not options.shard,
+                                path_hint=path_hint)
+
+    resume_key = None
+    if resume:
+        checkpoint = SyncCheckpoint.get_by_library(library)
+        if checkpoint and checkpoint.path_hint != scheduler.path_hint:
+            # Paths before the checkpoint were only synced for the hints of the interrupted scan.
+            hints = (checkpoint.path_hint or '').replace('\n', ',')
+            raise KyofuError(f'Checkpoint is of a scan with other path hints: path_hint={hints or "(none)"}')
+        if checkpoint:
+            print(f'Resume: path={checkpoint.last_path}')
+            resume_key = path_order_key(checkpoint.last_path, path_hint)
         else:
-            song = _import_song(library, metadata)
-            print(f'Added: path={p}')
-            session.add(song)
-
-    deleted = set(imported.keys()) - exists
-    for p in deleted:
-        dp = Path(p)
-        if not dp.exists():
-            print(f'Deleted: path={p}')
-            session.delete(Song.get_by_path(dp, library, required=True))
+            print('No checkpoint found. Start from the beginning')
+
+    # Runs in the walker thread, so it must not touch ORM objects bound to the session.
+    base_path = library.path
+
+    def pending_paths():
+        for p in walk_files(base_path, path_hint, options.walk_filter, options.walk_threads):
+            if resume_key and path_order_key(str(p.relative_to(base_path)), path_hint) <= resume_key:
+                # Already committed by the interrupted run; only keep it from being treated as deleted.
+                pos = imported.find(str(song_path(p).relative_to(base_path)))
+                if pos is not None:
+                    imported.mark_seen(pos)
+                continue
+            yield p
 
-    session.commit()
+    def is_written(metadata: Metadata) -> bool:
+        pos = imported.find(str(metadata.file.path.relative_to(base_path)))
+        if pos is None:
+            return True
+        return overwrite and imported.digest(pos) != song_digest(_metadata_values(metadata))
+
+    counts = dict.fromkeys(['added', 'updated', 'unchanged', 'skipped', 'moved', 'deleted'], 0)
+    last_path = None
+    cache = options.open_metadata_cache()
+    pipeline = _metadata_pipeline('walk', pending_paths(), options, cache, is_written)
+    with stats.timer('phase.sync'):
+        for p, metadata in pipeline.run('write'):
+            last_path = str(library.relative_path(p))
+            if metadata:
+                values = _song_values(library, metadata)
+                pos = imported.find(values['file_path'])
+                if pos is not None:
+                    imported.mark_seen(pos)
+                    if not overwrite:
+                        counts['skipped'] += 1
+                    elif imported.digest(pos) == values['metadata_digest']:
+                        counts['unchanged'] += 1
+                    else:
+                        print(f'Updated: path={p}')
+                        counts['updated'] += 1
+                        writer.upsert(values)
+                else:
+                    # The same audio may be in several places; the first match may be a copy still in place.
+                    moved, old_path = None, None
+                    for pos in imported.unseen_fingerprints(values['fingerprint']):
+                        old_path = _moved_from(library, imported.song_id(pos))
+                        if old_path is not None:
+                            moved = pos
+                            break
+                    if old_path is not None:
+                        imported.mark_seen(moved)
+                        print(f'Moved: path={old_path} -> {values["file_path"]}')
+                        counts['moved'] += 1
+                        writer.move(imported.song_id(moved), values)
+                    else:
+                        print(f'Added: path={p}')
+                        counts['added'] += 1
+                        writer.upsert(values)
+            scheduler.tick(last_path)
+
+    with stats.timer('phase.delete_pass'):
+        for song_id, p in iter_song_paths(imported.unseen_song_ids(), options.batch_size):
+            if not (library.path / p).exists():
+                print(f'Deleted: path={p}')
+                counts['deleted'] += 1
+                writer.delete(song_id)
+
+    with stats.timer('phase.finish'):
+        scheduler.finish()
+    _report_counts(counts)
+    _log_pipeline_metrics(pipeline)
+    if cache:
+        cache.close()
+    return counts
 
 
 def init(args):
@@ -125,81 +417,400 @@ def init(args):
     session.add(library)
     session.commit()
 
-    _full_sync(library)
+    _full_sync(library, options=SyncOptions.from_args(args))
+
+
+def _selected_libraries(args) -> List[Library]:
+    from kyofu import session
+    from kyofu.exceptions import KyofuError
+
+    if args.all:
+        if args.library_name:
+            raise KyofuError('Library names and --all are exclusive')
+        return session.query(Library).order_by(Library.name).all()
+    if not args.library_name:
+        raise KyofuError('A library name or --all is required')
+    libraries = [Library.get_by_name(name, required=True) for name in dict.fromkeys(args.library_name)]
+    if len(libraries) > 1 and args.path_hint:
+        raise KyofuError('--path-hint is relative to a single library')
+    return libraries
+
+
+def _library_device(library: Library) -> Optional[int]:
+    import os
+
+    try:
+        return os.stat(library.base_path).st_dev
+    except OSError:
+        return None
+
+
+def _sync_concurrency(requested: Optional[int]) -> int:
+    from kyofu import logger, session
+    from kyofu.config import SYNC_CONCURRENCY
+
+    concurrency = requested or SYNC_CONCURRENCY
+    if concurrency > 1 and session.get_bind().dialect.name == 'sqlite':
+        # SQLite has a single writer, and a sync keeps its write transaction open for up to SYNC_COMMIT_EVERY
+        # rows or SYNC_COMMIT_INTERVAL seconds; a concurrent sync would give up after busy_timeout.
+        logger.info(f'SQLite syncs one library at a time: concurrency={concurrency}')
+        return 1
+    return concurrency
+
+
+def _sync_libraries(libraries: List[Library], sync: Callable[[Library], Dict[str, int]],
+                    concurrency: Optional[int] = None) -> None:
+    import threading
+    from kyofu import logger, session
+    from kyofu.config import SYNC_CONCURRENCY, SYNC_DEVICE_CONCURRENCY
+    from kyofu.exceptions import KyofuError
+
+    if len(libraries) == 1:
+        sync(libraries[0])
+        return
+
+    # Each worker takes the first pending library whose device has a free slot, so libraries on a busy or
+    # slow device wait for it without holding up the libraries on other devices.
+    pending = [(library.library_id, library.name, _library_device(library)) for library in libraries]
+    busy: Dict[Optional[int], int] = {}
+    results: Dict[str, Dict[str, int]] = {}
+    failed: List[str] = []
+    condition = threading.Condition()
+
+    def take() -> Optional[Tuple[int, str, Optional[int]]]:
+        with condition:
+            while pending:
+                for item in pending:
+                    if busy.get(item[2], 0) < SYNC_DEVICE_CONCURRENCY:
+                        pending.remove(item)
+                        busy[item[2]] = busy.get(item[2], 0) + 1
+                        return item
+                condition.wait()
+            return None
+
+    def work() -> None:
+        while True:
+            item = take()
+            if item is None:
+                return
+            library_id, name, device = item
+            try:
+                # Objects of the main thread's session must not be used from this one.
+                results[name] = sync(session.get(Library, library_id))
+            except Exception:
+                logger.exception(f'Sync failed: library={name}')
+                session.rollback()
+                failed.append(name)
+            finally:
+                session.remove()
+                with condition:
+                    busy[device] -= 1
+                    condition.notify_all()
+
+    threads = [threading.Thread(target=work, name=f'sync-{n}', daemon=True)
+               for n in range(min(concurrency or SYNC_CONCURRENCY, len(pending)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    total: Dict[str, int] = {}
+    for name in sorted(results):
+        print(f'Summary: library={name} ' + ' '.join(f'{k}={v}' for k, v in results[name].items()))
+        for k, v in results[name].items():
+            total[k] = total.get(k, 0) + v
+    print(f'Summary: libraries={len(results)} failed={len(failed)} ' + ' '.join(f'{k}={v}' for k, v in total.items()))
+    if failed:
+        raise KyofuError(f'Sync failed: libraries={",".join(sorted(failed))}')
 
 
 def scan(args):
+    from kyofu import confirm_commit
     from kyofu.util import show_proceed_prompt
 
-    name = args.library_name
     overwrite = args.overwrite_song
     path_hint = args.path_hint
 
-    library = Library.get_by_name(name)
+    libraries = _selected_libraries(args)
     if not path_hint:
         if not show_proceed_prompt('Full scan may take very long time. Continue?'):
             return
+    confirm_commit()
 
-    _full_sync(library, overwrite, path_hint)
+    options = SyncOptions.from_args(args)
+    _sync_libraries(libraries, lambda library: _full_sync(library, overwrite, path_hint, args.resume, options),
+                    _sync_concurrency(args.concurrency))
 
 
-def _diff_scan(library: Library) -> Iterable[Path]:
-    from kyofu import session
-    from kyofu.exceptions import KyofuError
-    from sqlalchemy.sql.functions import max
-    import subprocess
-    from datetime import datetime
+def _sync_changes(library: Library, source_name: str, changed: Iterable[Path], existing: Set[str],
+                  deleted: List[Tuple[int, str]], options: SyncOptions, writer, scheduler) -> Dict[str, int]:
+    from kyofu.stats import stats
 
-    query = session.query(max(Song.modified))
-    query = query.filter(Song.library_id == library.library_id)
-    (last_modified,) = query.first()
-    now = datetime.now()
-    delta = now - last_modified
-    buffer_minute = 0
-    delta_minute = delta.days * 24 * 60 + delta.seconds // 60 + buffer_minute
+    moved_from = _deleted_fingerprints(deleted, options.batch_size) if deleted else {}
+    moved_ids = set()
+    counts = dict.fromkeys(['added', 'updated', 'moved', 'deleted'], 0)
+    cache = options.open_metadata_cache()
+    pipeline = _metadata_pipeline(source_name, changed, options, cache, lambda _: True)
+    with stats.timer('phase.sync'):
+        for _, metadata in pipeline.run('write'):
+            if not metadata:
+                continue
+            row = _song_values(library, metadata)
+            candidates = moved_from.get(row['fingerprint'])
+            if row['file_path'] in existing:
+                print(f'Updated: path={row["file_path"]}')
+                counts['updated'] += 1
+                writer.upsert(row)
+            elif candidates:
+                song_id, old_path = candidates.pop()
+                moved_ids.add(song_id)
+                print(f'Moved: path={old_path} -> {row["file_path"]}')
+                counts['moved'] += 1
+                writer.move(song_id, row)
+            else:
+                print(f'Added: path={row["file_path"]}')
+                counts['added'] += 1
+                writer.upsert(row)
+            scheduler.tick(row['file_path'])
+
+    for song_id, p in deleted:
+        if song_id not in moved_ids:
+            print(f'Deleted: path={p}')
+            counts['deleted'] += 1
+            writer.delete(song_id)
+
+    _log_pipeline_metrics(pipeline)
+    if cache:
+        cache.close()
+    return counts
+
+
+def _update_library(library: Library, options: SyncOptions, deep: bool, commit: bool) -> Dict[str, int]:
+    from kyofu.checkpoint import CommitScheduler
+    from kyofu.stats import stats
+    from kyofu.tree import diff_tree, save_directories
+
+    writer = _batch_writer(library, options)
+    scheduler = CommitScheduler(library, writer, options.commit_every, options.commit_interval,
+                                enabled=commit, checkpoint=False)
 
-    result = subprocess.run(['find', library.base_path, '-type', 'f', '-mmin', f'-{delta_minute}'],
-                            capture_output=True)
-    if result.returncode != 0:
-        raise KyofuError(result.stderr.decode())
+    with stats.timer('phase.tree_diff'):
+        diff = diff_tree(library, deep, options.walk_filter)
+    counts = _sync_changes(library, 'diff', diff.changed, diff.existing, diff.deleted, options, writer, scheduler)
 
-    raw_output = result.stdout.decode().strip()
-    if not raw_output:
-        return ()
-    for p in raw_output.split('\n'):
-        yield Path(p)
+    with stats.timer('phase.finish'):
+        save_directories(library, diff, options.batch_size)
+        scheduler.finish()
+    _report_counts(counts)
+    return counts
 
 
 def update(args):
-    from kyofu.metadata import load_metadata
-    from kyofu import session, logger
+    from kyofu import session, logger, confirm_commit
+    from kyofu.util import show_proceed_prompt
 
-    name = args.library_name
-    library = Library.get_by_name(name)
+    libraries = _selected_libraries(args)
+    empty = set()
+    for library in libraries:
+        if not session.query(Song.song_id).filter(Song.library_id == library.library_id).first():
+            logger.info(f'No song in library. try full scan: library={library}')
+            empty.add(library.library_id)
+    if empty and not show_proceed_prompt('Full scan may take very long time. Continue?'):
+        libraries = [library for library in libraries if library.library_id not in empty]
+        if not libraries:
+            return
+    commit = confirm_commit()
+
+    options = SyncOptions.from_args(args)
+
+    def sync(library: Library) -> Dict[str, int]:
+        if library.library_id in empty:
+            return _full_sync(library, options=options)
+        return _update_library(library, options, args.deep, commit)
+
+    _sync_libraries(libraries, sync, _sync_concurrency(args.concurrency))
+
+
+def _apply_renames(library: Library, operations, writer, batch_size: int) -> Tuple[int, List[str]]:
+    from kyofu.index import song_ids_by_path
+    from kyofu.metadata import song_path
+    from kyofu.tree import songs_under_directory
+    from kyofu.watch import DELETE_DIR, RENAME_DIR, RENAME_FILE
+
+    renamed = 0
+    unresolved = []
+    file_renames = []
+
+    def flush_file_renames():
+        nonlocal renamed
+        pairs = [(str(song_path(Path(old))), str(song_path(Path(new))), new) for old, new in file_renames]
+        current = song_ids_by_path(library, {p for old, new, _ in pairs for p in (old, new)}, batch_size)
+        replaced = []
+        for old, new, raw_new in pairs:
+            song_id = current.pop(old, None)
+            if new in current:
+                # mv over an existing file: its row goes, the renamed row takes the path.
+                replaced.append(current.pop(new))
+            if song_id is None:
+                unresolved.append(raw_new)
+                continue
+            current[new] = song_id
+            print(f'Renamed: path={old} -> {new}')
+            renamed += 1
+            writer.rename(song_id, new)
+        if replaced:
+            writer.delete_now(replaced)
+        writer.flush()
+        file_renames.clear()
+
+    for kind, old, new in operations:
+        if kind == RENAME_FILE:
+            file_renames.append((old, new))
+            continue
+        flush_file_renames()
+        if kind == RENAME_DIR:
+            for song_id, p in songs_under_directory(library, old):
+                print(f'Renamed: path={p} -> {new}{p[len(old):]}')
+                renamed += 1
+                writer.rename(song_id, f'{new}{p[len(old):]}')
+        elif kind == DELETE_DIR:
+            for song_id, p in songs_under_directory(library, old):
+                print(f'Deleted: path={p}')
+                writer.delete(song_id)
+        writer.flush()
+    flush_file_renames()
+    return renamed, unresolved
+
+
+def _apply_watch_batch(library: Library, batch, options: SyncOptions) -> None:
+    from kyofu.checkpoint import CommitScheduler
+    from kyofu.index import song_ids_by_path
+    from kyofu.metadata import song_path
+    from kyofu.watch import CHANGED, DELETED
+
+    if batch.rescan:
+        # Events were lost, and in-place rewrites do not change directory mtimes, so stat every file.
+        print('Event queue overflowed. Rescan the library')
+        _update_library(library, options, deep=True, commit=True)
+        return
+
+    writer = _batch_writer(library, options)
+    scheduler = CommitScheduler(library, writer, options.commit_every, options.commit_interval,
+                                enabled=True, checkpoint=False)
+    renamed, unresolved = _apply_renames(library, batch.operations, writer, options.batch_size)
+
+    changed = sorted({p for p, state in batch.paths.items() if state == CHANGED} | set(unresolved))
+    changed = [p for p in changed if (library.path / p).exists()]
+    deleted = [str(song_path(Path(p))) for p, state in batch.paths.items() if state == DELETED]
+    song_ids = song_ids_by_path(library, deleted + [str(song_path(Path(p))) for p in changed], options.batch_size)
+    existing = song_ids.keys() - set(deleted)
+    counts = _sync_changes(library, 'watch', (library.path / p for p in changed), existing,
+                           [(song_ids[p], p) for p in deleted if p in song_ids], options, writer, scheduler)
+    counts['renamed'] = renamed
+    scheduler.finish()
+    _report_counts(counts)
+
+
+def _apply_watch_batch_or_rescan(library: Library, watcher, batch, options: SyncOptions) -> None:
+    from kyofu import logger, session
+
+    try:
+        _apply_watch_batch(library, batch, options)
+    except Exception:
+        # A lost connection, a deadlock or a conflicting rename must not end the daemon. The events of the
+        # batch are gone with it, so the next batch rescans the library instead.
+        session.rollback()
+        logger.exception('Watch batch failed. Rescan with the next batch')
+        watcher.request_rescan()
+
+
+def watch(args):
+    import signal
+    from kyofu import current_config, logger, session
+    from kyofu.config import WATCH_DEBOUNCE, WATCH_MAX_DELAY
+    from kyofu.watch import Watcher
+
+    # A daemon has nobody to answer the commit prompt.
+    current_config['auto_commit'] = True
+    library = Library.get_by_name(args.library_name, required=True)
+    options = SyncOptions.from_args(args)
+    watcher = Watcher(library.path, options.walk_filter)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: watcher.stop())
+    try:
+        watcher.watch_tree()
+        logger.info(f'Watching: library={library}')
+        # Catch up with what changed while nothing was watching; later changes arrive as events.
+        if session.query(Song.song_id).filter(Song.library_id == library.library_id).first():
+            _update_library(library, options, args.deep, commit=True)
+        else:
+            _full_sync(library, options=options)
+        watcher.run(lambda batch: _apply_watch_batch_or_rescan(library, watcher, batch, options),
+                    args.debounce or WATCH_DEBOUNCE, args.max_delay or WATCH_MAX_DELAY)
+    finally:
+        watcher.close()
 
-    if len(library.song) == 0:
-        logger.info(f'No song in library. try full scan: library={library}')
-        return scan(args)
 
-    for path in _diff_scan(library):
-        metadata = load_metadata(path)
-        relative_path = library.relative_path(path)
-        song = Song.get_by_path(relative_path, library)
+def search(args):
+    import time
+    from kyofu import session
+    from kyofu.search import SearchIndex, build_index
+
+    library = Library.get_by_name(args.library_name, required=True)
+    if args.rebuild:
+        print(f'Indexed: songs={build_index(library)}')
+    if not args.query:
+        return
+
+    start = time.perf_counter()
+    with SearchIndex.open(library) as index:
+        result = index.search(' '.join(args.query), args.limit, args.offset)
+    elapsed = time.perf_counter() - start
+    songs = {s.song_id: s for s in session.query(Song).filter(Song.song_id.in_([h.song_id for h in result.hits]))}
+    print(f'Total: {result.total} ({elapsed * 1000:.1f}ms)')
+    for hit in result.hits:
+        song = songs.get(hit.song_id)
         if song:
-            print(f'Updated: path={relative_path}')
-            _import_song(library, metadata, song=song)
-        else:
-            print(f'Added: path={relative_path}')
-            song = _import_song(library, metadata)
-            session.add(song)
+            print(f'{hit.score}\t{song.artist} - {song.title} ({song.album})\t{song.file_path}')
+
+
+def browse(args):
+    from kyofu import session
+    from kyofu.model import AlbumSummary, ArtistSummary
+
+    library = Library.get_by_name(args.library_name, required=True)
+    if args.kind == 'albums':
+        query = session.query(AlbumSummary).filter(AlbumSummary.library_id == library.library_id)
+        if args.artist:
+            query = query.filter(AlbumSummary.artist == args.artist)
+        query = query.order_by(AlbumSummary.artist, AlbumSummary.album)
+        for a in query.offset(args.offset).limit(args.limit):
+            years = str(a.min_year) if a.min_year == a.max_year else f'{a.min_year}-{a.max_year}'
+            print(f'{a.artist} - {a.album}\ttracks={a.track_count} discs={a.disc_count} years={years}')
+    else:
+        query = session.query(ArtistSummary).filter(ArtistSummary.library_id == library.library_id)
+        query = query.order_by(ArtistSummary.artist)
+        for a in query.offset(args.offset).limit(args.limit):
+            print(f'{a.artist}\talbums={a.album_count} tracks={a.track_count}')
+
 
+def rebuild_aggregates(args):
+    from kyofu import session
+    from kyofu.aggregate import rebuild_aggregates
+
+    library = Library.get_by_name(args.library_name, required=True)
+    counts = rebuild_aggregates(session, library.library_id)
+    print('Rebuilt: ' + ' '.join(f'{k}={v}' for k, v in counts.items()))
     session.commit()
 
 
 def delete(args):
     from kyofu import session
+    from kyofu.aggregate import refresh_aggregates
+    from kyofu.bulk import delete_songs
+    from kyofu.search import SearchDelta
     from sqlalchemy import or_
-    from kyofu.util import show_proceed_prompt
+    from kyofu.util import prefix_filter, show_proceed_prompt
 
     name = args.library_name
     prefix = args.prefix
@@ -208,9 +819,10 @@ def delete(args):
     query = session.query(Song)
     query = query.filter(Song.library_id == library.library_id)
     query = query.filter(
-        or_(Song.file_path.like(f'{h}%') for h in prefix)
+        or_(*(prefix_filter(Song.file_path, p) for p in prefix))
     )
-    query = query.order_by(Song.album_artist, Song.album)
+    # The file_path index already returns the prefix ranges in this order, so no sort is needed.
+    query = query.order_by(Song.file_path)
     delete_target = query.all()
     if not delete_target:
         print('Nothing to delete')
@@ -220,20 +832,56 @@ def delete(args):
     for t in delete_target:
         print(t.file_path)
     if show_proceed_prompt('Delete continue?'):
-        for t in delete_target:
-            session.delete(t)
+        delete_songs(session, (t.song_id for t in delete_target))
+        refresh_aggregates(session, {(t.library_id, t.album_artist or t.artist, t.album) for t in delete_target})
         # We have already asked y/n so commit without prompt.
         session.commit(force=True)
+        search = SearchDelta.for_library(library)
+        if search:
+            search.delete(t.song_id for t in delete_target)
+            search.commit()
 
 
-def main():
-    from kyofu import current_config
+def create_schema(args):
+    from kyofu import engine
+    from kyofu.model import sqla_metadata
+
+    sqla_metadata.create_all(engine)
+    print(f'Schema created: url={engine.url!r}')
+
+
+def cache(args):
+    from kyofu.cache import MetadataCache
+
+    with MetadataCache.open_default() as metadata_cache:
+        if args.cache_command == 'prune':
+            pruned = metadata_cache.prune(args.max_bytes, args.negative)
+            print(f'Pruned: entries={pruned}')
+        for key, value in metadata_cache.stats().items():
+            print(f'{key}: {value}')
+
+
+def main(argv: Optional[List[str]] = None):
+    from kyofu import configure_logging, current_config
+    from kyofu.stats import profile, stats, write_report
 
-    args = parse_args()
+    configure_logging()
+    args = parse_args(argv)
     if args.yes:
         current_config['auto_commit'] = args.yes
 
-    args.func(args)
+    if args.stats or args.stats_json or args.stats_prometheus:
+        from kyofu import engine
+        from kyofu.stats import instrument_engine
+
+        instrument_engine(engine)
+    try:
+        with profile(args.profile, args.profiler), stats.timer('phase.total'):
+            args.func(args)
+    finally:
+        if args.stats:
+            print(stats.summary())
+        write_report(args.stats_json, args.stats_prometheus)
 
 
 if __name__ == '__main__':
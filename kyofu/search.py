@@ -0,0 +1,396 @@
+import json
+import mmap
+import os
+import struct
+import unicodedata
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from kyofu.exceptions import KyofuError
+
+if TYPE_CHECKING:
+    from kyofu.model import Library
+
+# A trigram index over the normalised title, artist, album, album artist and genre of every song of a library.
+# The base file is written once and memory-mapped read-only:
+#
+#   header, song ids (q), text offsets (Q), trigram keys (q, sorted), posting offsets (Q), postings (I), texts
+#
+# Postings are sorted document numbers, texts are the normalised fields joined by FIELD_SEPARATOR. Syncs
+# append to a delta log next to it, which is folded into a new base file once it grows past
+# SEARCH_DELTA_MAX_BYTES.
+
+SEARCH_FIELDS = ('title', 'artist', 'album', 'album_artist', 'genre')
+FIELD_SEPARATOR = '\x1f'
+_FIELD_WEIGHTS = (8, 4, 2, 2, 1)
+
+_MAGIC = b'KYFS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIIQQ')
+
+
+class SearchIndexError(KyofuError):
+    pass
+
+
+def normalize(text: Optional[str]) -> str:
+    # Case-folded, accents stripped and every run of non-alphanumeric characters collapsed to one space.
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in stripped).split())
+
+
+def document_text(values) -> str:
+    get = values.get if isinstance(values, dict) else lambda f: getattr(values, f)
+    return FIELD_SEPARATOR.join(normalize(get(f)) for f in SEARCH_FIELDS)
+
+
+def _key(trigram: str) -> int:
+    return (ord(trigram[0]) << 42) | (ord(trigram[1]) << 21) | ord(trigram[2])
+
+
+def _trigram_keys(text: str) -> Set[int]:
+    # Each field is padded with a leading space, so ' ab' marks a word starting with 'ab'.
+    keys = set()
+    for value in text.split(FIELD_SEPARATOR):
+        padded = f' {value}'
+        keys.update(_key(padded[i:i + 3]) for i in range(len(padded) - 2))
+    return keys
+
+
+def _query_keys(term: str) -> Optional[List[int]]:
+    if len(term) >= 3:
+        return sorted({_key(term[i:i + 3]) for i in range(len(term) - 2)})
+    if len(term) == 2:
+        return [_key(f' {term}')]
+    return None
+
+
+def _score(text: str, terms: Sequence[str]) -> int:
+    fields = text.split(FIELD_SEPARATOR)
+    score = 0
+    for term in terms:
+        best = 0
+        for weight, value in zip(_FIELD_WEIGHTS, fields):
+            pos = value.find(term)
+            if pos < 0:
+                continue
+            if value == term:
+                weight *= 4
+            elif pos == 0 or value[pos - 1] == ' ':
+                weight *= 2
+            best = max(best, weight)
+        if not best:
+            return 0
+        score += best
+    return score
+
+
+def default_index_path(library: 'Library') -> Path:
+    from hashlib import sha256
+    from kyofu.config import DB_URL, SEARCH_INDEX_DIR
+
+    # Library ids are only unique within one database.
+    database = sha256(DB_URL.encode()).hexdigest()[:12]
+    return Path(SEARCH_INDEX_DIR) / f'{database}-{library.library_id}.idx'
+
+
+def _delta_path(path: Path) -> Path:
+    return path.with_name(path.name + '.delta')
+
+
+@contextmanager
+def _locked(path: Path):
+    import fcntl
+
+    # Shards of a library sync in separate processes; an append must not fall between the read and the
+    # unlink of another process's compaction.
+    with path.with_name(path.name + '.lock').open('a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@dataclass
+class SearchHit:
+    song_id: int
+    score: int
+
+
+@dataclass
+class SearchResult:
+    total: int
+    hits: List[SearchHit] = field(default_factory=list)
+
+
+def write_index(path: Path, documents: Iterable[Tuple[int, str]]) -> int:
+    song_ids = array('q')
+    text_offsets = array('Q', [0])
+    texts = bytearray()
+    postings: Dict[int, array] = {}
+    for number, (song_id, text) in enumerate(sorted(documents)):
+        song_ids.append(song_id)
+        texts += text.encode()
+        text_offsets.append(len(texts))
+        for key in _trigram_keys(text):
+            posting = postings.get(key)
+            if posting is None:
+                posting = postings[key] = array('I')
+            posting.append(number)
+
+    keys = array('q', sorted(postings))
+    posting_offsets = array('Q', [0])
+    total = 0
+    for key in keys:
+        total += len(postings[key])
+        posting_offsets.append(total)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(song_ids), len(keys), total, len(texts)))
+        song_ids.tofile(f)
+        text_offsets.tofile(f)
+        keys.tofile(f)
+        posting_offsets.tofile(f)
+        for key in keys:
+            postings[key].tofile(f)
+        # Pads the postings so that the texts section does not break the 8-byte alignment of a later version.
+        f.write(bytes(-total * 4 % 8))
+        f.write(texts)
+    tmp_path.replace(path)
+    return len(song_ids)
+
+
+def _load_delta(path: Path) -> Dict[int, Optional[str]]:
+    delta = {}
+    try:
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line a writer is still appending.
+                    break
+                delta[entry['song_id']] = entry['text']
+    except FileNotFoundError:
+        pass
+    return delta
+
+
+class SearchIndex:
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            with path.open('rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            raise SearchIndexError(f'search index not built: path={path}')
+        magic, version, doc_count, key_count, posting_count, text_size = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION:
+            raise SearchIndexError(f'unsupported search index: path={path}')
+
+        view = self._view = memoryview(self._mmap)
+        offset = _HEADER.size
+
+        def section(fmt: str, count: int, size: int):
+            nonlocal offset
+            part = view[offset:offset + count * size].cast(fmt)
+            offset += count * size
+            return part
+
+        self._song_ids = section('q', doc_count, 8)
+        self._text_offsets = section('Q', doc_count + 1, 8)
+        self._keys = section('q', key_count, 8)
+        self._posting_offsets = section('Q', key_count + 1, 8)
+        self._postings = section('I', posting_count, 4)
+        offset += -posting_count * 4 % 8
+        self._texts = view[offset:offset + text_size]
+        self.delta = _load_delta(_delta_path(path))
+
+    @staticmethod
+    def open(library: 'Library') -> 'SearchIndex':
+        return SearchIndex(default_index_path(library))
+
+    def __len__(self) -> int:
+        return len(self._song_ids)
+
+    def close(self) -> None:
+        for part in (self._song_ids, self._text_offsets, self._keys, self._posting_offsets, self._postings,
+                     self._texts, self._view):
+            part.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'SearchIndex':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _text(self, number: int) -> str:
+        return bytes(self._texts[self._text_offsets[number]:self._text_offsets[number + 1]]).decode()
+
+    def documents(self) -> Iterator[Tuple[int, str]]:
+        for number, song_id in enumerate(self._song_ids):
+            if song_id not in self.delta:
+                yield song_id, self._text(number)
+        for song_id, text in self.delta.items():
+            if text is not None:
+                yield song_id, text
+
+    def _posting(self, key: int):
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+        return self._postings[self._posting_offsets[i]:self._posting_offsets[i + 1]]
+
+    def _candidates(self, terms: Sequence[str]) -> Iterable[int]:
+        postings = []
+        for term in terms:
+            keys = _query_keys(term)
+            if keys is None:
+                continue
+            for key in keys:
+                posting = self._posting(key)
+                if posting is None:
+                    return []
+                postings.append(posting)
+        if not postings:
+            # Only one-character terms: every document has to be checked.
+            return range(len(self._song_ids))
+        postings.sort(key=len)
+        candidates = postings[0].tolist()
+        # Intersecting with the next shortest lists narrows the candidates quickly; once few are left it is
+        # cheaper to settle the rest by checking the text itself, which is needed for the score anyway.
+        for posting in postings[1:]:
+            if len(candidates) < 64:
+                break
+            if len(posting) > 16 * len(candidates):
+                candidates = [n for n in candidates if _contains(posting, n)]
+            else:
+                candidates = set(candidates).intersection(posting.tolist())
+        return candidates
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> SearchResult:
+        terms = normalize(query).split()
+        if not terms:
+            return SearchResult(0)
+        scored = []
+        for number in self._candidates(terms):
+            song_id = self._song_ids[number]
+            if song_id in self.delta:
+                continue
+            score = _score(self._text(number), terms)
+            if score:
+                scored.append((-score, song_id))
+        for song_id, text in self.delta.items():
+            if text is not None:
+                score = _score(text, terms)
+                if score:
+                    scored.append((-score, song_id))
+        scored.sort()
+        page = scored[offset:offset + limit]
+        return SearchResult(len(scored), [SearchHit(song_id, -score) for score, song_id in page])
+
+
+def _contains(posting, number: int) -> bool:
+    i = bisect_left(posting, number)
+    return i < len(posting) and posting[i] == number
+
+
+def _library_documents(library_id: int, batch_size: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    from kyofu import session
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.model import Song
+
+    columns = [getattr(Song, f) for f in SEARCH_FIELDS]
+    query = session.query(Song.song_id, *columns).filter(Song.library_id == library_id)
+    query = query.execution_options(stream_results=True).yield_per(batch_size or DB_BATCH_SIZE)
+    for song_id, *values in query:
+        yield song_id, FIELD_SEPARATOR.join(normalize(v) for v in values)
+
+
+def build_index(library: 'Library', path: Optional[Path] = None, batch_size: Optional[int] = None) -> int:
+    path = path or default_index_path(library)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Held from the read on, so a sync committing meanwhile appends its changes to the new delta log.
+    with _locked(path):
+        count = write_index(path, _library_documents(library.library_id, batch_size))
+        _delta_path(path).unlink(missing_ok=True)
+    return count
+
+
+def compact_index(path: Path) -> int:
+    with SearchIndex(path) as index:
+        documents = list(index.documents())
+    count = write_index(path, documents)
+    _delta_path(path).unlink(missing_ok=True)
+    return count
+
+
+def search(library: 'Library', query: str, limit: int = 20, offset: int = 0) -> SearchResult:
+    with SearchIndex.open(library) as index:
+        return index.search(query, limit, offset)
+
+
+class SearchDelta:
+    # Collects the changes of a sync and appends them to the delta log once they are committed, so a
+    # rolled back sync leaves the index as it was.
+    def __init__(self, path: Path):
+        self.path = path
+        self._pending: List[Tuple[int, Optional[str]]] = []
+
+    @staticmethod
+    def for_library(library: 'Library') -> Optional['SearchDelta']:
+        path = default_index_path(library)
+        return SearchDelta(path) if path.exists() else None
+
+    def put(self, song_id: int, values) -> None:
+        self._pending.append((song_id, document_text(values)))
+
+    def put_rows(self, session, rows: Sequence[Dict]) -> None:
+        from kyofu.config import DB_BATCH_SIZE
+        from kyofu.model import Song
+        from kyofu.util import chunked, path_hash
+
+        # Upserted rows carry no song_id; look the ids up in the same transaction.
+        by_key = {(r['library_id'], r['file_path']): r for r in rows}
+        for chunk in chunked(by_key, DB_BATCH_SIZE):
+            hashes = {path_hash(file_path) for _, file_path in chunk}
+            query = session.query(Song.song_id, Song.library_id, Song.file_path)
+            query = query.filter(Song.library_id.in_({library_id for library_id, _ in chunk}))
+            query = query.filter(Song.file_path_hash.in_(hashes))
+            for song_id, library_id, file_path in query:
+                row = by_key.get((library_id, file_path))
+                if row is not None:
+                    self.put(song_id, row)
+
+    def delete(self, song_ids: Iterable[int]) -> None:
+        self._pending.extend((song_id, None) for song_id in song_ids)
+
+    def discard(self) -> None:
+        self._pending = []
+
+    def commit(self) -> None:
+        from kyofu.config import SEARCH_DELTA_MAX_BYTES
+
+        if not self._pending:
+            return
+        with _locked(self.path):
+            with _delta_path(self.path).open('a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps({'song_id': i, 'text': t}) + '\n' for i, t in self._pending))
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            self._pending = []
+            # Every search scans the whole log, so it is folded into the base file before it gets slow.
+            if size > SEARCH_DELTA_MAX_BYTES:
+                compact_index(self.path)
@@ -1,8 +1,62 @@
+from pathlib import Path
+
+from sqlalchemy.orm import Session, scoped_session
+
+
+class KyofuSession(Session):
+    def commit(self, force: bool = False):
+        from kyofu import current_config
+        from kyofu.bulk import clear_pending_writes, has_pending_writes
+        from kyofu.util import show_proceed_prompt
+
+        auto_commit = current_config.get('auto_commit', False)
+        if auto_commit or force:
+            super().commit()
+        else:
+            if self.new or self.dirty or self.deleted or has_pending_writes(self):
+                if show_proceed_prompt('Commit?'):
+                    super().commit()
+                else:
+                    self.rollback()
+        clear_pending_writes(self)
+
+
+class KyofuScopedSession(scoped_session):
+    # One session per thread, so that libraries synced concurrently do not share a transaction.
+    def commit(self, force: bool = False):
+        return self.registry().commit(force)
+
+
+def _set_sqlite_pragmas(dbapi_connection, _) -> None:
+    from kyofu.config import SQLITE_PRAGMAS
+
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
+
+
+def create_database_engine(url: str, echo: bool = False):
+    from sqlalchemy import create_engine, event
+
+    from kyofu.config import DB_POOL_SIZE
+
+    options = {}
+    if not url.startswith('sqlite'):
+        # A connection for every library synced concurrently, plus the main thread.
+        options['pool_size'] = DB_POOL_SIZE
+    engine = create_engine(url, echo=echo, **options)
+    if engine.dialect.name == 'sqlite':
+        if engine.url.database not in (None, '', ':memory:'):
+            Path(engine.url.database).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+
 def setup_database_connection():
-    from sqlalchemy import create_engine
     from sqlalchemy.orm import sessionmaker
     from kyofu.config import DB_URL, SQLALCHEMY_ENGINE_ECHO
 
-    engine = create_engine(DB_URL, echo=SQLALCHEMY_ENGINE_ECHO)
-    session = sessionmaker(bind=engine)()
+    engine = create_database_engine(DB_URL, echo=SQLALCHEMY_ENGINE_ECHO)
+    session = KyofuScopedSession(sessionmaker(bind=engine, class_=KyofuSession))
     return engine, session
@@ -0,0 +1,91 @@
+from typing import Optional
+
+# Classifies a file by its first bytes, so that only plausible audio reaches mutagen, and directly the class
+# for its format instead of mutagen.File probing every format it knows. Anything unrecognised is still
+# probed, e.g. an MPEG stream behind leading padding.
+
+SNIFF_BYTES = 64
+
+MP3 = 'mp3'
+FLAC = 'flac'
+MP4 = 'mp4'
+AAC = 'aac'
+UNKNOWN = 'unknown'
+
+AUDIO_KINDS = (MP3, FLAC, MP4, AAC, UNKNOWN)
+
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image'),
+    (b'\x89PNG\r\n\x1a\n', 'image'),
+    (b'GIF87a', 'image'),
+    (b'GIF89a', 'image'),
+    (b'II*\x00', 'image'),
+    (b'MM\x00*', 'image'),
+    (b'%PDF', 'document'),
+    (b'PK\x03\x04', 'archive'),
+    (b'Rar!', 'archive'),
+    (b'7z\xbc\xaf\x27\x1c', 'archive'),
+    (b'\x1f\x8b', 'archive'),
+    # Audio, but not a format the sync stores.
+    (b'OggS', 'unsupported'),
+    (b'RIFF', 'unsupported'),
+    (b'FORM', 'unsupported'),
+    (b'MAC ', 'unsupported'),
+    (b'wvpk', 'unsupported'),
+)
+_ID3_SUFFIXES = {'.flac': FLAC, '.aac': AAC}
+_TEXT_CONTROLS = set(b'\t\n\r\f')
+_UTF_BOMS = (b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')
+
+
+def _mpeg_frame(head: bytes) -> Optional[str]:
+    if len(head) < 4 or head[0] != 0xFF or head[1] & 0xE0 != 0xE0:
+        return None
+    layer = (head[1] >> 1) & 0x03
+    if layer == 0:
+        # ADTS: a 12-bit sync word and layer 0 (ISO/IEC 13818-7).
+        return AAC if head[1] & 0xF0 == 0xF0 else None
+    if layer != 1:
+        # Layers I and II are not stored, and a UTF-16 byte order mark looks like a layer I header.
+        return None
+    version = (head[1] >> 3) & 0x03
+    bitrate = head[2] >> 4
+    sample_rate = (head[2] >> 2) & 0x03
+    if version == 1 or bitrate == 15 or sample_rate == 3:
+        return None
+    return MP3
+
+
+def _is_text(head: bytes) -> bool:
+    # Cue sheets, rip logs, playlists and nfo files: no control bytes, valid UTF-8 or a byte order mark.
+    if head.startswith(_UTF_BOMS):
+        return True
+    if any(b < 0x20 and b not in _TEXT_CONTROLS for b in head):
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the end of the sample.
+        return e.start >= len(head) - 3 and e.reason == 'unexpected end of data'
+    return True
+
+
+def sniff(head: bytes, suffix: str = '') -> str:
+    if not head:
+        return 'empty'
+    if head.startswith(b'ID3'):
+        # Some taggers put an ID3v2 tag in front of FLAC and ADTS streams too.
+        return _ID3_SUFFIXES.get(suffix.lower(), MP3)
+    if head.startswith(b'fLaC'):
+        return FLAC
+    if head[4:8] == b'ftyp':
+        return MP4
+    kind = _mpeg_frame(head)
+    if kind:
+        return kind
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if _is_text(head):
+        return 'text'
+    return UNKNOWN
@@ -0,0 +1,200 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Upper bounds of the histogram buckets in seconds: 1us, 2us, 4us, ... about 134s.
+_BUCKET_BOUNDS = tuple(1e-6 * 2 ** i for i in range(28))
+_PROMETHEUS_PREFIX = 'kyofu_'
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        index = 0 if value <= _BUCKET_BOUNDS[0] else min(math.ceil(math.log2(value / _BUCKET_BOUNDS[0])),
+                                                         len(_BUCKET_BOUNDS))
+        self.buckets[index] += 1
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation, so never an underestimate by more than 2x.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(_BUCKET_BOUNDS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': round(self.quantile(0.5), 6),
+            'p99': round(self.quantile(0.99), 6),
+            'max': round(self.max, 6),
+        }
+
+
+class Stats:
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def as_dict(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'histograms': {k: h.as_dict() for k, h in sorted(self.histograms.items())},
+            }
+
+    def summary(self) -> str:
+        data = self.as_dict()
+        lines = []
+        width = max((len(k) for section in data.values() for k in section), default=0)
+        for name, value in data['counters'].items():
+            lines.append(f'{name:<{width}}  {value}')
+        for name, value in data['gauges'].items():
+            lines.append(f'{name:<{width}}  {value:g}')
+        for name, h in data['histograms'].items():
+            lines.append(f'{name:<{width}}  count={h["count"]} sum={h["sum"]:.3f}s avg={h["avg"] * 1000:.3f}ms '
+                         f'p50={h["p50"] * 1000:.3f}ms p99={h["p99"] * 1000:.3f}ms max={h["max"] * 1000:.3f}ms')
+        return '\n'.join(lines)
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = _metric_name(name) + '_total'
+                lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+            for name, value in sorted(self.gauges.items()):
+                metric = _metric_name(name)
+                lines += [f'# TYPE {metric} gauge', f'{metric} {value}']
+            for name, histogram in sorted(self.histograms.items()):
+                metric = _metric_name(name)
+                lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for bound, count in zip(_BUCKET_BOUNDS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines += [f'{metric}_sum {histogram.sum}', f'{metric}_count {histogram.count}']
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(name: str) -> str:
+    return _PROMETHEUS_PREFIX + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    # The textfile collector may read at any time, so never expose a partially written file.
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_text(content)
+    tmp_path.replace(path)
+
+
+def write_report(json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+    import json
+
+    if json_path:
+        _write_atomic(Path(json_path), json.dumps(stats.as_dict(), indent=2) + '\n')
+    if prometheus_path:
+        _write_atomic(Path(prometheus_path), stats.prometheus())
+
+
+def instrument_engine(engine) -> None:
+    from sqlalchemy import event
+
+    if getattr(engine, '_kyofu_instrumented', False):
+        return
+    engine._kyofu_instrumented = True
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('kyofu_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['kyofu_query_start'].pop()
+        stats.count('db.statements')
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            stats.count('db.rows', cursor.rowcount)
+        stats.observe('db.statement_seconds', elapsed)
+
+
+@contextmanager
+def profile(path: Optional[str], profiler: str = 'cprofile') -> Iterator[None]:
+    if not path:
+        yield
+        return
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            from kyofu.exceptions import KyofuError
+
+            raise KyofuError('pyinstrument is not installed')
+        pyinstrument_profiler = Profiler()
+        pyinstrument_profiler.start()
+        try:
+            yield
+        finally:
+            pyinstrument_profiler.stop()
+            Path(path).write_text(pyinstrument_profiler.output_text(unicode=True))
+    else:
+        import cProfile
+
+        c_profiler = cProfile.Profile()
+        c_profiler.enable()
+        try:
+            yield
+        finally:
+            c_profiler.disable()
+            c_profiler.dump_stats(path)
+
+
+stats = Stats()
@@ -0,0 +1,169 @@
+import struct
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+# Smallest files mutagen accepts for each format, used by the tests and the benchmark library generator.
+# The audio bytes are derived from the file name so that every file has its own content fingerprint.
+
+_MP3_FRAME_HEADER = bytes.fromhex('FFFB9064')  # MPEG-1 layer III, 128 kbps, 44.1 kHz
+_MP3_FRAME_SIZE = 417
+_MP3_FRAME_COUNT = 8
+_AUDIO_SEED_SIZE = 16
+
+
+def _audio_seed(path: Path) -> bytes:
+    from hashlib import sha256
+
+    return sha256(str(path).encode()).digest()[:_AUDIO_SEED_SIZE]
+
+
+def _mp3_bytes(seed: bytes) -> bytes:
+    # The seed goes at the end of the frame, clear of the Xing/Info header mutagen looks for.
+    frame = _MP3_FRAME_HEADER + bytes(_MP3_FRAME_SIZE - len(_MP3_FRAME_HEADER) - len(seed)) + seed
+    return frame * _MP3_FRAME_COUNT
+
+
+def _atom(name: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + name + payload
+
+
+def _full_atom(name: bytes, payload: bytes) -> bytes:
+    return _atom(name, bytes(4) + payload)
+
+
+def _flac_bytes(seed: bytes) -> bytes:
+    sample_rate, channels, bits_per_sample, total_samples = 44100, 2, 16, 44100
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) | total_samples
+    stream_info = struct.pack('>HH', 4096, 4096) + bytes(6) + packed.to_bytes(8, 'big') + bytes(16)
+    # No frames, so the seed follows the metadata blocks where the audio would be.
+    return b'fLaC' + bytes([0x80]) + len(stream_info).to_bytes(3, 'big') + stream_info + seed
+
+
+def _m4a_bytes(seed: bytes) -> bytes:
+    mvhd = _full_atom(b'mvhd', struct.pack('>IIIIIH', 0, 0, 1000, 1000, 0x00010000, 0x0100) + bytes(74)
+                      + struct.pack('>I', 2))
+    mdhd = _full_atom(b'mdhd', struct.pack('>IIIIHH', 0, 0, 44100, 44100, 0x55c4, 0))
+    hdlr = _full_atom(b'hdlr', bytes(4) + b'soun' + bytes(13))
+    esds = _full_atom(b'esds', bytes.fromhex('03190000000411400000000000000000000000000502121006010102'))
+    mp4a = _atom(b'mp4a', bytes(6) + struct.pack('>H', 1) + bytes(8) + struct.pack('>HHHHI', 2, 16, 0, 0, 44100 << 16)
+                 + esds)
+    stbl = _atom(b'stbl', _full_atom(b'stsd', struct.pack('>I', 1) + mp4a))
+    trak = _atom(b'trak', _atom(b'mdia', mdhd + hdlr + _atom(b'minf', stbl)))
+    ftyp = _atom(b'ftyp', b'M4A ' + bytes(4) + b'M4A isom')
+    return ftyp + _atom(b'moov', mvhd + trak) + _atom(b'mdat', seed + bytes(128 - len(seed)))
+
+
+def write_flac(path: Path, **tags: str) -> Path:
+    from mutagen.flac import FLAC
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(_flac_bytes(_audio_seed(path)))
+    flac = FLAC(path)
+    for key, value in tags.items():
+        flac[key] = value
+    flac.save()
+    return path
+
+
+def write_mp3(path: Path, **tags: str) -> Path:
+    from mutagen.easyid3 import EasyID3
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(_mp3_bytes(_audio_seed(path)))
+    id3 = EasyID3()
+    for key, value in tags.items():
+        id3[key] = value
+    id3.save(path)
+    return path
+
+
+def write_m4a(path: Path, **tags: str) -> Path:
+    from mutagen.easymp4 import EasyMP4
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(_m4a_bytes(_audio_seed(path)))
+    mp4 = EasyMP4(path)
+    for key, value in tags.items():
+        mp4[key] = value
+    mp4.save()
+    return path
+
+
+WRITERS: Dict[str, Callable[..., Path]] = {
+    '.flac': write_flac,
+    '.mp3': write_mp3,
+    '.m4a': write_m4a,
+}
+
+
+def write_audio(path: Path, **tags: str) -> Path:
+    return WRITERS[path.suffix](path, **tags)
+
+
+GENRES = ('Rock', 'Pop', 'Jazz', 'Classical', 'Electronic', 'Hip-Hop', 'Folk', 'Metal')
+
+
+def _library_tags(rng, artist: int, album: int, track: int, tracks: int) -> Dict[str, str]:
+    return {
+        'title': f'Track {track:02d}',
+        'album': f'Album {artist:03d}-{album:02d}',
+        'artist': f'Artist {artist:03d}',
+        'albumartist': f'Artist {artist:03d}',
+        'genre': rng.choice(GENRES),
+        'tracknumber': f'{track}/{tracks}',
+        'discnumber': '1/1',
+        'date': str(rng.randint(1960, 2020)),
+    }
+
+
+def _dump(path: Path) -> Path:
+    import pickle
+    from mutagen import File
+
+    # Same layout as scripts/construct_pickle_dump.py: the easy mutagen object next to the file name.
+    with path.open('rb') as f:
+        guess = File(f, easy=True)
+    dump_path = path.with_name(f'{path.name}.pickle')
+    with dump_path.open('wb') as f:
+        pickle.dump(guess, f)
+    path.unlink()
+    return dump_path
+
+
+def generate_library(base_path: Path, artists: int, albums: int, tracks: int,
+                     formats: Sequence[str] = ('.mp3', '.flac', '.m4a'), dump: bool = False,
+                     seed: int = 0) -> List[Path]:
+    import random
+
+    rng = random.Random(seed)
+    paths = []
+    for artist in range(1, artists + 1):
+        for album in range(1, albums + 1):
+            suffix = formats[(artist * albums + album) % len(formats)]
+            album_path = base_path / f'Artist {artist:03d}' / f'Album {album:02d}'
+            for track in range(1, tracks + 1):
+                path = write_audio(album_path / f'{track:02d} Track{suffix}',
+                                   **_library_tags(rng, artist, album, track, tracks))
+                paths.append(_dump(path) if dump else path)
+    return paths
+
+
+def modify_library(paths: Sequence[Path], count: int, seed: int = 0) -> List[Path]:
+    import pickle
+    import random
+    from mutagen import File
+
+    rng = random.Random(seed)
+    modified = sorted(rng.sample(list(paths), min(count, len(paths))))
+    for path in modified:
+        if path.suffix == '.pickle':
+            with path.open('rb') as f:
+                guess = pickle.load(f)
+            guess['title'] = f'{guess["title"][0]} (modified)'
+            with path.open('wb') as f:
+                pickle.dump(guess, f)
+        else:
+            guess = File(path, easy=True)
+            guess['title'] = f'{guess["title"][0]} (modified)'
+            guess.save()
+    return modified
@@ -0,0 +1,281 @@
+import re
+import struct
+from typing import BinaryIO, Dict, List, Optional
+
+# Header-only readers for the fields MetadataExtractor needs. Each reader returns None for anything it
+# does not handle exactly like mutagen's easy interface, and the caller falls back to mutagen.File.
+
+MP3_MIME = ['audio/mp3', 'audio/mpeg']
+FLAC_MIME = ['audio/flac', 'audio/x-flac']
+MP4_MIME = ['audio/mp4', 'audio/x-m4a', 'audio/mpeg4', 'audio/aac']
+
+_MAX_TAG_SIZE = 1024 * 1024
+
+_ID3_FRAMES = {
+    'TIT2': 'title',
+    'TALB': 'album',
+    'TPE1': 'artist',
+    'TPE2': 'albumartist',
+    'TCON': 'genre',
+    'TRCK': 'tracknumber',
+    'TPOS': 'discnumber',
+    'TDRC': 'date',
+}
+_ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+_MP4_ATOMS = {
+    b'\xa9nam': 'title',
+    b'\xa9alb': 'album',
+    b'\xa9ART': 'artist',
+    b'aART': 'albumartist',
+    b'\xa9gen': 'genre',
+    b'\xa9day': 'date',
+}
+_MP4_PAIR_ATOMS = {
+    b'trkn': 'tracknumber',
+    b'disk': 'discnumber',
+}
+_MP4_ILST_PATH = (b'udta', b'meta', b'ilst')
+
+_VORBIS_KEYS = {'title', 'album', 'artist', 'albumartist', 'genre', 'tracknumber', 'discnumber', 'date'}
+
+# mutagen resolves numeric genre references and normalises timestamps, so leave those to it.
+_NUMERIC_GENRE = re.compile(r'^\(|^\d+$')
+_YEAR = re.compile(r'^\d{4}')
+
+
+class TagReaderError(Exception):
+    pass
+
+
+class FastFile:
+    def __init__(self, tags: Dict[str, List[str]], mime: List[str]):
+        self.tags = tags
+        self.mime = mime
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise TagReaderError('unexpected end of file')
+    return data
+
+
+def _synchsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _is_mpeg_layer3_frame(header: bytes) -> bool:
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return False
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate = header[2] >> 4
+    sample_rate = (header[2] >> 2) & 0x03
+    return version != 1 and layer == 1 and bitrate not in (0, 15) and sample_rate != 3
+
+
+def _decode_id3_text(data: bytes) -> List[str]:
+    if not data or data[0] >= len(_ID3_ENCODINGS):
+        raise TagReaderError('unknown text encoding')
+    encoding = _ID3_ENCODINGS[data[0]]
+    text = data[1:].decode(encoding)
+    values = text.split('\x00')
+    while values and not values[-1]:
+        values.pop()
+    return values
+
+
+def read_id3(f: BinaryIO) -> Optional[FastFile]:
+    header = _read_exact(f, 10)
+    major = header[3]
+    flags = header[5]
+    if major not in (3, 4) or flags & 0xC0:
+        # ID3v2.2, unsynchronisation and extended headers are left to mutagen.
+        return None
+    size = _synchsafe(header[6:10])
+    if size > _MAX_TAG_SIZE:
+        return None
+    body = _read_exact(f, size)
+    if not _is_mpeg_layer3_frame(f.read(4)):
+        return None
+
+    tags = {}
+    year = None
+    offset = 0
+    while offset + 10 <= len(body):
+        frame_id = body[offset:offset + 4]
+        if frame_id[0] == 0:
+            break
+        size_bytes = body[offset + 4:offset + 8]
+        if major == 4:
+            if any(b & 0x80 for b in size_bytes):
+                # Some writers store plain integers in v2.4; mutagen guesses which, so leave it to mutagen.
+                return None
+            frame_size = _synchsafe(size_bytes)
+        else:
+            frame_size = struct.unpack('>I', size_bytes)[0]
+        frame_flags = struct.unpack('>H', body[offset + 8:offset + 10])[0]
+        data = body[offset + 10:offset + 10 + frame_size]
+        offset += 10 + frame_size
+        if len(data) != frame_size:
+            raise TagReaderError('truncated frame')
+        name = frame_id.decode('latin-1')
+        if name not in _ID3_FRAMES and name != 'TYER':
+            continue
+        # v2.4: grouping, compression, encryption, unsync, data length; v2.3: compression, encryption, grouping.
+        if frame_flags & (0x004F if major == 4 else 0x00E0):
+            return None
+        key = _ID3_FRAMES.get(name)
+        if key in tags:
+            return None
+        values = _decode_id3_text(data)
+        if name == 'TYER':
+            year = values
+        else:
+            tags[key] = values
+
+    if major == 3 and 'date' not in tags and year:
+        tags['date'] = year
+    genre = tags.get('genre')
+    if genre and any(_NUMERIC_GENRE.search(g) for g in genre):
+        return None
+    date = tags.get('date')
+    if date and not all(_YEAR.match(d) for d in date):
+        return None
+    # mutagen fills frames missing from the ID3v2 tag from a trailing ID3v1 tag; let it do so.
+    if not all(tags.get(k) for k in ('title', 'album', 'artist', 'genre', 'tracknumber', 'date')):
+        return None
+    return FastFile(tags, MP3_MIME)
+
+
+def read_flac(f: BinaryIO) -> Optional[FastFile]:
+    _read_exact(f, 4)
+    first = True
+    while True:
+        header = _read_exact(f, 4)
+        last = header[0] & 0x80
+        block_type = header[0] & 0x7F
+        size = int.from_bytes(header[1:4], 'big')
+        if first and block_type != 0:
+            return None
+        first = False
+        if block_type == 4:
+            if size > _MAX_TAG_SIZE:
+                return None
+            return FastFile(_parse_vorbis_comment(_read_exact(f, size)), FLAC_MIME)
+        if last:
+            return None
+        f.seek(size, 1)
+
+
+def _parse_vorbis_comment(data: bytes) -> Dict[str, List[str]]:
+    (vendor_length,) = struct.unpack_from('<I', data, 0)
+    offset = 4 + vendor_length
+    (count,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+    tags = {}
+    for _ in range(count):
+        (length,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        entry = data[offset:offset + length]
+        offset += length
+        if len(entry) != length:
+            raise TagReaderError('truncated comment')
+        key, sep, value = entry.decode('utf-8').partition('=')
+        if not sep:
+            raise TagReaderError('malformed comment')
+        key = key.lower()
+        if key in _VORBIS_KEYS:
+            tags.setdefault(key, []).append(value)
+    return tags
+
+
+def _iter_atoms(f: BinaryIO, end: Optional[int]):
+    while end is None or f.tell() + 8 <= end:
+        start = f.tell()
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, name = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', _read_exact(f, 8))[0]
+            header_size = 16
+        elif size == 0:
+            return
+        if size < header_size:
+            raise TagReaderError('invalid atom size')
+        yield name, start + header_size, start + size
+        f.seek(start + size)
+
+
+def _find_atom(f: BinaryIO, path: tuple, end: Optional[int] = None) -> Optional[tuple]:
+    for name, data_start, data_end in _iter_atoms(f, end):
+        if name == path[0]:
+            if len(path) == 1:
+                return data_start, data_end
+            f.seek(data_start + (4 if name == b'meta' else 0))
+            return _find_atom(f, path[1:], data_end)
+    return None
+
+
+def read_mp4(f: BinaryIO) -> Optional[FastFile]:
+    f.seek(0)
+    moov = _find_atom(f, (b'moov',))
+    if not moov:
+        return None
+    f.seek(moov[0])
+    if not _find_atom(f, (b'trak',), moov[1]):
+        return None
+    f.seek(moov[0])
+    ilst = _find_atom(f, _MP4_ILST_PATH, moov[1])
+    if not ilst:
+        return None
+    start, end = ilst
+    if end - start > _MAX_TAG_SIZE:
+        return None
+    f.seek(start)
+
+    tags = {}
+    for name, item_start, item_end in list(_iter_atoms(f, end)):
+        if name == b'gnre':
+            return None
+        if name not in _MP4_ATOMS and name not in _MP4_PAIR_ATOMS:
+            continue
+        f.seek(item_start)
+        values = []
+        for data_name, data_start, data_end in list(_iter_atoms(f, item_end)):
+            if data_name != b'data':
+                continue
+            f.seek(data_start)
+            payload = _read_exact(f, data_end - data_start)
+            data_type = struct.unpack('>I', payload[:4])[0] & 0xFFFFFF
+            value = payload[8:]
+            if name in _MP4_PAIR_ATOMS:
+                if len(value) < 6:
+                    return None
+                number, total = struct.unpack('>2H', value[2:6])
+                values.append(f'{number}/{total}' if total else str(number))
+            elif data_type == 1:
+                values.append(value.decode('utf-8'))
+            else:
+                return None
+        key = _MP4_ATOMS.get(name) or _MP4_PAIR_ATOMS[name]
+        tags.setdefault(key, []).extend(values)
+    return FastFile(tags, MP4_MIME)
+
+
+def read_tags(f: BinaryIO) -> Optional[FastFile]:
+    try:
+        head = f.read(12)
+        f.seek(0)
+        if head.startswith(b'ID3'):
+            return read_id3(f)
+        elif head.startswith(b'fLaC'):
+            return read_flac(f)
+        elif head[4:8] == b'ftyp':
+            return read_mp4(f)
+    except (TagReaderError, struct.error, UnicodeDecodeError, OSError):
+        pass
+    return None
@@ -0,0 +1,161 @@
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from kyofu.model import Directory, Library, Song
+from kyofu.walk import ROOT_DIR, WalkFilter, join_path, scan_directory
+
+DirectoryState = Tuple[int, int]
+FileState = Tuple[Optional[int], Optional[int], Optional[int]]
+
+
+@dataclass
+class TreeDiff:
+    changed: List[Path] = field(default_factory=list)
+    existing: Set[str] = field(default_factory=set)
+    deleted: List[Tuple[int, str]] = field(default_factory=list)
+    directories: Dict[str, DirectoryState] = field(default_factory=dict)
+    removed_directories: Set[str] = field(default_factory=set)
+
+
+def parent_dir(rel_path: str) -> str:
+    return str(Path(rel_path).parent)
+
+
+def subtree_filter(rel_dir: str):
+    from sqlalchemy import or_, true
+    from kyofu.util import prefix_filter
+
+    rel_dir = rel_dir.rstrip('/') or ROOT_DIR
+    if rel_dir == ROOT_DIR:
+        return true()
+    return or_(Song.dir_path == rel_dir, prefix_filter(Song.dir_path, f'{rel_dir}/'))
+
+
+def load_directories(library: Library) -> Dict[str, DirectoryState]:
+    from kyofu import session
+
+    query = session.query(Directory.dir_path, Directory.mtime_ns, Directory.inode)
+    query = query.filter(Directory.library_id == library.library_id)
+    return {dir_path: (mtime_ns, inode) for dir_path, mtime_ns, inode in query}
+
+
+def song_directories(library: Library) -> Set[str]:
+    from kyofu import session
+
+    query = session.query(Song.dir_path).filter(Song.library_id == library.library_id).distinct()
+    return {dir_path for (dir_path,) in query}
+
+
+def _songs_in_directory(library: Library, rel_dir: str) -> Dict[str, Tuple[int, FileState]]:
+    from kyofu import session
+
+    query = session.query(Song.song_id, Song.file_path, Song.file_size, Song.mtime_ns, Song.inode)
+    query = query.filter(Song.library_id == library.library_id)
+    query = query.filter(Song.dir_path == rel_dir)
+    return {file_path: (song_id, (size, mtime_ns, inode)) for song_id, file_path, size, mtime_ns, inode in query}
+
+
+def songs_under_directory(library: Library, rel_dir: str) -> List[Tuple[int, str]]:
+    from kyofu import session
+
+    query = session.query(Song.song_id, Song.file_path)
+    query = query.filter(Song.library_id == library.library_id)
+    query = query.filter(subtree_filter(rel_dir))
+    return query.all()
+
+
+def diff_tree(library: Library, deep: bool = False, walk_filter: Optional[WalkFilter] = None) -> TreeDiff:
+    from kyofu.metadata import song_path
+
+    walk_filter = walk_filter or WalkFilter()
+    stored = load_directories(library)
+    # Directories holding songs count as known too: a scan stores no directory states, and a directory removed
+    # before the first update would otherwise never be compared with the listing of its parent.
+    known = set(stored)
+    for d in song_directories(library):
+        while d != ROOT_DIR and d not in known:
+            known.add(d)
+            d = parent_dir(d)
+    children = defaultdict(list)
+    for d in known:
+        if d != ROOT_DIR:
+            children[parent_dir(d)].append(d)
+
+    diff = TreeDiff()
+    stack = [ROOT_DIR]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            stat = os.stat(library.path / rel_dir)
+        except FileNotFoundError:
+            continue
+        state = (stat.st_mtime_ns, stat.st_ino)
+        # The base directory is shared by every shard, so a shard always lists it and leaves its stored
+        # state alone; one shard saving it would hide the changes of the others.
+        shared = walk_filter.shard is not None and rel_dir == ROOT_DIR
+        if not deep and not shared and stored.get(rel_dir) == state:
+            # Nothing was added, removed or renamed here; only the known subdirectories need a look.
+            stack.extend(d for d in children[rel_dir] if walk_filter.accepts_dir(d))
+            continue
+
+        if not shared:
+            diff.directories[rel_dir] = state
+        files, dirs = scan_directory(library.path / rel_dir)
+        songs = _songs_in_directory(library, rel_dir)
+        if shared:
+            songs = {p: song for p, song in songs.items() if walk_filter.in_shard(p)}
+        listed = set()
+        for name, entry in sorted(files.items()):
+            rel_path = join_path(rel_dir, name)
+            if not walk_filter.accepts_file(rel_path):
+                continue
+            song_rel_path = str(song_path(Path(rel_path)))
+            listed.add(song_rel_path)
+            file_stat = entry.stat()
+            song = songs.get(song_rel_path)
+            if song and song[1] == (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino):
+                continue
+            if song:
+                diff.existing.add(song_rel_path)
+            diff.changed.append(library.path / rel_path)
+        # Like the delete pass of a scan, only files that are gone are deleted; an ignored file keeps its row.
+        present = {str(song_path(Path(join_path(rel_dir, name)))) for name in files}
+        for song_rel_path, (song_id, _) in songs.items():
+            if song_rel_path not in listed and song_rel_path not in present:
+                diff.deleted.append((song_id, song_rel_path))
+
+        present_dirs = {join_path(rel_dir, d) for d in dirs}
+        listed_dirs = {d for d in present_dirs if walk_filter.accepts_dir(d)}
+        for child in children[rel_dir]:
+            if not walk_filter.in_shard(child):
+                continue
+            if child not in present_dirs:
+                diff.deleted.extend(songs_under_directory(library, child))
+                diff.removed_directories.update(d for d in stored if d == child or d.startswith(f'{child}/'))
+        stack.extend(sorted(listed_dirs, reverse=True))
+
+    return diff
+
+
+def save_directories(library: Library, diff: TreeDiff, batch_size: Optional[int] = None) -> None:
+    from sqlalchemy import delete, insert
+    from kyofu import session
+    from kyofu.bulk import mark_pending_writes
+    from kyofu.config import DB_BATCH_SIZE
+    from kyofu.util import chunked
+
+    table = Directory.__table__
+    for chunk in chunked(diff.removed_directories | diff.directories.keys(), batch_size or DB_BATCH_SIZE):
+        statement = delete(table).where(table.c.library_id == library.library_id)
+        session.execute(statement.where(table.c.dir_path.in_(chunk)))
+        mark_pending_writes(session)
+    rows = (
+        {'library_id': library.library_id, 'dir_path': d, 'mtime_ns': mtime_ns, 'inode': inode}
+        for d, (mtime_ns, inode) in diff.directories.items()
+    )
+    for chunk in chunked(rows, batch_size or DB_BATCH_SIZE):
+        session.execute(insert(table).values(chunk))
+        mark_pending_writes(session)
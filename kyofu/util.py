@@ -1,9 +1,34 @@
+from typing import Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
 def compile_query(query) -> str:
     from kyofu import engine
 
     return query.statement.compile(engine, compile_kwargs={"literal_binds": True})
 
 
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *_):
+        self.count += 1
+
+    def __enter__(self) -> 'QueryCounter':
+        from sqlalchemy import event
+
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *_):
+        from sqlalchemy import event
+
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
 def show_proceed_prompt(message: str) -> bool:
     try:
         ok = input(f'{message} [y/N] ').strip().lower()
@@ -17,3 +42,43 @@ def escape_for_like(raw: str) -> str:
     escaped = raw.replace('%', r'\%')
     escaped = escaped.replace('_', r'\_')
     return escaped
+
+
+def path_hash(path: str) -> int:
+    from hashlib import sha256
+
+    # 63 bits so that the value fits a signed BIGINT on every backend.
+    return int.from_bytes(sha256(path.encode()).digest()[:8], 'big') & 0x7FFFFFFFFFFFFFFF
+
+
+def prefix_successor(prefix: str) -> Optional[str]:
+    # The smallest string that sorts after every string starting with prefix, in code point order.
+    chars = list(prefix)
+    while chars:
+        code = ord(chars.pop()) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return ''.join(chars) + chr(code)
+    return None
+
+
+def prefix_filter(column, prefix: str):
+    from sqlalchemy import and_
+
+    # A range on the column's index; unlike LIKE it needs no escaping. Assumes a binary collation.
+    successor = prefix_successor(prefix)
+    if successor is None:
+        return column >= prefix
+    return and_(column >= prefix, column < successor)
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
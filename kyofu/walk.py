@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+ROOT_DIR = '.'
+
+
+def join_path(rel_dir: str, name: str) -> str:
+    return name if rel_dir == ROOT_DIR else f'{rel_dir}/{name}'
+
+
+def scan_directory(path: Path) -> Tuple[Dict[str, os.DirEntry], List[str]]:
+    files = {}
+    dirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            # DirEntry carries the d_type from readdir, so this does not stat on most filesystems.
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            elif entry.is_file():
+                files[entry.name] = entry
+    return files, dirs
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    count: int
+
+    @staticmethod
+    def parse(value: str) -> 'Shard':
+        from kyofu.exceptions import KyofuError
+
+        try:
+            index, count = (int(v) for v in value.split('/'))
+        except ValueError:
+            raise KyofuError(f'Invalid shard, expected i/N: {value}') from None
+        if not 0 <= index < count:
+            raise KyofuError(f'Invalid shard, expected 0 <= i < N: {value}')
+        return Shard(index, count)
+
+    @staticmethod
+    def key(rel_path: str) -> str:
+        from kyofu.metadata import song_path
+
+        # Everything below a top-level directory belongs to the same shard, so a shard lists and reconciles
+        # whole subtrees. Files directly in the base directory are spread by their own song path.
+        top, sep, _ = rel_path.partition('/')
+        return top if sep else str(song_path(Path(top)))
+
+    def owns(self, rel_path: str) -> bool:
+        from kyofu.util import path_hash
+
+        return path_hash(self.key(rel_path)) % self.count == self.index
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
+
+
+class WalkFilter:
+    def __init__(self, extensions: Optional[Sequence[str]] = None, ignore: Optional[Sequence[str]] = None,
+                 shard: Optional[Shard] = None):
+        from kyofu.config import WALK_AUDIO_EXTENSIONS, WALK_IGNORE
+
+        extensions = WALK_AUDIO_EXTENSIONS if extensions is None else extensions
+        self.extensions = {e.lower() if e.startswith('.') else f'.{e.lower()}' for e in extensions}
+        self.ignore = tuple(WALK_IGNORE if ignore is None else ignore)
+        self.shard = shard
+
+    def is_ignored(self, rel_path: str) -> bool:
+        name = rel_path.rsplit('/', 1)[-1]
+        return any(fnmatch(name, pattern) or fnmatch(rel_path, pattern) for pattern in self.ignore)
+
+    def in_shard(self, rel_path: str) -> bool:
+        return self.shard is None or self.shard.owns(rel_path)
+
+    def accepts_dir(self, rel_path: str) -> bool:
+        return self.in_shard(rel_path) and not self.is_ignored(rel_path)
+
+    def accepts_file(self, rel_path: str) -> bool:
+        from kyofu.metadata import song_path
+
+        if not self.in_shard(rel_path) or self.is_ignored(rel_path):
+            return False
+        if not self.extensions:
+            return True
+        return song_path(Path(rel_path)).suffix.lower() in self.extensions
+
+
+def walk_roots(path_hint: Optional[Iterable[str]] = None) -> List[str]:
+    # The directories walked for the hints, in walk order. A hint inside another one is walked with it,
+    # so that no file is yielded twice.
+    roots = sorted({h.strip('/') or ROOT_DIR for h in path_hint or []})
+    if not roots or ROOT_DIR in roots:
+        return [ROOT_DIR]
+    result = []
+    for root in roots:
+        if not any(root.startswith(f'{r}/') for r in result):
+            result.append(root)
+    return result
+
+
+def walk_files(base_path: Path, path_hint: Optional[Iterable[str]] = None, walk_filter: Optional[WalkFilter] = None,
+               threads: int = 1) -> Iterator[Path]:
+    walk_filter = walk_filter or WalkFilter()
+    roots = walk_roots(path_hint)
+    roots = [r for r in roots if r == ROOT_DIR or walk_filter.in_shard(r)]
+    if threads <= 1:
+        yield from _walk(base_path, roots, walk_filter, lambda p: _completed(scan_directory, p))
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            yield from _walk(base_path, roots, walk_filter, lambda p: executor.submit(scan_directory, p))
+
+
+def _completed(func, *args) -> Future:
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _walk(base_path: Path, roots: Sequence[str], walk_filter: WalkFilter, submit) -> Iterator[Path]:
+    from kyofu import logger
+    from kyofu.stats import stats
+
+    for root in roots:
+        # Listings of subdirectories are submitted as soon as their parent is read, so the pool
+        # reads ahead while paths are still yielded in the sorted depth-first order of path_order_key.
+        stack = [(root, submit(base_path / root))]
+        while stack:
+            rel_dir, future = stack.pop()
+            try:
+                files, dirs = future.result()
+            except OSError as e:
+                logger.warning(f'Failed to list directory: path={base_path / rel_dir}, error={e}')
+                continue
+            rel_paths = [join_path(rel_dir, name) for name in sorted(files)]
+            accepted = [p for p in rel_paths if walk_filter.accepts_file(p)]
+            stats.count('walk.directories')
+            stats.count('walk.files', len(accepted))
+            stats.count('walk.files_skipped', len(files) - len(accepted))
+            for rel_path in accepted:
+                yield base_path / rel_path
+            children = [join_path(rel_dir, d) for d in sorted(dirs)]
+            children = [c for c in children if walk_filter.accepts_dir(c)]
+            stack.extend((c, submit(base_path / c)) for c in reversed(children))
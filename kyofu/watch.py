@@ -0,0 +1,250 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from kyofu.inotify import (IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DONT_FOLLOW, IN_EXCL_UNLINK, IN_IGNORED,
+                           IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW, Event, Inotify)
+from kyofu.walk import ROOT_DIR, WalkFilter, join_path, scan_directory
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR | IN_DONT_FOLLOW
+              | IN_EXCL_UNLINK)
+
+CHANGED = 'changed'
+DELETED = 'deleted'
+
+RENAME_FILE = 'rename_file'
+RENAME_DIR = 'rename_dir'
+DELETE_DIR = 'delete_dir'
+
+# A rename is reported as IN_MOVED_FROM and IN_MOVED_TO with the same cookie, normally in the same read.
+# A source left unpaired this long was moved out of the library.
+_MOVE_PAIR_TIMEOUT = 0.5
+_POLL_INTERVAL = 1.0
+
+
+def _under(path: str, rel_dir: str) -> bool:
+    return path == rel_dir or path.startswith(f'{rel_dir}/')
+
+
+def _rebase(path: str, old_dir: str, new_dir: str) -> str:
+    return new_dir + path[len(old_dir):]
+
+
+@dataclass
+class WatchBatch:
+    # Renames and directory deletions in the order they happened, then the final state of every other
+    # path touched. Paths are relative to the library and are the raw paths on disk.
+    operations: List[Tuple[str, str, Optional[str]]] = field(default_factory=list)
+    paths: Dict[str, str] = field(default_factory=dict)
+    rescan: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(self.operations or self.paths or self.rescan)
+
+
+class Watcher:
+    def __init__(self, base_path: Path, walk_filter: Optional[WalkFilter] = None, inotify: Optional[Inotify] = None):
+        self.base_path = base_path
+        self.walk_filter = walk_filter or WalkFilter()
+        self.inotify = inotify or Inotify()
+        self._dirs: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+        self._moved_from: Dict[int, Tuple[str, bool, float]] = {}
+        self._batch = WatchBatch()
+        self._first_event: Optional[float] = None
+        self._last_event: Optional[float] = None
+        self._stop = threading.Event()
+
+    def watch_tree(self, rel_dir: str = ROOT_DIR) -> List[str]:
+        from kyofu.stats import stats
+
+        # Watches are added before each listing, so a file created meanwhile is either listed or reported.
+        files = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            wd = self.inotify.add_watch(str(self.base_path / current), WATCH_MASK)
+            if wd is None:
+                continue
+            self._dirs[wd] = current
+            self._wds[current] = wd
+            stats.gauge('watch.directories', len(self._wds))
+            try:
+                names, dirs = scan_directory(self.base_path / current)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            files.extend(p for p in (join_path(current, n) for n in sorted(names)) if self.walk_filter.accepts_file(p))
+            stack.extend(d for d in (join_path(current, n) for n in dirs) if not self.walk_filter.is_ignored(d))
+        return files
+
+    def _forget_tree(self, rel_dir: str, remove: bool) -> None:
+        for path in [d for d in self._wds if _under(d, rel_dir)]:
+            wd = self._wds.pop(path)
+            self._dirs.pop(wd, None)
+            if remove:
+                self.inotify.rm_watch(wd)
+
+    def _rebase_tree(self, old_dir: str, new_dir: str) -> None:
+        # The kernel keeps the watches of a renamed directory; only their paths change.
+        for path in [d for d in self._wds if _under(d, old_dir)]:
+            wd = self._wds.pop(path)
+            self._wds[_rebase(path, old_dir, new_dir)] = wd
+            self._dirs[wd] = _rebase(path, old_dir, new_dir)
+        for path in [p for p in self._batch.paths if _under(p, old_dir)]:
+            self._batch.paths[_rebase(path, old_dir, new_dir)] = self._batch.paths.pop(path)
+
+    def _set(self, rel_path: str, state: str) -> None:
+        self._batch.paths[rel_path] = state
+
+    def _dir_added(self, rel_dir: str) -> None:
+        for p in self.watch_tree(rel_dir):
+            self._set(p, CHANGED)
+
+    def _dir_removed(self, rel_dir: str, remove_watches: bool) -> None:
+        self._forget_tree(rel_dir, remove_watches)
+        for path in [p for p in self._batch.paths if _under(p, rel_dir)]:
+            del self._batch.paths[path]
+        self._batch.operations.append((DELETE_DIR, rel_dir, None))
+
+    def _dir_moved(self, old_dir: str, new_dir: str) -> None:
+        if self.walk_filter.is_ignored(new_dir):
+            self._dir_removed(old_dir, True)
+            return
+        if self.walk_filter.is_ignored(old_dir):
+            self._dir_added(new_dir)
+            return
+        self._rebase_tree(old_dir, new_dir)
+        self._batch.operations.append((RENAME_DIR, old_dir, new_dir))
+
+    def _file_moved(self, old_path: str, new_path: str) -> None:
+        old_accepted = self.walk_filter.accepts_file(old_path)
+        new_accepted = self.walk_filter.accepts_file(new_path)
+        if old_accepted and new_accepted and self._batch.paths.get(old_path) != CHANGED:
+            self._batch.paths.pop(old_path, None)
+            # Whatever the target path held is replaced by the renamed row.
+            self._batch.paths.pop(new_path, None)
+            self._batch.operations.append((RENAME_FILE, old_path, new_path))
+            return
+        # Not in the catalog yet, e.g. a download renamed from its temporary name: read the new path instead.
+        if old_accepted:
+            self._set(old_path, DELETED)
+        if new_accepted:
+            self._set(new_path, CHANGED)
+
+    def handle(self, event: Event) -> None:
+        from kyofu.stats import stats
+
+        now = time.monotonic()
+        stats.count('watch.events')
+        if event.mask & IN_Q_OVERFLOW:
+            # Events were lost, so the tree has to be compared with the catalog again.
+            stats.count('watch.overflows')
+            self._batch.rescan = True
+            self._touch(now)
+            return
+        if event.mask & IN_IGNORED:
+            rel_dir = self._dirs.pop(event.wd, None)
+            if rel_dir is not None and self._wds.get(rel_dir) == event.wd:
+                del self._wds[rel_dir]
+            return
+        rel_dir = self._dirs.get(event.wd)
+        if rel_dir is None or not event.name:
+            return
+        rel_path = join_path(rel_dir, event.name)
+        self._touch(now)
+
+        if event.mask & IN_MOVED_FROM:
+            self._moved_from[event.cookie] = (rel_path, event.is_dir, now)
+        elif event.mask & IN_MOVED_TO:
+            source = self._moved_from.pop(event.cookie, None)
+            if source is None:
+                self._added(rel_path, event.is_dir)
+            elif event.is_dir:
+                self._dir_moved(source[0], rel_path)
+            else:
+                self._file_moved(source[0], rel_path)
+        elif event.is_dir:
+            if event.mask & IN_CREATE and not self.walk_filter.is_ignored(rel_path):
+                self._dir_added(rel_path)
+            elif event.mask & IN_DELETE:
+                self._dir_removed(rel_path, False)
+        elif self.walk_filter.accepts_file(rel_path):
+            if event.mask & IN_CLOSE_WRITE:
+                self._set(rel_path, CHANGED)
+            elif event.mask & IN_DELETE:
+                self._set(rel_path, DELETED)
+
+    def _added(self, rel_path: str, is_dir: bool) -> None:
+        if is_dir:
+            if not self.walk_filter.is_ignored(rel_path):
+                self._dir_added(rel_path)
+        elif self.walk_filter.accepts_file(rel_path):
+            self._set(rel_path, CHANGED)
+
+    def _touch(self, now: float) -> None:
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+
+    def _expire_moves(self, now: float) -> None:
+        for cookie, (rel_path, is_dir, at) in list(self._moved_from.items()):
+            if now - at < _MOVE_PAIR_TIMEOUT:
+                continue
+            del self._moved_from[cookie]
+            if is_dir:
+                self._dir_removed(rel_path, True)
+            elif self.walk_filter.accepts_file(rel_path):
+                self._set(rel_path, DELETED)
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._batch) or bool(self._moved_from)
+
+    def take(self, final: bool = False) -> WatchBatch:
+        # On the final batch nothing else can arrive, so every unpaired rename source counts as moved out.
+        self._expire_moves(float('inf') if final else time.monotonic())
+        batch, self._batch = self._batch, WatchBatch()
+        self._first_event = self._last_event = None
+        if self._moved_from:
+            # Still waiting for the other half of a rename; keep the batch open for it.
+            self._first_event = self._last_event = time.monotonic()
+        return batch
+
+    def poll(self, timeout: Optional[float]) -> None:
+        for event in self.inotify.read(timeout):
+            self.handle(event)
+
+    def due(self, debounce: float, max_delay: float) -> bool:
+        if self._first_event is None:
+            return False
+        now = time.monotonic()
+        return now - self._last_event >= debounce or now - self._first_event >= max_delay
+
+    def run(self, apply: Callable[[WatchBatch], None], debounce: float, max_delay: float) -> None:
+        # A path is applied once its directory has been quiet for the debounce window, so a file that is
+        # written in several steps is read once; max_delay bounds the wait under a constant stream of events.
+        while not self._stop.is_set():
+            timeout = _POLL_INTERVAL
+            if self._first_event is not None:
+                deadline = min(self._last_event + debounce, self._first_event + max_delay)
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            self.poll(timeout)
+            if self.due(debounce, max_delay):
+                batch = self.take()
+                if batch:
+                    apply(batch)
+        if self.pending:
+            apply(self.take(final=True))
+
+    def request_rescan(self) -> None:
+        # Applied with the next batch, at the latest once the debounce window has passed.
+        self._batch.rescan = True
+        self._touch(time.monotonic())
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def close(self) -> None:
+        self.inotify.close()
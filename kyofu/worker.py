@@ -0,0 +1,51 @@
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+EXECUTOR_TYPES = ('process', 'thread')
+
+
+def create_executor(executor_type: str, jobs: int) -> Executor:
+    if executor_type == 'process':
+        return ProcessPoolExecutor(max_workers=jobs)
+    elif executor_type == 'thread':
+        return ThreadPoolExecutor(max_workers=jobs)
+    else:
+        raise ValueError(f'Unknown executor type: {executor_type}')
+
+
+def map_bounded(func: Callable[[T], R], items: Iterable[T], jobs: int = 1, executor_type: str = 'process',
+                ordered: bool = True, buffer_size: int = None) -> Iterator[Tuple[T, R]]:
+    if jobs <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    # Consume items lazily so that a streaming producer is never drained ahead of the workers.
+    buffer_size = buffer_size or jobs * 4
+    with create_executor(executor_type, jobs) as executor:
+        if ordered:
+            in_flight = deque()
+            for item in items:
+                in_flight.append((item, executor.submit(func, item)))
+                if len(in_flight) >= buffer_size:
+                    done_item, future = in_flight.popleft()
+                    yield done_item, future.result()
+            while in_flight:
+                done_item, future = in_flight.popleft()
+                yield done_item, future.result()
+        else:
+            in_flight = {}
+            for item in items:
+                in_flight[executor.submit(func, item)] = item
+                if len(in_flight) >= buffer_size:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield in_flight.pop(future), future.result()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
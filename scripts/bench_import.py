@@ -0,0 +1,49 @@
+HEAVY_MODULES = ('sqlalchemy', 'pymysql', 'mutagen')
+
+
+def parse_args():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=['kyofu', 'kyofu.metadata', 'kyofu.run'])
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    return parser.parse_args()
+
+
+def import_time(module: str):
+    import subprocess
+    import sys
+
+    # -X importtime writes one line per module to stderr: self [us] | cumulative [us] | name
+    code = f'import {module}, sys; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return rows, result.stdout.strip()
+
+
+def main() -> None:
+    import statistics
+
+    args = parse_args()
+    for module in args.modules:
+        totals = []
+        rows, heavy = [], ''
+        for _ in range(args.repeat):
+            rows, heavy = import_time(module)
+            totals.append(next(c for c, _, name in rows if name == module))
+        print('{}: median={:.1f}ms min={:.1f}ms heavy=[{}]'.format(
+            module, statistics.median(totals) / 1000, min(totals) / 1000, heavy
+        ))
+        for cumulative_us, self_us, name in sorted(rows, reverse=True)[:args.top]:
+            print('  {:>8.1f}ms {:>8.1f}ms  {}'.format(cumulative_us / 1000, self_us / 1000, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# Times kyofu.run against the database configured by DB_URL or the DB_* environment variables, e.g. the
+# tools/db compose service: DB_PORT=23306 python scripts/bench_sync.py --artists 20 > result.json
+# or a local SQLite catalog created with `python -m kyofu.run create-schema`.
+# Every operation runs in its own interpreter so that peak RSS and query counts are per operation.
+
+
+def parse_args():
+    from argparse import REMAINDER, ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--artists', type=int, default=10)
+    parser.add_argument('--albums', type=int, default=5)
+    parser.add_argument('--tracks', type=int, default=10)
+    parser.add_argument('--format', action='append', dest='formats', choices=['.mp3', '.flac', '.m4a'])
+    parser.add_argument('--dump', action='store_true', help='write .pickle dumps instead of audio files')
+    parser.add_argument('--changes', type=int, default=10, help='files modified before update')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base-path', help='library directory, a temporary directory by default')
+    parser.add_argument('--keep', action='store_true', help='keep the library rows and files')
+    parser.add_argument('--shards', type=int, default=0, help='also time an overwrite scan split into N processes')
+    parser.add_argument('--child', nargs=REMAINDER, help='internal: run kyofu.run with these arguments')
+    parser.add_argument('--result', help='internal: where the child writes its measurements')
+    return parser.parse_args()
+
+
+def run_child(argv, result_path: str) -> None:
+    import json
+    import time
+    import kyofu
+    from kyofu.run import main
+    from kyofu.util import QueryCounter
+
+    started = time.time()
+    start = time.perf_counter()
+    with QueryCounter(kyofu.engine) as counter:
+        main(argv)
+    seconds = time.perf_counter() - start
+    with open(result_path, 'w') as f:
+        json.dump({'seconds': seconds, 'started': started, 'finished': started + seconds, 'queries': counter.count}, f)
+
+
+def measure(name: str, argv, files: int):
+    return measure_parallel(name, [argv], files)
+
+
+def measure_parallel(name: str, argvs, files: int):
+    import json
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    results = [tempfile.NamedTemporaryFile('r', suffix='.json') for _ in argvs]
+    try:
+        processes = []
+        for argv, result in zip(argvs, results):
+            command = [sys.executable, __file__, '--result', result.name, '--child', *argv]
+            # Answers the full scan and delete prompts; -y covers the commit prompt.
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+            process.stdin.write(b'y\n' * 4)
+            process.stdin.close()
+            processes.append(process)
+        peak_rss_kb = 0
+        for process in processes:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.WEXITSTATUS(status)
+            peak_rss_kb = max(peak_rss_kb, usage.ru_maxrss)
+        if any(p.returncode for p in processes):
+            raise RuntimeError(f'{name} failed: status={[p.returncode for p in processes]}')
+        measured = [json.load(result) for result in results]
+    finally:
+        for result in results:
+            result.close()
+
+    # From the first child starting its work to the last one finishing, without the interpreter starts.
+    seconds = max(m['finished'] for m in measured) - min(m['started'] for m in measured)
+    queries = sum(m['queries'] for m in measured)
+    result = {
+        'operation': name,
+        'files': files,
+        'seconds': round(seconds, 3),
+        'files_per_second': round(files / seconds, 1) if seconds else None,
+        'queries': queries,
+        'queries_per_file': round(queries / files, 3) if files else None,
+        'peak_rss_kb': peak_rss_kb,
+    }
+    if len(measured) > 1:
+        result['processes'] = len(measured)
+        result['slowest_seconds'] = round(max(m['seconds'] for m in measured), 3)
+    return result
+
+
+def cleanup(name: str) -> None:
+    from kyofu import session
+    from kyofu.model import Library, Song
+
+    library = Library.get_by_name(name)
+    if library:
+        session.query(Song).filter(Song.library_id == library.library_id).delete(synchronize_session=False)
+        session.delete(library)
+        session.commit(force=True)
+
+
+def main() -> None:
+    import json
+    import platform
+    import sys
+    import tempfile
+    import time
+    from pathlib import Path
+    from kyofu.synthetic import generate_library, modify_library
+
+    args = parse_args()
+    if args.child:
+        run_child(args.child, args.result)
+        return
+
+    formats = args.formats or ['.mp3', '.flac', '.m4a']
+    tmp = tempfile.TemporaryDirectory()
+    base_path = Path(args.base_path or tmp.name).resolve() / f'library-{args.seed}'
+    name = f'bench-{int(time.time())}-{args.seed}'
+
+    start = time.perf_counter()
+    paths = generate_library(base_path, args.artists, args.albums, args.tracks, formats, args.dump, args.seed)
+    generate_seconds = time.perf_counter() - start
+    first_artist = sorted(p.relative_to(base_path).parts[0] for p in paths)[0]
+    artist_files = sum(1 for p in paths if p.relative_to(base_path).parts[0] == first_artist)
+
+    results = []
+    try:
+        results.append(measure('init', ['-y', 'init', name, str(base_path)], len(paths)))
+        results.append(measure('scan', ['-y', 'scan', name], len(paths)))
+        results.append(measure('scan_overwrite', ['-y', 'scan', name, '--overwrite-song'], len(paths)))
+        if args.shards > 1:
+            argvs = [['-y', 'scan', name, '--overwrite-song', '--shard', f'{i}/{args.shards}']
+                     for i in range(args.shards)]
+            results.append(measure_parallel(f'scan_overwrite_{args.shards}_shards', argvs, len(paths)))
+        # The first update stores the directory states, which init and scan do not; it lists the whole tree.
+        results.append(measure('update_cold', ['-y', 'update', name], len(paths)))
+        # Tags are rewritten in place, which leaves the directory mtimes alone, so only a deep update sees them.
+        changed = modify_library(paths, args.changes, args.seed)
+        results.append(measure('update_deep', ['-y', 'update', '--deep', name], len(changed)))
+        results.append(measure('delete', ['-y', 'delete', name, '--prefix', f'{first_artist}/'], artist_files))
+    finally:
+        if not args.keep:
+            cleanup(name)
+            tmp.cleanup()
+
+    json.dump({
+        'library': {
+            'artists': args.artists,
+            'albums': args.albums,
+            'tracks': args.tracks,
+            'files': len(paths),
+            'formats': formats,
+            'dump': args.dump,
+            'seed': args.seed,
+            'generate_seconds': round(generate_seconds, 3),
+        },
+        'python': platform.python_version(),
+        'results': results,
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+class CountingReader:
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def parse_args():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('base_path')
+    parser.add_argument('-n', '--repeat', type=int, default=1)
+    return parser.parse_args()
+
+
+def measure(paths, read):
+    import time
+
+    bytes_read = 0
+    handled = 0
+    start = time.perf_counter()
+    for p in paths:
+        with p.open('rb') as f:
+            reader = CountingReader(f)
+            if read(reader):
+                handled += 1
+            bytes_read += reader.bytes_read
+    return time.perf_counter() - start, bytes_read, handled
+
+
+def main() -> None:
+    from pathlib import Path
+    from mutagen import File
+    from kyofu.tagreader import read_tags
+    from kyofu.walk import walk_files
+
+    args = parse_args()
+    paths = list(walk_files(Path(args.base_path).resolve()))
+    if not paths:
+        print('no files found')
+        return
+    readers = {
+        'fast': read_tags,
+        'mutagen': lambda f: File(f, easy=True),
+    }
+    for name, read in readers.items():
+        elapsed, bytes_read, handled = 0.0, 0, 0
+        for _ in range(args.repeat):
+            elapsed, bytes_read, handled = measure(paths, read)
+        print('{}: files={} handled={} bytes/file={:.0f} us/file={:.1f}'.format(
+            name, len(paths), handled, bytes_read / len(paths), elapsed / len(paths) * 1e6
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import kyofu.config
+
+# Tests must not read or fill the user's metadata cache.
+kyofu.config.METADATA_CACHE = False
+
+
+def create_test_engine():
+    from kyofu.model import sqla_metadata
+    from kyofu.setup import create_database_engine
+
+    engine = create_database_engine('sqlite://')
+    sqla_metadata.create_all(engine)
+    return engine
+
+
+def bind_session(engine):
+    from kyofu import session
+
+    session.rollback()
+    session.bind = engine
+    # Sessions of other threads, e.g. of libraries synced concurrently, use the same engine.
+    session.session_factory.configure(bind=engine)
+    return session
+
+
+def write_song(path: Path, n: int) -> Path:
+    from kyofu.synthetic import write_audio
+
+    return write_audio(
+        path,
+        title=f'title {n}',
+        album=f'album {n // 10}',
+        artist='artist',
+        genre='genre',
+        tracknumber=str(n % 10 + 1),
+        date='2000',
+    )
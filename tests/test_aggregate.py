@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestAggregates(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine
+        from kyofu import current_config
+
+        current_config['auto_commit'] = True
+        self.session = bind_session(create_test_engine())
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.tmp.cleanup()
+
+    def _library(self):
+        from kyofu.model import Library
+
+        library = Library(name='library', base_path=str(self.base_path / 'library'))
+        self.session.add(library)
+        self.session.commit()
+        return library
+
+    def _albums(self, library):
+        from kyofu.model import AlbumSummary
+
+        query = self.session.query(AlbumSummary).filter(AlbumSummary.library_id == library.library_id)
+        return {(a.artist, a.album): (a.track_count, a.disc_count, a.min_year, a.max_year) for a in query}
+
+    def _artists(self, library):
+        from kyofu.model import ArtistSummary
+
+        query = self.session.query(ArtistSummary).filter(ArtistSummary.library_id == library.library_id)
+        return {a.artist: (a.album_count, a.track_count) for a in query}
+
+    def _assert_consistent(self, library):
+        from kyofu.aggregate import rebuild_aggregates
+
+        albums, artists = self._albums(library), self._artists(library)
+        self.assertEqual(0, rebuild_aggregates(self.session, library.library_id)['differences'])
+        self.assertEqual(albums, self._albums(library))
+        self.assertEqual(artists, self._artists(library))
+
+    def test_sync(self):
+        from support import write_song
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.synthetic import write_audio
+
+        library = self._library()
+        paths = [write_song(library.path / f'{n // 10}' / f'{n}.flac', n) for n in range(25)]
+        write_audio(library.path / 'various' / '1.mp3', title='t', album='album 0', artist='guest',
+                    albumartist='artist', genre='genre', tracknumber='11', discnumber='2', date='2004')
+        _full_sync(library, options=SyncOptions(batch_size=7))
+
+        self.assertEqual({
+            ('artist', 'album 0'): (11, 2, 2000, 2004),
+            ('artist', 'album 1'): (10, 1, 2000, 2000),
+            ('artist', 'album 2'): (5, 1, 2000, 2000),
+        }, self._albums(library))
+        self.assertEqual({'artist': (3, 26)}, self._artists(library))
+        self._assert_consistent(library)
+
+        # Retagging moves a song to another album; deleting the last song of an album removes its row.
+        write_audio(paths[0], title='t', album='other', artist='someone', genre='genre', tracknumber='1',
+                    date='1999')
+        for p in paths[20:]:
+            p.unlink()
+        self.session.expire_all()
+        _full_sync(library, overwrite=True, options=SyncOptions(batch_size=7))
+
+        self.assertEqual({
+            ('artist', 'album 0'): (10, 2, 2000, 2004),
+            ('artist', 'album 1'): (10, 1, 2000, 2000),
+            ('someone', 'other'): (1, 1, 1999, 1999),
+        }, self._albums(library))
+        self.assertEqual({'artist': (2, 20), 'someone': (1, 1)}, self._artists(library))
+        self._assert_consistent(library)
+
+    def test_rolled_back(self):
+        from support import write_song
+        from kyofu.bulk import BatchWriter
+        from kyofu.aggregate import AggregateTracker
+        from kyofu.model import Song
+
+        library = self._library()
+        write_song(library.path / '0.flac', 0)
+        tracker = AggregateTracker()
+        writer = BatchWriter(self.session, aggregates=tracker)
+        writer.upsert(dict(library_id=library.library_id, file_path='0.flac', **Song.path_values('0.flac'),
+                           title='t', album='a', artist='b', album_artist=None, genre='g', track_number=1,
+                           disc_number=1, release_year=2000))
+        writer.flush()
+        self.assertEqual({('b', 'a'): (1, 1, 2000, 2000)}, self._albums(library))
+        self.session.rollback()
+        writer.rolled_back()
+        self.assertEqual(set(), tracker.keys)
+        self.assertEqual({}, self._albums(library))
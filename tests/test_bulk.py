@@ -0,0 +1,84 @@
+import unittest
+from datetime import datetime
+
+
+def _row(n: int) -> dict:
+    return {
+        'library_id': 1,
+        'file_path': f'artist/album/{n:02}.mp3',
+        'title': f'title {n}',
+        'album': 'album',
+        'artist': 'artist',
+        'album_artist': None,
+        'genre': 'genre',
+        'track_number': n,
+        'disc_number': 1,
+        'release_year': 2000,
+        'modified': datetime(2000, 1, 1),
+        'file_size': 1000,
+        'mtime_ns': 946652400000000000,
+        'inode': n,
+    }
+
+
+class TestChunked(unittest.TestCase):
+    def test_chunked(self):
+        from kyofu.util import chunked
+
+        self.assertEqual([], list(chunked([], 3)))
+        self.assertEqual([[0, 1, 2], [3, 4]], list(chunked(range(5), 3)))
+        self.assertEqual([[0, 1, 2]], list(chunked(iter(range(3)), 3)))
+
+
+class TestSongUpsertStatement(unittest.TestCase):
+    def test_mysql(self):
+        from sqlalchemy.dialects import mysql
+        from kyofu.bulk import song_upsert_statement
+
+        statement = song_upsert_statement('mysql', [_row(1), _row(2)])
+        sql = str(statement.compile(dialect=mysql.dialect()))
+        self.assertIn('ON DUPLICATE KEY UPDATE', sql)
+        self.assertIn('title = VALUES(title)', sql)
+        self.assertNotIn('file_path = VALUES(file_path)', sql)
+        self.assertEqual(2, sql.count('(' + ', '.join(['%s'] * 14) + ')'))
+
+    def test_sqlite(self):
+        from sqlalchemy.dialects import sqlite
+        from kyofu.bulk import song_upsert_statement
+
+        statement = song_upsert_statement('sqlite', [_row(1)])
+        sql = str(statement.compile(dialect=sqlite.dialect()))
+        self.assertIn('ON CONFLICT (library_id, file_path) DO UPDATE', sql)
+
+    def test_unknown_dialect(self):
+        from kyofu.bulk import song_upsert_statement
+
+        self.assertIsNone(song_upsert_statement('oracle', [_row(1)]))
+
+
+class TestUpsertSongs(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine
+        from kyofu.model import Library
+
+        self.session = bind_session(create_test_engine())
+        self.session.add_all([Library(name='library1', base_path='/a'), Library(name='library2', base_path='/b')])
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.rollback()
+
+    def test_same_path_in_libraries(self):
+        from kyofu.bulk import _generic_upsert, upsert_songs
+        from kyofu.model import Song
+
+        rows = [dict(_row(1), **Song.path_values(_row(1)['file_path']), library_id=n) for n in (1, 2)]
+        upsert_songs(self.session, [rows[0]])
+        upsert_songs(self.session, [dict(rows[1], title='other')])
+        _generic_upsert(self.session, [dict(rows[0], title='updated')])
+        songs = self.session.query(Song.library_id, Song.title).order_by(Song.library_id).all()
+        self.assertEqual([(1, 'updated'), (2, 'other')], songs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _cache(self, max_bytes: int = 1024 * 1024, **kwargs):
+        from kyofu.cache import MetadataCache
+
+        return MetadataCache(self.base_path / 'cache' / 'metadata.sqlite3', max_bytes, **kwargs)
+
+    def test_hit_and_invalidate(self):
+        from support import write_song
+        from kyofu.metadata import load_metadata
+
+        path = write_song(self.base_path / '1.flac', 1)
+        with self._cache() as cache:
+            first = load_metadata(path, cache)
+            second = load_metadata(path, cache)
+            self.assertEqual(first, second)
+            self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+            write_song(path, 2)
+            self.assertEqual('title 2', load_metadata(path, cache).song.title)
+            self.assertEqual(2, cache.misses)
+
+    def test_negative_entry(self):
+        from kyofu.metadata import load_metadata_many
+
+        path = self.base_path / 'broken.flac'
+        path.write_bytes(b'not audio')
+        with self._cache() as cache:
+            self.assertEqual([(path, None)], list(load_metadata_many([path], cache=cache)))
+            self.assertEqual([(path, None)], list(load_metadata_many([path], cache=cache)))
+            self.assertEqual(1, cache.hits)
+            self.assertEqual(1, cache.stats()['negative_entries'])
+            self.assertEqual(1, cache.prune(negative=True))
+            self.assertEqual(0, cache.stats()['entries'])
+
+    def test_parallel(self):
+        from support import write_song
+        from kyofu.metadata import load_metadata_many
+
+        paths = [write_song(self.base_path / f'{n}.flac', n) for n in range(8)]
+        with self._cache() as cache:
+            first = list(load_metadata_many(paths, jobs=2, executor_type='process', cache=cache))
+            second = list(load_metadata_many(paths, jobs=2, executor_type='process', cache=cache))
+            self.assertEqual(first, second)
+            self.assertEqual(8, cache.hits)
+
+    def test_eviction(self):
+        from support import write_song
+        from kyofu.metadata import load_metadata
+
+        paths = [write_song(self.base_path / f'{n}.flac', n) for n in range(20)]
+        with self._cache(max_bytes=4096) as cache:
+            for p in paths:
+                load_metadata(p, cache)
+            stats = cache.stats()
+            self.assertLessEqual(stats['bytes'], 4096)
+            self.assertLess(stats['entries'], 20)
+            self.assertEqual(0, cache.prune(max_bytes=4096))
+            self.assertGreater(cache.prune(max_bytes=0), 0)
+            self.assertEqual(0, cache.stats()['entries'])
+
+    def test_shared_file(self):
+        from support import write_song
+        from kyofu.metadata import load_metadata
+
+        paths = [write_song(self.base_path / f'{n}.flac', n) for n in range(4)]
+        # Neither a store nor a hit of one cache may keep the other waiting for the write lock.
+        with self._cache(timeout=0.5) as first, self._cache(timeout=0.5) as second:
+            load_metadata(paths[0], first)
+            load_metadata(paths[0], first)
+            load_metadata(paths[1], second)
+            load_metadata(paths[2], first)
+            load_metadata(paths[0], second)
+            self.assertEqual((1, 2), (first.hits, first.misses))
+            self.assertEqual((1, 1), (second.hits, second.misses))
+        with self._cache() as cache:
+            self.assertEqual(3, cache.stats()['entries'])
+
+    def test_locked(self):
+        import sqlite3
+        from support import write_song
+        from kyofu.metadata import load_metadata
+
+        path = write_song(self.base_path / '1.flac', 1)
+        with self._cache(timeout=0.1) as cache:
+            load_metadata(path, cache)
+            write_song(path, 2)
+            connection = sqlite3.connect(str(cache.path))
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                # A locked cache is skipped, not a failed sync.
+                with self.assertLogs('kyofu', 'WARNING'):
+                    self.assertEqual('title 2', load_metadata(path, cache).song.title)
+            finally:
+                connection.rollback()
+                connection.close()
+            # The dropped store is made up by the next miss.
+            self.assertEqual('title 2', load_metadata(path, cache).song.title)
+            load_metadata(path, cache)
+            self.assertEqual((1, 3), (cache.hits, cache.misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
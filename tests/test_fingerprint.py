@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_retag(self):
+        from mutagen import File
+        from support import write_song
+        from kyofu.fingerprint import fingerprint
+
+        for suffix in ['.mp3', '.flac', '.m4a']:
+            path = write_song(self.base_path / f'song{suffix}', 1)
+            before = fingerprint(path)
+            tags = File(path, easy=True)
+            tags['title'] = 'a much longer title than before ' * 10
+            tags.save()
+            self.assertEqual(before, fingerprint(path), suffix)
+
+            moved = path.replace(self.base_path / f'moved{suffix}')
+            self.assertEqual(before, fingerprint(moved), suffix)
+
+    def test_distinct(self):
+        from support import write_song
+        from kyofu.fingerprint import fingerprint
+
+        fingerprints = {fingerprint(write_song(self.base_path / f'{n}.mp3', n)) for n in range(10)}
+        self.assertEqual(10, len(fingerprints))
+
+    def test_sampled(self):
+        from kyofu.fingerprint import fingerprint
+
+        path = self.base_path / 'raw.bin'
+        payload = bytearray(1024 * 1024)
+        path.write_bytes(payload)
+        before = fingerprint(path, sample_size=4096)
+
+        payload[512 * 1024] = 1
+        path.write_bytes(payload)
+        self.assertEqual(before, fingerprint(path, sample_size=4096))
+        payload[-1] = 1
+        path.write_bytes(payload)
+        self.assertNotEqual(before, fingerprint(path, sample_size=4096))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+
+class TestSongIndex(unittest.TestCase):
+    def test_find(self):
+        from kyofu.index import SongIndex
+
+        index = SongIndex()
+        for n in range(100):
+            index.append(n + 1, f'artist/album/{n}.flac')
+        index.freeze()
+
+        self.assertEqual(100, len(index))
+        for n in range(100):
+            pos = index.find(f'artist/album/{n}.flac')
+            self.assertIsNotNone(pos)
+            self.assertEqual(n + 1, index.song_id(pos))
+        self.assertIsNone(index.find('artist/album/100.flac'))
+        self.assertNotIn('artist/album/100.flac', index)
+
+    def test_unseen(self):
+        from kyofu.index import SongIndex
+
+        index = SongIndex()
+        for n in range(10):
+            index.append(n, f'{n}.flac')
+        index.freeze()
+        for n in range(0, 10, 3):
+            index.mark_seen(index.find(f'{n}.flac'))
+
+        self.assertEqual([1, 2, 4, 5, 7, 8], sorted(index.unseen_song_ids()))
+
+    def test_fingerprint(self):
+        from kyofu.index import SongIndex
+
+        index = SongIndex()
+        for n in range(10):
+            index.append(n, f'{n}.flac', n % 5 if n < 8 else None)
+        index.freeze()
+
+        found = set()
+        for _ in range(2):
+            pos = next(index.unseen_fingerprints(1))
+            index.mark_seen(pos)
+            found.add(index.song_id(pos))
+        self.assertEqual({1, 6}, found)
+        self.assertEqual([], list(index.unseen_fingerprints(1)))
+        self.assertEqual([], list(index.unseen_fingerprints(None)))
+        self.assertEqual([], list(index.unseen_fingerprints(7)))
+
+    def test_empty(self):
+        from kyofu.index import SongIndex
+
+        index = SongIndex().freeze()
+        self.assertEqual(0, len(index))
+        self.assertIsNone(index.find('foo'))
+        self.assertEqual([], list(index.unseen_song_ids()))
+
+
+if __name__ == '__main__':
+    unittest.main()
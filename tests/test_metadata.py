@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestMetadataCli(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _run(self, *args: str, stdin: bytes = b''):
+        return subprocess.run([sys.executable, '-m', 'kyofu.metadata', *args], input=stdin, capture_output=True,
+                              check=False)
+
+    def test_batch(self):
+        from support import write_song
+
+        for n in range(5):
+            write_song(self.base_path / 'album' / f'{n}.flac', n)
+        single = write_song(self.base_path / 'single.mp3', 9)
+        broken = self.base_path / 'broken.flac'
+        broken.write_bytes(b'not audio')
+
+        stdin = b'\0'.join(bytes(p) for p in (self.base_path / 'album', broken))
+        result = self._run('-0', '-j', '2', '--executor', 'thread', '-', str(single), stdin=stdin)
+        self.assertEqual(1, result.returncode)
+        lines = [json.loads(line) for line in result.stdout.decode().splitlines()]
+        self.assertEqual(
+            sorted([f'title {n}' for n in range(5)] + ['title 9']),
+            sorted(line['song']['title'] for line in lines),
+        )
+        errors = [json.loads(line) for line in result.stderr.decode().splitlines() if line.startswith('{')]
+        self.assertEqual([str(broken)], [e['path'] for e in errors])
+
+    def test_keep_order(self):
+        from support import write_song
+
+        paths = [write_song(self.base_path / f'{n}.mp3', n) for n in range(8)]
+        result = self._run('-j', '3', '--executor', 'thread', '--keep-order', *map(str, paths))
+        self.assertEqual(0, result.returncode)
+        titles = [json.loads(line)['song']['title'] for line in result.stdout.decode().splitlines()]
+        self.assertEqual([f'title {n}' for n in range(8)], titles)
+
+
+if __name__ == '__main__':
+    unittest.main()
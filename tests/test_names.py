@@ -0,0 +1,76 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestNameResolver(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine
+        from kyofu import current_config
+
+        current_config['auto_commit'] = True
+        self.engine = create_test_engine()
+        self.session = bind_session(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.tmp.cleanup()
+
+    def test_full_sync(self):
+        import kyofu.config
+        from kyofu.model import Album, Artist, Genre, Library, Song
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.synthetic import generate_library
+
+        generate_library(self.base_path, 3, 2, 5)
+        library = Library(name='library', base_path=str(self.base_path))
+        self.session.add(library)
+        self.session.commit()
+
+        kyofu.config.NORMALIZE_NAMES = True
+        try:
+            _full_sync(library, options=SyncOptions(batch_size=10))
+        finally:
+            kyofu.config.NORMALIZE_NAMES = False
+
+        self.assertEqual(3, self.session.query(Artist).count())
+        self.assertEqual(6, self.session.query(Album).count())
+        for song in self.session.query(Song):
+            album = self.session.get(Album, song.album_id)
+            self.assertEqual(song.album, album.name)
+            self.assertEqual(song.artist, self.session.get(Artist, song.artist_id).name)
+            self.assertEqual(song.album_artist_id, album.artist_id)
+            self.assertEqual(song.genre, self.session.get(Genre, song.genre_id).name)
+
+    def test_resolve(self):
+        from kyofu.names import NameResolver
+        from kyofu.model import Album, Artist
+        from kyofu.util import QueryCounter
+
+        rows = [
+            {'artist': 'A', 'album_artist': None, 'album': 'X', 'genre': 'Rock'},
+            {'artist': 'B', 'album_artist': 'A', 'album': 'X', 'genre': 'Rock '},
+            {'artist': 'B', 'album_artist': None, 'album': 'X', 'genre': 'Pop'},
+        ]
+        resolver = NameResolver()
+        resolver.apply(self.session, rows)
+        with QueryCounter(self.engine) as counter:
+            resolver.apply(self.session, [dict(r) for r in rows])
+        self.assertEqual(0, counter.count)
+        self.assertEqual(rows[0]['album_id'], rows[1]['album_id'])
+        self.assertNotEqual(rows[0]['album_id'], rows[2]['album_id'])
+        self.assertEqual(rows[0]['genre_id'], rows[1]['genre_id'])
+        self.assertEqual(rows[0]['artist_id'], rows[1]['album_artist_id'])
+
+        # A fresh cache reads back the ids written by the first one.
+        again = [dict(r) for r in rows]
+        NameResolver().apply(self.session, again)
+        self.assertEqual(rows, again)
+        self.assertEqual(2, self.session.query(Artist).count())
+        self.assertEqual(2, self.session.query(Album).count())
+
+
+if __name__ == '__main__':
+    unittest.main()
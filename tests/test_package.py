@@ -0,0 +1,43 @@
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestLazyImport(unittest.TestCase):
+    def test_metadata_import_is_light(self):
+        code = ('import kyofu.metadata, sys; '
+                'print(",".join(m for m in ("sqlalchemy", "pymysql", "mutagen") if m in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual('', result.stdout.strip())
+
+    def test_session(self):
+        import kyofu
+        from kyofu.setup import KyofuScopedSession, KyofuSession
+
+        self.assertIsInstance(kyofu.session, KyofuScopedSession)
+        self.assertIsInstance(kyofu.session(), KyofuSession)
+        with self.assertRaises(AttributeError):
+            kyofu.missing
+
+
+class TestSqliteEngine(unittest.TestCase):
+    def test_pragmas(self):
+        from kyofu.model import sqla_metadata
+        from kyofu.setup import create_database_engine
+
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_database_engine(f'sqlite:///{Path(tmp) / "catalog" / "kyofu.sqlite3"}')
+            sqla_metadata.create_all(engine)
+            with engine.connect() as connection:
+                self.assertEqual('wal', connection.exec_driver_sql('PRAGMA journal_mode').scalar())
+                self.assertEqual(1, connection.exec_driver_sql('PRAGMA foreign_keys').scalar())
+                rows = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")
+                tables = {name for (name,) in rows}
+            engine.dispose()
+        self.assertLessEqual({'library', 'song', 'sync_checkpoint', 'directory'}, tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import time
+import unittest
+
+
+def _square(items):
+    for n in items:
+        yield n * n
+
+
+class TestPipeline(unittest.TestCase):
+    def test_stages(self):
+        from kyofu.pipeline import Pipeline
+
+        pipeline = Pipeline(4).source('walk', range(100)).stage('parse', _square)
+        self.assertEqual([n * n for n in range(100)], list(pipeline.run('write')))
+        metrics = pipeline.metrics()
+        self.assertEqual(['walk', 'parse', 'write'], list(metrics))
+        self.assertEqual(100, metrics['write']['items'])
+        self.assertLessEqual(metrics['walk']['queue_depth_max'], 4)
+
+    def test_bounded(self):
+        from kyofu.pipeline import Pipeline
+
+        produced = []
+
+        def source():
+            for n in range(100):
+                produced.append(n)
+                yield n
+
+        results = Pipeline(2).source('walk', source()).stage('parse', _square).run('write')
+        self.assertEqual(0, next(results))
+        time.sleep(0.5)
+        # Two bounded queues, one item in each stage and the consumed one.
+        self.assertLessEqual(len(produced), 8)
+        results.close()
+
+    def test_error(self):
+        from kyofu.pipeline import Pipeline
+
+        def failing(items):
+            for n in items:
+                if n == 3:
+                    raise ValueError('broken')
+                yield n
+
+        with self.assertRaises(ValueError):
+            list(Pipeline(2).source('walk', range(10)).stage('parse', failing).run('write'))
+
+
+if __name__ == '__main__':
+    unittest.main()
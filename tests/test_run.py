@@ -0,0 +1,435 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestFullSync(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine
+        from kyofu import current_config
+
+        current_config['auto_commit'] = True
+        self.engine = create_test_engine()
+        self.session = bind_session(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.tmp.cleanup()
+
+    def _library(self, name: str):
+        from kyofu.model import Library
+
+        library = Library(name=name, base_path=str(self.base_path / name))
+        self.session.add(library)
+        self.session.commit()
+        return library
+
+    def _sync_queries(self, song_count: int) -> int:
+        from support import write_song
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.model import Song
+        from kyofu.util import QueryCounter
+
+        library = self._library(f'library{song_count}')
+        paths = [write_song(library.path / library.name / f'{n}.flac', n) for n in range(song_count)]
+        _full_sync(library, options=SyncOptions(batch_size=1000))
+        self.assertEqual(song_count, self.session.query(Song).filter(Song.library_id == library.library_id).count())
+
+        for p in paths[::2]:
+            p.unlink()
+        self.session.expire_all()
+        with QueryCounter(self.engine) as counter:
+            _full_sync(library, options=SyncOptions(batch_size=1000))
+        remaining = self.session.query(Song).filter(Song.library_id == library.library_id).count()
+        self.assertEqual(song_count - len(paths[::2]), remaining)
+        return counter.count
+
+    def test_delete_query_count(self):
+        small = self._sync_queries(10)
+        large = self._sync_queries(100)
+        self.assertEqual(small, large)
+
+    def test_resume(self):
+        from support import write_song
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.walk import walk_files
+        from kyofu.model import Song, SyncCheckpoint
+
+        library = self._library('library')
+        for n in range(20):
+            write_song(library.path / f'{n % 3}' / f'{n}.flac', n)
+        walked = [str(library.relative_path(p)) for p in walk_files(library.path)]
+        self.session.add(SyncCheckpoint(library_id=library.library_id, last_path=walked[9]))
+        self.session.commit()
+
+        _full_sync(library, resume=True, options=SyncOptions(commit_every=4))
+        imported = {s.file_path for s in self.session.query(Song)}
+        self.assertEqual(set(walked[10:]), imported)
+        self.assertIsNone(SyncCheckpoint.get_by_library(library))
+
+    def test_resume_path_hint(self):
+        from support import write_song
+        from kyofu.exceptions import KyofuError
+        from kyofu.model import Song, SyncCheckpoint
+        from kyofu.run import _full_sync
+
+        library = self._library('library')
+        for n in range(6):
+            write_song(library.path / f'{"ab"[n % 2]}' / f'{n}.flac', n)
+        self.session.add(SyncCheckpoint(library_id=library.library_id, last_path='b/3.flac', path_hint='b'))
+        self.session.commit()
+
+        # Files under a/ were never synced by the interrupted scan of b/, so they must not be skipped.
+        with self.assertRaises(KyofuError):
+            _full_sync(library, resume=True)
+        _full_sync(library, path_hint=['b'], resume=True)
+        self.assertEqual({'b/5.flac'}, {s.file_path for s in self.session.query(Song)})
+        self.assertIsNone(SyncCheckpoint.get_by_library(library))
+
+    def test_commit_checkpoint(self):
+        from kyofu.bulk import BatchWriter
+        from kyofu.checkpoint import CommitScheduler
+        from kyofu.model import SyncCheckpoint
+
+        library = self._library('library')
+        scheduler = CommitScheduler(library, BatchWriter(self.session), every=2, interval=3600, enabled=True)
+        scheduler.tick('a.flac')
+        self.assertIsNone(SyncCheckpoint.get_by_library(library))
+        scheduler.tick('b.flac')
+        self.assertEqual('b.flac', SyncCheckpoint.get_by_library(library).last_path)
+        scheduler.finish()
+        self.assertIsNone(SyncCheckpoint.get_by_library(library))
+
+    def test_move(self):
+        from support import write_song
+        from kyofu.run import _full_sync
+        from kyofu.model import Song
+
+        library = self._library('library')
+        for n in range(6):
+            write_song(library.path / 'old' / f'{n}.flac', n)
+        _full_sync(library)
+        song_ids = {s.title: s.song_id for s in self.session.query(Song)}
+
+        (library.path / 'new').mkdir()
+        for n in range(3):
+            (library.path / 'old' / f'{n}.flac').rename(library.path / 'new' / f'{n}.flac')
+        # A copy of a file that stays in place is a new song.
+        (library.path / 'copy.flac').write_bytes((library.path / 'old' / '3.flac').read_bytes())
+        _full_sync(library)
+        self.session.expire_all()
+
+        songs = {s.file_path: s for s in self.session.query(Song)}
+        self.assertEqual({'new/0.flac', 'new/1.flac', 'new/2.flac', 'old/3.flac', 'old/4.flac', 'old/5.flac',
+                          'copy.flac'}, set(songs))
+        for n in range(3):
+            song = songs[f'new/{n}.flac']
+            self.assertEqual(song_ids[f'title {n}'], song.song_id)
+            self.assertEqual('new', song.dir_path)
+        self.assertNotEqual(songs['old/3.flac'].song_id, songs['copy.flac'].song_id)
+
+    def test_move_duplicate(self):
+        from support import write_song
+        from kyofu.run import _full_sync
+        from kyofu.model import Song
+        from kyofu.util import path_hash
+
+        library = self._library('library')
+        names = [f'dup/{n}.flac' for n in range(3)]
+        write_song(library.path / names[0], 0)
+        for name in names[1:]:
+            (library.path / name).write_bytes((library.path / names[0]).read_bytes())
+        _full_sync(library)
+        song_ids = {s.file_path: s.song_id for s in self.session.query(Song)}
+
+        # The copies still in place are not seen yet when a/ is walked, and come first among the matches.
+        moving = max(names, key=path_hash)
+        (library.path / 'a').mkdir()
+        (library.path / moving).rename(library.path / 'a' / 'x.flac')
+        _full_sync(library)
+        self.session.expire_all()
+
+        songs = {s.file_path: s.song_id for s in self.session.query(Song)}
+        self.assertEqual(song_ids[moving], songs['a/x.flac'])
+        self.assertEqual(set(names) - {moving} | {'a/x.flac'}, set(songs))
+
+    def test_overwrite_unchanged(self):
+        from unittest import mock
+        from mutagen.flac import FLAC
+        from support import write_song
+        from kyofu.fingerprint import fingerprint
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.model import Song
+        from kyofu.stats import stats
+
+        library = self._library('library')
+        for n in range(10):
+            write_song(library.path / f'{n}.flac', n)
+        _full_sync(library)
+        flac = FLAC(library.path / '3.flac')
+        flac['title'] = 'retagged'
+        flac.save()
+
+        stats.reset()
+        # Only the changed file has its content read for a fingerprint.
+        with mock.patch('kyofu.fingerprint.fingerprint', side_effect=fingerprint) as fingerprinted:
+            _full_sync(library, overwrite=True, options=SyncOptions(metadata_cache=False))
+        self.assertEqual(1, fingerprinted.call_count)
+        self.assertEqual(1, stats.counters['sync.updated'])
+        self.assertEqual(9, stats.counters['sync.unchanged'])
+        self.assertEqual(1, stats.counters['db.upserted_rows'])
+        self.session.expire_all()
+        song = self.session.query(Song).filter(Song.file_path == '3.flac').one()
+        self.assertEqual('retagged', song.title)
+        self.assertIsNotNone(song.fingerprint)
+
+        stats.reset()
+        with mock.patch('kyofu.fingerprint.fingerprint', side_effect=fingerprint) as fingerprinted:
+            _full_sync(library, overwrite=True, options=SyncOptions(metadata_cache=False))
+        self.assertEqual(0, fingerprinted.call_count)
+        self.assertEqual(10, stats.counters['sync.unchanged'])
+        self.assertNotIn('db.upserted_rows', stats.counters)
+
+
+class TestMultiLibrary(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session
+        from kyofu import current_config
+        from kyofu.model import sqla_metadata
+        from kyofu.setup import create_database_engine
+
+        current_config['auto_commit'] = True
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+        # Every thread has its own session, so an in-memory database would be a different one per thread.
+        self.engine = create_database_engine(f'sqlite:///{self.base_path / "kyofu.sqlite3"}')
+        sqla_metadata.create_all(self.engine)
+        self.session = bind_session(self.engine)
+
+    def tearDown(self):
+        from support import bind_session, create_test_engine
+
+        bind_session(create_test_engine())
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def _libraries(self, count: int):
+        from kyofu.model import Library
+
+        libraries = [Library(name=f'library{n}', base_path=str(self.base_path / f'library{n}')) for n in range(count)]
+        for library in libraries:
+            library.path.mkdir()
+        self.session.add_all(libraries)
+        self.session.commit()
+        return libraries
+
+    def _max_running(self, libraries, devices, run=None):
+        import threading
+        import time
+        from unittest import mock
+        from kyofu.run import _sync_libraries
+
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def sync(library, *args, **kwargs):
+            with lock:
+                running.append(library.name)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(library.name)
+            return {'added': 1}
+
+        with mock.patch('kyofu.run._library_device', lambda library: devices[library.name]):
+            if run:
+                with mock.patch('kyofu.run._full_sync', sync):
+                    run()
+            else:
+                _sync_libraries(libraries, sync, concurrency=4)
+        return max(peak)
+
+    def test_device_limit(self):
+        libraries = self._libraries(4)
+        self.assertEqual(1, self._max_running(libraries, {library.name: 1 for library in libraries}))
+        self.assertEqual(2, self._max_running(libraries, {library.name: n % 2 for n, library in enumerate(libraries)}))
+
+    def test_sqlite_one_at_a_time(self):
+        from unittest import mock
+        from kyofu.run import parse_args
+
+        libraries = self._libraries(3)
+        args = parse_args(['scan', '--all', '--concurrency', '3'])
+        # Concurrent write transactions would fail on SQLite once a sync outlasts busy_timeout.
+        with mock.patch('kyofu.util.show_proceed_prompt', lambda message: True):
+            peak = self._max_running(libraries, {library.name: n for n, library in enumerate(libraries)},
+                                     lambda: args.func(args))
+        self.assertEqual(1, peak)
+
+    def test_shared_metadata_cache(self):
+        from unittest import mock
+        from support import write_song
+        from kyofu.cache import MetadataCache
+        from kyofu.model import Song
+        from kyofu.run import SyncOptions, _full_sync, _sync_libraries
+        from kyofu.stats import stats
+
+        libraries = self._libraries(2)
+        for n, library in enumerate(libraries):
+            for m in range(10):
+                write_song(library.path / f'{n}-{m}.flac', m)
+        cache_path = self.base_path / 'cache' / 'metadata.sqlite3'
+        options = SyncOptions(metadata_cache=True, executor_type='thread')
+
+        # Both syncs run at once and store into the same cache file through their own connections.
+        stats.reset()
+        with mock.patch('kyofu.config.METADATA_CACHE_PATH', str(cache_path)), \
+                mock.patch('kyofu.run._library_device', lambda library: library.name):
+            _sync_libraries(libraries, lambda library: _full_sync(library, overwrite=True, options=options), 2)
+            _sync_libraries(libraries, lambda library: _full_sync(library, overwrite=True, options=options), 2)
+        self.assertEqual(20, stats.counters['parse.cache_hits'])
+        self.assertEqual(20, self.session.query(Song).count())
+        with MetadataCache(cache_path, 1024 * 1024) as cache:
+            self.assertEqual(20, cache.stats()['entries'])
+
+    def test_update_all(self):
+        from contextlib import redirect_stdout
+        from io import StringIO
+        from unittest import mock
+        from support import write_song
+        from kyofu.model import Song
+        from kyofu.run import parse_args
+
+        libraries = self._libraries(3)
+        for n, library in enumerate(libraries):
+            for m in range(5 * (n + 1)):
+                write_song(library.path / f'{n}-{m}.flac', m)
+
+        output = StringIO()
+        args = parse_args(['update', '--all', '--concurrency', '3', '--executor', 'thread'])
+        # Empty libraries fall back to a full scan, which asks first.
+        with redirect_stdout(output), mock.patch('kyofu.util.show_proceed_prompt', lambda message: True):
+            args.func(args)
+        self.assertIn('Summary: libraries=3 failed=0 added=30', output.getvalue())
+        self.session.expire_all()
+        for n, library in enumerate(libraries):
+            count = self.session.query(Song).filter(Song.library_id == library.library_id).count()
+            self.assertEqual(5 * (n + 1), count)
+
+        (libraries[1].path / '1-0.flac').unlink()
+        write_song(libraries[2].path / 'new.flac', 100)
+        output = StringIO()
+        args = parse_args(['update', 'library1', 'library2', '--executor', 'thread'])
+        with redirect_stdout(output):
+            args.func(args)
+        self.assertIn('Summary: libraries=2 failed=0 added=1 updated=0 moved=0 deleted=1', output.getvalue())
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        from kyofu.model import sqla_metadata
+        from kyofu.setup import create_database_engine
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+        self.db_url = f'sqlite:///{self.base_path / "kyofu.sqlite3"}'
+        self.engine = create_database_engine(self.db_url)
+        sqla_metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def _run_shards(self, *argv, shards: int = 3):
+        import os
+        import subprocess
+        import sys
+
+        # Shards on one host share the metadata cache file.
+        env = dict(os.environ, DB_URL=self.db_url, METADATA_CACHE='1',
+                   METADATA_CACHE_PATH=str(self.base_path / 'cache' / 'metadata.sqlite3'),
+                   SEARCH_INDEX_DIR=str(self.base_path / 'index'),
+                   PYTHONPATH=os.pathsep.join(filter(None, [str(Path(__file__).parent.parent),
+                                                            os.environ.get('PYTHONPATH')])))
+        processes = [
+            subprocess.Popen([sys.executable, '-m', 'kyofu.run', '-y', *argv, '--shard', f'{i}/{shards}',
+                              '--executor', 'thread'], env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, text=True)
+            for i in range(shards)
+        ]
+        outputs = [p.communicate('y\n') for p in processes]
+        self.assertEqual([0] * shards, [p.returncode for p in processes])
+        self.assertNotIn('Metadata cache', ''.join(err for _, err in outputs))
+        return ''.join(out for out, _ in outputs)
+
+    def _paths(self):
+        from kyofu.model import Song
+
+        with self.engine.connect() as connection:
+            return sorted(p for (p,) in connection.execute(Song.__table__.select().with_only_columns(Song.file_path)))
+
+    def test_concurrent_shards(self):
+        import re
+        from support import write_song
+        from kyofu.model import Library
+
+        library_path = self.base_path / 'library'
+        names = [f'{d}/{n}.flac' for d in range(8) for n in range(3)] + ['root0.flac', 'root1.flac']
+        for n, name in enumerate(names):
+            write_song(library_path / name, n)
+        with self.engine.begin() as connection:
+            connection.execute(Library.__table__.insert().values(name='library', base_path=str(library_path)))
+
+        output = self._run_shards('scan', 'library')
+        # Every file is added by exactly one shard.
+        self.assertEqual(sorted(names), sorted(re.findall(r'Added: path=\S+/library/(\S+)', output)))
+        self.assertEqual(sorted(names), self._paths())
+
+        for name in ('0/0.flac', '5/1.flac', 'root1.flac'):
+            (library_path / name).unlink()
+        write_song(library_path / '9' / 'new.flac', 100)
+        expected = sorted(set(names) - {'0/0.flac', '5/1.flac', 'root1.flac'} | {'9/new.flac'})
+
+        output = self._run_shards('update', 'library')
+        self.assertEqual(['0/0.flac', '5/1.flac', 'root1.flac'], sorted(re.findall(r'Deleted: path=(\S+)', output)))
+        self.assertEqual(['9/new.flac'], re.findall(r'Added: path=(\S+)', output))
+        self.assertEqual(expected, self._paths())
+
+        output = self._run_shards('--stats', 'scan', 'library', '--overwrite-song', shards=2)
+        self.assertEqual(len(expected), sum(int(n) for n in re.findall(r'^parse\.cache_hits\s+(\d+)$', output, re.M)))
+        self.assertNotIn('Deleted:', output)
+        self.assertNotIn('Added:', output)
+        self.assertEqual(expected, self._paths())
+
+        for name in ('1/0.flac', 'root0.flac'):
+            (library_path / name).unlink()
+        output = self._run_shards('scan', 'library', shards=2)
+        self.assertEqual(['1/0.flac', 'root0.flac'], sorted(re.findall(r'Deleted: path=(\S+)', output)))
+
+
+class TestPathOrderKey(unittest.TestCase):
+    def test_walk_order(self):
+        from support import write_song
+        from kyofu.checkpoint import path_order_key
+        from kyofu.walk import walk_files
+
+        with tempfile.TemporaryDirectory() as tmp:
+            base_path = Path(tmp)
+            for name in ('a b/1.flac', 'a/2.flac', 'a/b/3.flac', 'a/c.flac', 'z.flac', 'a-/4.flac'):
+                write_song(base_path / name, 1)
+            walked = [str(p.relative_to(base_path)) for p in walk_files(base_path)]
+            self.assertEqual(sorted(walked, key=path_order_key), walked)
+            self.assertEqual('z.flac', walked[0])
+
+            # Roots are walked in hint order, which puts a- before a/b although a/b sorts first in a full walk.
+            hints = ['a/b', 'a-', 'a/b/']
+            walked = [str(p.relative_to(base_path)) for p in walk_files(base_path, hints)]
+            self.assertEqual(['a-/4.flac', 'a/b/3.flac'], walked)
+            self.assertEqual(walked, sorted(walked, key=lambda p: path_order_key(p, hints)))
+
+
+if __name__ == '__main__':
+    unittest.main()
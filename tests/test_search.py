@@ -0,0 +1,170 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+def _document(title, artist='', album='', album_artist='', genre=''):
+    from kyofu.search import document_text
+
+    return document_text(dict(title=title, artist=artist, album=album, album_artist=album_artist, genre=genre))
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'library.idx'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _search(self, query, **kwargs):
+        from kyofu.search import SearchIndex
+
+        with SearchIndex(self.path) as index:
+            return index.search(query, **kwargs)
+
+    def test_normalize(self):
+        from kyofu.search import normalize
+
+        self.assertEqual('cafe uber', normalize('  Café   ÜBER! '))
+        self.assertEqual('ab c', normalize('AB_c'))
+        self.assertEqual('', normalize(None))
+
+    def test_ranking(self):
+        from kyofu.search import write_index
+
+        write_index(self.path, [
+            (1, _document('Blue Monday', 'New Order')),
+            (2, _document('Monday Morning', 'Fleetwood Mac')),
+            (3, _document('Sunday', 'Blue Nile', genre='monday')),
+            (4, _document('Friday', 'Someone')),
+        ])
+        result = self._search('monday')
+        self.assertEqual(3, result.total)
+        self.assertEqual(3, result.hits[-1].song_id)
+        self.assertEqual({1, 2}, {h.song_id for h in result.hits[:2]})
+
+        self.assertEqual([1, 3], [h.song_id for h in self._search('BLUE mon').hits])
+        self.assertEqual([3], [h.song_id for h in self._search('nile').hits])
+        self.assertEqual(0, self._search('tuesday').total)
+        self.assertEqual(0, self._search('  ').total)
+
+    def test_short_terms(self):
+        from kyofu.search import write_index
+
+        write_index(self.path, [(1, _document('Xy Song')), (2, _document('Song', 'Axyz')), (3, _document('Q'))])
+        # Two-character terms only match at the start of a word.
+        self.assertEqual([1], [h.song_id for h in self._search('xy').hits])
+        self.assertEqual([2], [h.song_id for h in self._search('axy').hits])
+        self.assertEqual([3], [h.song_id for h in self._search('q').hits])
+
+    def test_pagination(self):
+        from kyofu.search import write_index
+
+        write_index(self.path, [(n, _document(f'song {n}')) for n in range(1, 51)])
+        pages = [self._search('song', limit=20, offset=offset) for offset in (0, 20, 40)]
+        self.assertEqual([50, 50, 50], [p.total for p in pages])
+        self.assertEqual([20, 20, 10], [len(p.hits) for p in pages])
+        self.assertEqual(list(range(1, 51)), [h.song_id for p in pages for h in p.hits])
+
+    def test_delta(self):
+        from kyofu.search import SearchDelta, SearchIndex, write_index
+
+        write_index(self.path, [(1, _document('Alpha')), (2, _document('Beta'))])
+        delta = SearchDelta(self.path)
+        delta.put(2, dict(title='Gamma', artist=None, album=None, album_artist=None, genre=None))
+        delta.put(3, dict(title='Alpha Two', artist=None, album=None, album_artist=None, genre=None))
+        delta.delete([1])
+        self.assertEqual(1, self._search('beta').total)
+
+        delta.commit()
+        self.assertEqual([3], [h.song_id for h in self._search('alpha').hits])
+        self.assertEqual([2], [h.song_id for h in self._search('gamma').hits])
+        self.assertEqual(0, self._search('beta').total)
+
+        delta.put(4, dict(title='Delta', artist=None, album=None, album_artist=None, genre=None))
+        delta.discard()
+        delta.commit()
+        self.assertEqual(0, self._search('delta').total)
+
+        with mock.patch('kyofu.config.SEARCH_DELTA_MAX_BYTES', 0):
+            delta.delete([3])
+            delta.commit()
+        self.assertFalse(self.path.with_name('library.idx.delta').exists())
+        with SearchIndex(self.path) as index:
+            self.assertEqual(1, len(index))
+            self.assertEqual({}, index.delta)
+        self.assertEqual([2], [h.song_id for h in self._search('gamma').hits])
+
+    def test_build_with_concurrent_commit(self):
+        import threading
+        import time
+        from kyofu.search import SearchDelta, build_index, write_index
+
+        write_index(self.path, [(1, _document('Alpha'))])
+        delta = SearchDelta(self.path)
+        delta.put(2, dict(title='Beta', artist=None, album=None, album_artist=None, genre=None))
+        committer = threading.Thread(target=delta.commit)
+
+        def documents(library_id, batch_size):
+            # A sync commits after the rebuild read the database, and before it replaced the files.
+            committer.start()
+            time.sleep(0.2)
+            yield 1, _document('Alpha')
+
+        with mock.patch('kyofu.search._library_documents', documents):
+            build_index(mock.Mock(library_id=1), self.path)
+        committer.join()
+        self.assertEqual([2], [h.song_id for h in self._search('beta').hits])
+
+    def test_missing(self):
+        from kyofu.search import SearchIndex, SearchIndexError
+
+        with self.assertRaises(SearchIndexError):
+            SearchIndex(self.path)
+
+
+class TestSearchSync(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine
+        from kyofu import current_config
+
+        current_config['auto_commit'] = True
+        self.session = bind_session(create_test_engine())
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+        patcher = mock.patch('kyofu.config.SEARCH_INDEX_DIR', str(self.base_path / 'search'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session.rollback()
+        self.tmp.cleanup()
+
+    def test_sync(self):
+        from support import write_song
+        from kyofu.model import Library
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.search import build_index, search
+        from kyofu.synthetic import write_audio
+
+        library = Library(name='library', base_path=str(self.base_path / 'library'))
+        self.session.add(library)
+        self.session.commit()
+        paths = [write_song(library.path / f'{n}.flac', n) for n in range(20)]
+        _full_sync(library, options=SyncOptions())
+        self.assertEqual(20, build_index(library))
+        self.assertEqual(20, search(library, 'title').total)
+
+        paths[3].unlink()
+        write_audio(paths[4], title='Renamed Thing', album='album', artist='artist', genre='genre',
+                    tracknumber='1', date='2000')
+        write_song(library.path / '20.flac', 20)
+        self.session.expire_all()
+        _full_sync(library, overwrite=True, options=SyncOptions())
+
+        self.assertEqual(19, search(library, 'title').total)
+        self.assertEqual(1, search(library, 'renamed thing').total)
+        self.assertEqual(1, search(library, 'title 20').total)
+        self.assertEqual(20, search(library, 'artist').total)
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestSniff(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sniff(self):
+        from kyofu.sniff import sniff
+
+        self.assertEqual('mp3', sniff(b'ID3\x04\x00\x00\x00\x00\x00\x00'))
+        self.assertEqual('flac', sniff(b'ID3\x04\x00\x00\x00\x00\x00\x00', '.FLAC'))
+        self.assertEqual('mp3', sniff(b'\xff\xfb\x90\x64' + bytes(60)))
+        self.assertEqual('aac', sniff(b'\xff\xf1\x50\x80' + bytes(60)))
+        self.assertEqual('flac', sniff(b'fLaC\x00\x00\x00\x22'))
+        self.assertEqual('mp4', sniff(b'\x00\x00\x00\x20ftypM4A '))
+        self.assertEqual('image', sniff(b'\xff\xd8\xff\xe0\x00\x10JFIF'))
+        self.assertEqual('image', sniff(b'\x89PNG\r\n\x1a\n\x00\x00'))
+        self.assertEqual('text', sniff('REM GENRE Rock\r\nFILE "01 Track.flac" WAVE\r\n'.encode()))
+        self.assertEqual('text', sniff(b'#EXTM3U\n#EXTINF:123,Artist - Title\n'))
+        # A multi-byte character cut off at the end of the sample is still text.
+        self.assertEqual('text', sniff('EAC extraction logfile 曲'.encode()[:-1]))
+        self.assertEqual('text', sniff(b'\xff\xfeE\x00A\x00C\x00'))
+        self.assertEqual('unsupported', sniff(b'OggS\x00\x02'))
+        self.assertEqual('empty', sniff(b''))
+        self.assertEqual('unknown', sniff(b'\x00\x00\x00\x00\xff\xfb\x90\x64'))
+
+    def test_load(self):
+        from support import write_song
+        from kyofu.metadata import load_metadata_many
+        from kyofu.stats import stats
+
+        paths = [write_song(self.base_path / f'song{suffix}', n) for n, suffix in enumerate(['.mp3', '.flac', '.m4a'])]
+        for name, data in [('cover.jpg', b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'), ('album.cue', b'FILE "a.flac" WAVE\n'),
+                           ('rip.log', b'Exact Audio Copy V1.0\r\n'), ('broken.mp3', b'\x00' * 100)]:
+            (self.base_path / name).write_bytes(data)
+            paths.append(self.base_path / name)
+
+        stats.reset()
+        loaded = dict(load_metadata_many(paths, jobs=1, executor_type='thread'))
+        self.assertEqual(['title 0', 'title 1', 'title 2'], [loaded[p].song.title for p in paths[:3]])
+        self.assertEqual([None] * 4, [loaded[p] for p in paths[3:]])
+
+        counters = stats.as_dict()['counters']
+        self.assertEqual(1, counters['parse.routed.mp3'])
+        self.assertEqual(1, counters['parse.routed.flac'])
+        self.assertEqual(1, counters['parse.routed.mp4'])
+        self.assertEqual(1, counters['parse.skipped.image'])
+        self.assertEqual(2, counters['parse.skipped.text'])
+        self.assertEqual(1, counters['parse.probed'])
+        self.assertEqual(1, counters['parse.failed'])
@@ -0,0 +1,67 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestStats(unittest.TestCase):
+    def test_histogram(self):
+        from kyofu.stats import Histogram
+
+        histogram = Histogram()
+        for n in range(1, 101):
+            histogram.observe(n / 1000)
+        self.assertEqual(100, histogram.count)
+        self.assertAlmostEqual(5.05, histogram.sum)
+        # Bucket upper bounds are within a factor of two of the true quantile.
+        self.assertTrue(0.05 <= histogram.quantile(0.5) <= 0.1)
+        self.assertTrue(0.099 <= histogram.quantile(0.99) <= 0.1)
+        self.assertEqual(0.1, histogram.quantile(1.0))
+
+    def test_report(self):
+        from kyofu.stats import Stats
+
+        stats = Stats()
+        stats.count('walk.files', 3)
+        stats.count('walk.files')
+        stats.gauge('pipeline.parse.items_per_second', 12.5)
+        with stats.timer('phase.sync'):
+            pass
+
+        data = stats.as_dict()
+        self.assertEqual({'walk.files': 4}, data['counters'])
+        self.assertEqual(1, data['histograms']['phase.sync']['count'])
+        self.assertIn('walk.files', stats.summary())
+
+        prometheus = stats.prometheus().splitlines()
+        self.assertIn('kyofu_walk_files_total 4', prometheus)
+        self.assertIn('kyofu_pipeline_parse_items_per_second 12.5', prometheus)
+        self.assertIn('kyofu_phase_sync_bucket{le="+Inf"} 1', prometheus)
+        self.assertIn('kyofu_phase_sync_count 1', prometheus)
+
+    def test_write_report(self):
+        from kyofu.stats import stats, write_report
+
+        stats.count('test.written')
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path, prometheus_path = Path(tmp) / 'stats.json', Path(tmp) / 'kyofu.prom'
+            write_report(str(json_path), str(prometheus_path))
+            self.assertLessEqual(1, json.loads(json_path.read_text())['counters']['test.written'])
+            self.assertIn('kyofu_test_written_total', prometheus_path.read_text())
+            self.assertEqual(['kyofu.prom', 'stats.json'], sorted(p.name for p in Path(tmp).iterdir()))
+
+    def test_instrument_engine(self):
+        from support import create_test_engine
+        from kyofu.stats import instrument_engine, stats
+
+        engine = create_test_engine()
+        instrument_engine(engine)
+        instrument_engine(engine)
+        before = stats.counters.get('db.statements', 0)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("INSERT INTO library (name, base_path) VALUES ('a', '/a'), ('b', '/b')")
+        self.assertEqual(before + 1, stats.counters['db.statements'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestGenerateLibrary(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _songs(self, base_path: Path, dump: bool):
+        from kyofu.metadata import load_metadata
+        from kyofu.synthetic import generate_library
+
+        paths = generate_library(base_path, 2, 3, 4, dump=dump, seed=42)
+        return [(p.relative_to(base_path), load_metadata(p).song) for p in paths]
+
+    def test_deterministic(self):
+        songs = self._songs(self.base_path / 'a', False)
+        self.assertEqual(24, len(songs))
+        self.assertEqual({'.mp3', '.flac', '.m4a'}, {p.suffix for p, _ in songs})
+        self.assertEqual(songs, self._songs(self.base_path / 'b', False))
+
+    def test_dump(self):
+        audio = self._songs(self.base_path / 'audio', False)
+        dump = self._songs(self.base_path / 'dump', True)
+        self.assertEqual([s for _, s in audio], [s for _, s in dump])
+        self.assertTrue(all(p.suffix == '.pickle' for p, _ in dump))
+
+    def test_modify(self):
+        from kyofu.metadata import load_metadata
+        from kyofu.synthetic import generate_library, modify_library
+
+        paths = generate_library(self.base_path, 1, 2, 5)
+        modified = modify_library(paths, 3)
+        self.assertEqual(3, len(modified))
+        titles = [load_metadata(p).song.title for p in paths]
+        self.assertEqual(3, sum(t.endswith('(modified)') for t in titles))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+_TAGS = {
+    'title': 'タイトル',
+    'album': 'Album',
+    'artist': 'Artist',
+    'albumartist': 'Various Artists',
+    'genre': 'Rock',
+    'tracknumber': '3/12',
+    'discnumber': '2/2',
+    'date': '1999-05-01',
+}
+
+
+class TestReadTags(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _assert_conforms(self, path: Path, fast: bool = True):
+        import kyofu.config
+        from kyofu.metadata import _load_metadata
+        from kyofu.tagreader import read_tags
+
+        with path.open('rb') as f:
+            self.assertEqual(fast, read_tags(f) is not None)
+        try:
+            kyofu.config.FAST_TAG_READER = True
+            fast_metadata = _load_metadata(path)
+            kyofu.config.FAST_TAG_READER = False
+            mutagen_metadata = _load_metadata(path)
+        finally:
+            kyofu.config.FAST_TAG_READER = True
+        self.assertEqual(mutagen_metadata, fast_metadata)
+        return fast_metadata
+
+    def test_formats(self):
+        from kyofu.synthetic import write_audio
+
+        for suffix in ('.mp3', '.flac', '.m4a'):
+            metadata = self._assert_conforms(write_audio(self.base_path / f'song{suffix}', **_TAGS))
+            self.assertEqual('タイトル', metadata.song.title)
+            self.assertEqual((3, 2, 1999), (metadata.song.track_number, metadata.song.disc_number, metadata.song.year))
+
+    def test_multiple_values(self):
+        from kyofu.synthetic import write_flac, write_m4a
+
+        tags = dict(_TAGS, artist=['A', 'B'])
+        self._assert_conforms(write_flac(self.base_path / 'song.flac', **tags))
+        self._assert_conforms(write_m4a(self.base_path / 'song.m4a', **tags))
+
+    def test_id3v23(self):
+        from mutagen.id3 import ID3
+        from kyofu.synthetic import write_mp3
+
+        path = write_mp3(self.base_path / 'song.mp3', **_TAGS)
+        id3 = ID3(path)
+        id3.save(path, v2_version=3)
+        self.assertEqual(1999, self._assert_conforms(path).song.year)
+
+    def test_fallback(self):
+        from kyofu.synthetic import write_flac, write_mp3
+
+        self._assert_conforms(write_mp3(self.base_path / 'genre.mp3', **dict(_TAGS, genre='(17)')), fast=False)
+        self._assert_conforms(write_flac(self.base_path / 'untagged.flac'), fast=False)
+
+        import kyofu.config
+        from kyofu.metadata import MetadataError, _load_metadata
+
+        path = write_mp3(self.base_path / 'missing.mp3', title='t')
+        for fast in (True, False):
+            kyofu.config.FAST_TAG_READER = fast
+            try:
+                with self.assertRaises(MetadataError):
+                    _load_metadata(path)
+            finally:
+                kyofu.config.FAST_TAG_READER = True
+
+        path = self.base_path / 'cover.jpg'
+        path.write_bytes(bytes.fromhex('FFD8FFE0') + bytes(100))
+        with path.open('rb') as f:
+            from kyofu.tagreader import read_tags
+            self.assertIsNone(read_tags(f))
+
+
+if __name__ == '__main__':
+    unittest.main()
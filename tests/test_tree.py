@@ -0,0 +1,208 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestUpdate(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine, write_song
+        from kyofu import current_config
+        from kyofu.model import Library
+        from kyofu.run import _full_sync
+
+        current_config['auto_commit'] = True
+        self.session = bind_session(create_test_engine())
+        self.tmp = tempfile.TemporaryDirectory()
+        self.library = Library(name='library', base_path=str(Path(self.tmp.name).resolve()))
+        self.session.add(self.library)
+        self.session.commit()
+        for n in range(12):
+            write_song(self.library.path / f'{"abc"[n % 3]}' / f'{n}.flac', n)
+        _full_sync(self.library)
+
+    def tearDown(self):
+        self.session.rollback()
+        self.tmp.cleanup()
+
+    def _update(self, deep: bool = False, shard: str = None):
+        from kyofu.run import parse_args
+
+        args = parse_args(['update', 'library'] + (['--deep'] if deep else []) + (['--shard', shard] if shard else []))
+        args.func(args)
+
+    def _paths(self):
+        from kyofu.model import Song
+
+        return {s.file_path for s in self.session.query(Song)}
+
+    def test_diff(self):
+        from support import write_song
+        from kyofu.tree import diff_tree
+
+        self._update()
+        diff = diff_tree(self.library)
+        self.assertEqual([], diff.changed)
+        self.assertEqual([], diff.deleted)
+        self.assertEqual({}, diff.directories)
+
+        write_song(self.library.path / 'a' / '100.flac', 100)
+        (self.library.path / 'b' / '1.flac').unlink()
+        diff = diff_tree(self.library)
+        self.assertEqual([self.library.path / 'a' / '100.flac'], diff.changed)
+        self.assertEqual(['b/1.flac'], [p for _, p in diff.deleted])
+        self.assertEqual({'a', 'b'}, set(diff.directories.keys()))
+
+    def test_update(self):
+        import shutil
+        from support import write_song
+
+        self._update()
+        write_song(self.library.path / 'd' / '100.flac', 100)
+        shutil.rmtree(self.library.path / 'b')
+        self._update()
+
+        expected = {f'{"abc"[n % 3]}/{n}.flac' for n in range(12) if n % 3 != 1} | {'d/100.flac'}
+        self.assertEqual(expected, self._paths())
+
+    def test_removed_before_first_update(self):
+        import shutil
+
+        # The scan in setUp stored no directory states.
+        shutil.rmtree(self.library.path / 'b')
+        self._update(deep=True)
+        self.assertEqual({f'{"abc"[n % 3]}/{n}.flac' for n in range(12) if n % 3 != 1}, self._paths())
+
+        shutil.rmtree(self.library.path / 'c')
+        self._update()
+        self.assertEqual({f'a/{n}.flac' for n in range(0, 12, 3)}, self._paths())
+
+    def test_ignored(self):
+        from unittest import mock
+        from support import write_song
+        from kyofu.run import _full_sync, parse_args
+
+        # Rows from before a directory was ignored, e.g. by the default ignore patterns.
+        write_song(self.library.path / '.d' / '100.flac', 100)
+        with mock.patch('kyofu.config.WALK_IGNORE', []):
+            _full_sync(self.library)
+        expected = self._paths()
+        self.assertIn('.d/100.flac', expected)
+
+        for argv in (['--ignore', 'b', '--deep'], ['--ignore', 'c'], ['--ignore', '*.flac', '--deep'], []):
+            args = parse_args(['update', 'library'] + argv)
+            args.func(args)
+            # Ignored files are not synced, but their rows stay as long as the files exist.
+            self.assertEqual(expected, self._paths())
+
+    def test_deep(self):
+        from mutagen.flac import FLAC
+        from kyofu.model import Song
+
+        self._update()
+        path = self.library.path / 'c' / '2.flac'
+        flac = FLAC(path)
+        flac['title'] = 'retagged'
+        flac.save()
+
+        self._update()
+        self.assertEqual('title 2', self.session.query(Song).filter(Song.file_path == 'c/2.flac').one().title)
+        self._update(deep=True)
+        self.session.expire_all()
+        self.assertEqual('retagged', self.session.query(Song).filter(Song.file_path == 'c/2.flac').one().title)
+
+    def test_move(self):
+        from kyofu.model import Song
+
+        self._update()
+        song_ids = {s.file_path: s.song_id for s in self.session.query(Song)}
+        (self.library.path / 'a' / '0.flac').rename(self.library.path / 'b' / 'moved.flac')
+        (self.library.path / 'c').rename(self.library.path / 'd')
+        self._update()
+        self.session.expire_all()
+
+        songs = {s.file_path: s.song_id for s in self.session.query(Song)}
+        self.assertEqual(12, len(songs))
+        self.assertEqual(song_ids['a/0.flac'], songs['b/moved.flac'])
+        for n in range(2, 12, 3):
+            self.assertEqual(song_ids[f'c/{n}.flac'], songs[f'd/{n}.flac'])
+
+    def test_shards(self):
+        import shutil
+        from support import write_song
+        from kyofu.tree import diff_tree
+        from kyofu.walk import Shard
+
+        self._update()
+        expected = self._paths()
+        changed = {}
+        for name in ('d/100.flac', '101.flac', 'e/f/102.flac'):
+            write_song(self.library.path / name, 100)
+            changed[name] = True
+        for name in ('a/0.flac', 'c/2.flac'):
+            (self.library.path / name).unlink()
+            changed[name] = False
+        shutil.rmtree(self.library.path / 'b')
+        changed.update((p, False) for p in expected if p.startswith('b/'))
+
+        for i in range(2):
+            shard = Shard(i, 2)
+            self._update(shard=str(shard))
+            # Changes of the other shard are neither applied nor mistaken for deletions.
+            for name, exists in changed.items():
+                if shard.owns(name) or i == 1:
+                    (expected.add if exists else expected.discard)(name)
+            self.assertEqual(expected, self._paths())
+
+        diff = diff_tree(self.library)
+        self.assertEqual(([], []), (diff.changed, diff.deleted))
+
+
+class TestPathColumns(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine
+        from kyofu.model import Library, Song
+
+        self.session = bind_session(create_test_engine())
+        self.library = Library(name='library', base_path='/music')
+        self.session.add(self.library)
+        self.session.flush()
+        for file_path in ['1.mp3', 'a/1.mp3', 'a/b/1.mp3', 'a%/1.mp3', 'a_b/1.mp3', 'ab/1.mp3', 'a b/1.mp3']:
+            self.session.add(Song(library_id=self.library.library_id, file_path=file_path, title=file_path,
+                                  album='album', artist='artist', genre='genre', track_number=1, disc_number=1,
+                                  release_year=2000, **Song.path_values(file_path)))
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.rollback()
+
+    def _paths(self, criterion):
+        from kyofu.model import Song
+
+        return sorted(p for p, in self.session.query(Song.file_path).filter(criterion))
+
+    def test_path_values(self):
+        from kyofu.model import Song
+        from kyofu.util import path_hash
+
+        self.assertEqual({'dir_path': '.', 'file_path_hash': path_hash('1.mp3')}, Song.path_values('1.mp3'))
+        self.assertEqual('a/b', Song.path_values('a/b/1.mp3')['dir_path'])
+
+    def test_subtree_filter(self):
+        from kyofu.model import Song
+        from kyofu.tree import subtree_filter
+
+        self.assertEqual(['a/1.mp3', 'a/b/1.mp3'], self._paths(subtree_filter('a')))
+        self.assertEqual(['a/1.mp3', 'a/b/1.mp3'], self._paths(subtree_filter('a/')))
+        self.assertEqual(['a%/1.mp3'], self._paths(subtree_filter('a%')))
+        self.assertEqual(['a_b/1.mp3'], self._paths(subtree_filter('a_b')))
+        self.assertEqual(7, len(self._paths(subtree_filter('.'))))
+        self.assertEqual(['1.mp3'], self._paths(Song.dir_path == '.'))
+
+    def test_get_by_path(self):
+        from kyofu.model import Song
+
+        self.assertEqual('a%/1.mp3', Song.get_by_path('a%/1.mp3', self.library).file_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
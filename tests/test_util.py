@@ -15,5 +15,17 @@ class TestEscape(unittest.TestCase):
         self.assertEqual('foo__bar', escape_for_like(r'foo\_\_bar'))
 
 
+class TestPrefixSuccessor(unittest.TestCase):
+    def test_prefix_successor(self):
+        from kyofu.util import prefix_successor
+
+        self.assertEqual('b', prefix_successor('a'))
+        self.assertEqual('a/b0', prefix_successor('a/b/'))
+        self.assertEqual('a\ue000', prefix_successor('a\ud7ff'))
+        self.assertEqual('b', prefix_successor('a\U0010ffff'))
+        self.assertIsNone(prefix_successor(''))
+        self.assertIsNone(prefix_successor('\U0010ffff'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestWalkFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name)
+        for name in ('b/2.flac', 'b/cover.jpg', 'a/1.MP3', 'a/c/3.m4a', 'a/c/3.cue', 'z.flac.pickle',
+                     '.git/x.flac', 'a/skip/4.flac', 'd/5.flac'):
+            path = self.base_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _walk(self, **kwargs):
+        from kyofu.walk import walk_files
+
+        return [str(p.relative_to(self.base_path)) for p in walk_files(self.base_path, **kwargs)]
+
+    def test_filter(self):
+        from kyofu.walk import WalkFilter
+
+        walk_filter = WalkFilter(ignore=['.*', 'skip'])
+        expected = ['z.flac.pickle', 'a/1.MP3', 'a/c/3.m4a', 'b/2.flac', 'd/5.flac']
+        self.assertEqual(expected, self._walk(walk_filter=walk_filter))
+        self.assertEqual(expected, self._walk(walk_filter=walk_filter, threads=4))
+
+    def test_path_hint(self):
+        from kyofu.walk import WalkFilter
+
+        walk_filter = WalkFilter(extensions=[], ignore=[])
+        self.assertEqual(['b/2.flac', 'b/cover.jpg', 'd/5.flac'],
+                         self._walk(path_hint=['d', 'b'], walk_filter=walk_filter))
+        # A hint inside another one is not walked twice.
+        self.assertEqual(['a/c/3.cue', 'a/c/3.m4a'], self._walk(path_hint=['a/c', 'a/c/'], walk_filter=walk_filter))
+        self.assertEqual(4, len(self._walk(path_hint=['a', 'a/c'], walk_filter=walk_filter)))
+
+    def test_missing_directory(self):
+        self.assertEqual([], self._walk(path_hint=['missing']))
+
+    def test_streaming(self):
+        from kyofu.walk import walk_files
+
+        walker = walk_files(self.base_path, threads=2)
+        self.assertEqual(self.base_path / 'z.flac.pickle', next(walker))
+        walker.close()
+
+
+class TestShard(unittest.TestCase):
+    def test_parse(self):
+        from kyofu.exceptions import KyofuError
+        from kyofu.walk import Shard
+
+        self.assertEqual(Shard(1, 4), Shard.parse('1/4'))
+        self.assertEqual('1/4', str(Shard(1, 4)))
+        for value in ('4/4', '-1/4', '1', 'a/b', '0/0'):
+            with self.assertRaises(KyofuError):
+                Shard.parse(value)
+
+    def test_partition(self):
+        from kyofu.walk import Shard, WalkFilter, walk_files
+
+        with tempfile.TemporaryDirectory() as tmp:
+            base_path = Path(tmp)
+            names = [f'{d}/{n}/{m}.flac' for d in range(10) for n in range(2) for m in range(2)]
+            names += [f'{n}.flac' for n in range(10)] + ['z.flac.pickle']
+            for name in names:
+                path = base_path / name
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+
+            walked = []
+            for i in range(3):
+                shard = Shard(i, 3)
+                files = walk_files(base_path, walk_filter=WalkFilter(shard=shard))
+                paths = [str(p.relative_to(base_path)) for p in files]
+                self.assertTrue(paths)
+                # A top-level directory is never split between shards.
+                self.assertEqual(len({p.split('/')[0] for p in paths if '/' in p}) * 4, sum('/' in p for p in paths))
+                self.assertTrue(all(shard.owns(p) for p in paths))
+                walked.extend(paths)
+            self.assertEqual(sorted(names), sorted(walked))
+        # A dump lands in the shard of the song it stands for.
+        self.assertEqual('z.flac', Shard.key('z.flac.pickle'))
+        self.assertEqual('a', Shard.key('a/b/c.flac'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        from support import write_song
+        from kyofu.watch import Watcher
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.tmp.name).resolve()
+        for n in range(6):
+            write_song(self.base_path / f'{"ab"[n % 2]}' / f'{n}.flac', n)
+        self.watcher = Watcher(self.base_path)
+        self.watcher.watch_tree()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp.cleanup()
+
+    def _take(self):
+        for _ in range(3):
+            self.watcher.poll(0.05)
+        return self.watcher.take(final=True)
+
+    def test_events(self):
+        from support import write_song
+        from kyofu.watch import CHANGED, DELETED, DELETE_DIR, RENAME_DIR, RENAME_FILE
+
+        path = self.base_path / 'a' / '0.flac'
+        path.rename(self.base_path / 'b' / 'moved.flac')
+        (self.base_path / 'b').rename(self.base_path / 'c')
+        write_song(self.base_path / 'd' / 'e' / '100.flac', 100)
+        (self.base_path / 'a' / '2.flac').unlink()
+        write_song(self.base_path / 'c' / '1.flac', 1)
+        (self.base_path / '.ignored.flac').write_bytes(b'')
+        (self.base_path / 'a' / '4.flac').rename(self.base_path / 'a' / '4.flac.tmp')
+        batch = self._take()
+
+        self.assertEqual([(RENAME_FILE, 'a/0.flac', 'b/moved.flac'), (RENAME_DIR, 'b', 'c')], batch.operations)
+        self.assertEqual({'d/e/100.flac': CHANGED, 'a/2.flac': DELETED, 'c/1.flac': CHANGED,
+                          'a/4.flac': DELETED}, batch.paths)
+        self.assertFalse(batch.rescan)
+
+        # Watches follow the renamed directory and cover the new one.
+        write_song(self.base_path / 'c' / '200.flac', 200)
+        write_song(self.base_path / 'd' / 'e' / '201.flac', 201)
+        self.assertEqual({'c/200.flac': CHANGED, 'd/e/201.flac': CHANGED}, self._take().paths)
+
+        import shutil
+        shutil.rmtree(self.base_path / 'd')
+        batch = self._take()
+        self.assertIn((DELETE_DIR, 'd', None), batch.operations)
+
+    def test_moved_out(self):
+        from kyofu.watch import DELETE_DIR, DELETED
+
+        with tempfile.TemporaryDirectory() as outside:
+            (self.base_path / 'a').rename(Path(outside) / 'a')
+            (self.base_path / 'b' / '1.flac').rename(Path(outside) / '1.flac')
+            batch = self._take()
+        self.assertEqual([(DELETE_DIR, 'a', None)], batch.operations)
+        self.assertEqual({'b/1.flac': DELETED}, batch.paths)
+
+    def test_coalesce(self):
+        from kyofu.watch import CHANGED
+
+        path = self.base_path / 'new.flac'
+        path.write_bytes((self.base_path / 'a' / '0.flac').read_bytes())
+        for _ in range(3):
+            with path.open('ab') as f:
+                f.write(b'\0')
+        self.watcher.poll(0.05)
+        self.assertFalse(self.watcher.due(debounce=10, max_delay=10))
+        self.assertTrue(self.watcher.due(debounce=0, max_delay=10))
+        self.assertEqual({'new.flac': CHANGED}, self.watcher.take().paths)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class TestApplyWatchBatch(unittest.TestCase):
+    def setUp(self):
+        from support import bind_session, create_test_engine, write_song
+        from kyofu import current_config
+        from kyofu.model import Library
+        from kyofu.run import SyncOptions, _full_sync
+        from kyofu.watch import Watcher
+
+        current_config['auto_commit'] = True
+        self.session = bind_session(create_test_engine())
+        self.tmp = tempfile.TemporaryDirectory()
+        self.library = Library(name='library', base_path=str(Path(self.tmp.name).resolve()))
+        self.session.add(self.library)
+        self.session.commit()
+        for n in range(6):
+            write_song(self.library.path / f'{"ab"[n % 2]}' / f'{n}.flac', n)
+        self.options = SyncOptions(metadata_cache=False)
+        _full_sync(self.library, options=self.options)
+        self.watcher = Watcher(self.library.path)
+        self.watcher.watch_tree()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.session.rollback()
+        self.tmp.cleanup()
+
+    def _songs(self):
+        from kyofu.model import Song
+
+        return {s.file_path: s.song_id for s in self.session.query(Song)}
+
+    def test_apply(self):
+        from support import write_song
+        from kyofu.run import _apply_watch_batch
+
+        before = self._songs()
+        path = self.library.path
+        (path / 'a' / '0.flac').rename(path / 'b' / '1.flac')
+        (path / 'b').rename(path / 'c')
+        (path / 'a' / '2.flac').unlink()
+        write_song(path / 'd' / '100.flac', 100)
+        for _ in range(3):
+            self.watcher.poll(0.05)
+        _apply_watch_batch(self.library, self.watcher.take(final=True), self.options)
+        self.session.expire_all()
+
+        after = self._songs()
+        self.assertEqual({'a/4.flac', 'c/1.flac', 'c/3.flac', 'c/5.flac', 'd/100.flac'}, set(after))
+        # 0.flac replaced 1.flac and then moved with its directory.
+        self.assertEqual(before['a/0.flac'], after['c/1.flac'])
+        self.assertEqual(before['b/3.flac'], after['c/3.flac'])
+        self.assertEqual(before['a/4.flac'], after['a/4.flac'])
+
+    def test_overflow(self):
+        from kyofu.run import _apply_watch_batch
+        from kyofu.watch import WatchBatch
+
+        (self.library.path / 'a' / '0.flac').unlink()
+        _apply_watch_batch(self.library, WatchBatch(rescan=True), self.options)
+        self.session.expire_all()
+        self.assertNotIn('a/0.flac', self._songs())
+        self.assertEqual(5, len(self._songs()))
+
+    def test_failed_batch(self):
+        from unittest import mock
+        from kyofu.run import _apply_watch_batch_or_rescan
+
+        (self.library.path / 'a' / '0.flac').unlink()
+        for _ in range(3):
+            self.watcher.poll(0.05)
+        with mock.patch('kyofu.run._apply_watch_batch', side_effect=RuntimeError('connection lost')), \
+                self.assertLogs('kyofu', 'ERROR'):
+            _apply_watch_batch_or_rescan(self.library, self.watcher, self.watcher.take(final=True), self.options)
+        self.assertTrue(self.watcher.pending)
+        batch = self.watcher.take(final=True)
+        self.assertTrue(batch.rescan)
+
+        _apply_watch_batch_or_rescan(self.library, self.watcher, batch, self.options)
+        self.session.expire_all()
+        self.assertNotIn('a/0.flac', self._songs())
+        self.assertFalse(self.watcher.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+
+def _square(n: int) -> int:
+    return n * n
+
+
+class TestMapBounded(unittest.TestCase):
+    def test_serial(self):
+        from kyofu.worker import map_bounded
+
+        self.assertEqual([(n, n * n) for n in range(10)], list(map_bounded(_square, range(10))))
+
+    def test_ordered(self):
+        from kyofu.worker import map_bounded
+
+        for executor_type in ('thread', 'process'):
+            result = list(map_bounded(_square, range(50), jobs=3, executor_type=executor_type, buffer_size=4))
+            self.assertEqual([(n, n * n) for n in range(50)], result)
+
+    def test_unordered(self):
+        from kyofu.worker import map_bounded
+
+        result = map_bounded(_square, range(50), jobs=3, executor_type='thread', ordered=False)
+        self.assertEqual([(n, n * n) for n in range(50)], sorted(result))
+
+    def test_bounded(self):
+        from kyofu.worker import map_bounded
+
+        consumed = []
+
+        def producer():
+            for n in range(100):
+                consumed.append(n)
+                yield n
+
+        results = map_bounded(_square, producer(), jobs=2, executor_type='thread', buffer_size=5)
+        next(results)
+        self.assertLessEqual(len(consumed), 5)
+        results.close()
+
+    def test_unknown_executor(self):
+        from kyofu.worker import create_executor
+
+        with self.assertRaises(ValueError):
+            create_executor('fiber', 1)
+
+
+if __name__ == '__main__':
+    unittest.main()